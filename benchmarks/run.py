@@ -0,0 +1,402 @@
+#!/usr/bin/env python
+"""
+Offline benchmarks for djangregator's fetch and timeline paths.
+
+Runs against an in-memory SQLite database, with the recorded feeds in
+fixtures/ served by stand-ins for twitterapi and flickrapi (see stubs/) and by
+a local HTTP server for Delicious. Results are written as JSON, and can be
+compared against an earlier run to spot regressions:
+
+    $ python benchmarks/run.py --output=before.json
+    $ python benchmarks/run.py --compare=before.json
+
+Metrics whose names end in _per_sec are better when higher; all others are
+better when lower.
+"""
+
+import BaseHTTPServer
+import calendar
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime
+from optparse import OptionParser
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, 'stubs'))
+sys.path.insert(1, HERE)
+sys.path.insert(2, os.path.dirname(HERE))
+os.environ['DJANGO_SETTINGS_MODULE'] = 'settings'
+
+from django.core.management import call_command
+from django.db import connection
+from django.contrib.contenttypes.models import ContentType
+from django.template import Context, Template
+from django.utils.html import escape
+from django.utils import simplejson as json
+import django
+import flickrapi
+import twitterapi
+
+from djangregator.models import *
+from djangregator.services import delicious
+from djangregator import timeline
+from djangregator.templatetags.djangregator_filters import twitterize, tweetify
+from djangregator import tweetmarkup
+import djangregator
+
+EPOCH = calendar.timegm((2008, 8, 27, 14, 0, 0))
+PAGE_SIZE = 50
+PAGE_TEMPLATE = Template(
+    '{% for entry in entries %}'
+    '<li class="{{ entry.service }}"><a href="{{ entry.link }}">{{ entry.title }}</a> '
+    '{{ entry.published|date:"r" }}</li>'
+    '{% endfor %}')
+
+##############################################################################
+# Fixture feeds
+##############################################################################
+
+def load_fixture(name):
+    f = open(os.path.join(HERE, 'fixtures', name))
+    try:
+        return f.read()
+    finally:
+        f.close()
+
+
+def tweets(count):
+    """
+    Expands the recorded tweets into a timeline of ``count`` tweets, newest
+    first, one minute apart.
+    """
+    recorded = json.loads(load_fixture('twitter.json'))
+    timeline = []
+    for i in range(count):
+        status = recorded[i % len(recorded)]
+        timeline.append({
+            'id': 10 ** 9 + count - i,
+            'created_at': time.strftime('%a %b %d %H:%M:%S +0000 %Y', time.gmtime(EPOCH - i * 60)),
+            'text': status['text'],
+        })
+    return timeline
+
+
+def bookmarks(count):
+    recorded = json.loads(load_fixture('delicious.json'))
+    feed = []
+    for i in range(count):
+        bookmark = dict(recorded[i % len(recorded)])
+        bookmark['u'] = '%s#%d' % (bookmark['u'], i)
+        bookmark['dt'] = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(EPOCH - i * 60))
+        feed.append(bookmark)
+    return feed
+
+
+def photos(count):
+    from xml.etree import ElementTree
+    recorded = ElementTree.fromstring(load_fixture('flickr.xml')).findall('photos/photo')
+    stream = []
+    for i in range(count):
+        photo = dict(recorded[i % len(recorded)].attrib)
+        timestamp = EPOCH - i * 60
+        photo['id'] = str(3 * 10 ** 9 + count - i)
+        photo['dateupload'] = str(timestamp)
+        photo['datetaken'] = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(timestamp))
+        stream.append(photo)
+    return stream
+
+
+class FeedHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Serves the Delicious feed, honouring If-None-Match.
+    """
+    protocol_version = 'HTTP/1.1'
+    body = '[]'
+    
+    def do_GET(self):
+        etag = '"%x"' % hash(self.body)
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(self.body)))
+        self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(self.body)
+    
+    def log_message(self, *args):
+        pass
+
+
+def serve_feeds():
+    server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), FeedHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.setDaemon(True)
+    thread.start()
+    delicious.FEED_URL = 'http://127.0.0.1:%d/%%s' % server.server_port
+
+
+##############################################################################
+# Benchmarks
+##############################################################################
+
+def reset():
+    call_command('flush', interactive=False, verbosity=0)
+    ContentType.objects.clear_cache()
+
+
+def timed(func, repeat):
+    """
+    Returns the best wall time of ``repeat`` calls to func, in seconds.
+    """
+    best = None
+    for i in range(repeat):
+        started = time.time()
+        func()
+        elapsed = time.time() - started
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def bench_ingest(service, items):
+    reset()
+    persona = OnlinePersona.objects.create(name='benchmark')
+    if service == 'twitter':
+        twitterapi.TIMELINE = tweets(items)
+        TwitterAccount.objects.create(persona=persona, username='benchmark')
+    elif service == 'delicious':
+        FeedHandler.body = json.dumps(bookmarks(items))
+        DeliciousAccount.objects.create(persona=persona, username='benchmark')
+    elif service == 'flickr':
+        flickrapi.PHOTOS = photos(items)
+        FlickrAccount.objects.create(persona=persona, username='benchmark', api_key='benchmark')
+    
+    first = djangregator.fetch(sinks=[]).accounts[0]
+    again = djangregator.fetch(sinks=[]).accounts[0]
+    if first.failed or again.failed:
+        raise RuntimeError('fetching from %s failed: %s' % (service, first.error or again.error))
+    
+    prefix = 'ingest.%s.' % service
+    return {
+        prefix + 'items_per_sec': first.created / first.wall_time,
+        prefix + 'queries_per_item': first.queries / float(max(first.created, 1)),
+        prefix + 'unchanged_ms': again.wall_time * 1000,
+        prefix + 'unchanged_queries': again.queries,
+    }
+
+
+def populate_timeline(persona, start, stop):
+    content_type = ContentType.objects.get_for_model(TwitterStatus)
+    batch = []
+    for i in xrange(start, stop):
+        batch.append(TimelineEntry(
+            content_type=content_type,
+            object_id=i + 1,
+            published=datetime.utcfromtimestamp(EPOCH - i * 60),
+            persona=persona,
+            service=u'twitter',
+            title=u'Timeline entry number %d' % i,
+            link=u'http://twitter.com/benchmark/%d' % (i + 1)))
+        if len(batch) == 100:
+            TimelineEntry.objects.bulk_create(batch)
+            batch = []
+    TimelineEntry.objects.bulk_create(batch)
+
+
+def bench_timeline(sizes, repeat):
+    reset()
+    persona = OnlinePersona.objects.create(name='benchmark')
+    results = {}
+    populated = 0
+    for size in sorted(sizes):
+        populate_timeline(persona, populated, size)
+        populated = size
+        entries = TimelineEntry.objects.filter(persona=persona)
+        
+        def first_page():
+            PAGE_TEMPLATE.render(Context({'entries': entries[:PAGE_SIZE]}))
+        
+        def middle_page():
+            offset = size // 2
+            PAGE_TEMPLATE.render(Context({'entries': entries[offset:offset + PAGE_SIZE]}))
+        
+        middle = entries.order_by('-published', '-id')[size // 2 - 1]
+        cursor = timeline.encode_cursor(middle)
+        def keyset_page():
+            page = timeline.get_page(persona, cursor=cursor, limit=PAGE_SIZE, use_cache=False)
+            PAGE_TEMPLATE.render(Context({'entries': page}))
+        
+        def cached_page():
+            page = timeline.get_page(persona, cursor=cursor, limit=PAGE_SIZE)
+            PAGE_TEMPLATE.render(Context({'entries': page}))
+        
+        prefix = 'timeline.%d.' % size
+        results[prefix + 'first_page_ms'] = timed(first_page, repeat) * 1000
+        results[prefix + 'offset_page_ms'] = timed(middle_page, repeat) * 1000
+        results[prefix + 'keyset_page_ms'] = timed(keyset_page, repeat) * 1000
+        results[prefix + 'cached_page_ms'] = timed(cached_page, repeat) * 1000
+    return results
+
+
+def bench_filters(calls):
+    texts = [status['text'] for status in json.loads(load_fixture('twitter.json'))]
+    results = {}
+    filters = (
+        ('twitterize', lambda text: twitterize(text, autoescape=True)),
+        ('tweetify', lambda text: tweetify(text, autoescape=True)),
+        ('tweetify_uncached', lambda text: tweetmarkup._linkify(text, escape)),
+    )
+    for name, func in filters:
+        started = time.time()
+        for i in xrange(calls):
+            func(texts[i % len(texts)])
+        results['filter.%s.per_sec' % name] = calls / (time.time() - started)
+    return results
+
+
+def query_plan(queryset):
+    """
+    Returns the details of SQLite's query plan for ``queryset``.
+    """
+    sql, params = queryset.query.get_compiler(using=queryset.db).as_sql()
+    cursor = connection.cursor()
+    cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+    return [row[-1] for row in cursor.fetchall()]
+
+
+def check_indexes():
+    """
+    Checks that the lookups djangregator depends on are answered from an
+    index. Returns a list of (name, query plan) pairs for those which scan
+    a whole table or sort in a temporary table.
+    """
+    reset()
+    persona = OnlinePersona.objects.create(name='benchmark')
+    twitter = TwitterAccount.objects.create(persona=persona, username='benchmark')
+    delicious_account = DeliciousAccount.objects.create(persona=persona, username='benchmark')
+    flickr = FlickrAccount.objects.create(persona=persona, username='benchmark', api_key='benchmark')
+    content_type = ContentType.objects.get_for_model(TwitterStatus)
+    
+    queries = {
+        'timeline.persona': TimelineEntry.objects.filter(persona=persona)
+            .order_by('-published', '-id')[:PAGE_SIZE],
+        'timeline.all': TimelineEntry.objects.order_by('-published', '-id')[:PAGE_SIZE],
+        'timeline.object': TimelineEntry.objects.filter(
+            content_type=content_type, object_id__in=[1, 2, 3]).order_by(),
+        'twitter.natural_key': TwitterStatus.objects.filter(twitter_id__in=[1, 2, 3]).order_by(),
+        'twitter.latest': twitter.tweets.order_by('-published')[:1],
+        'delicious.natural_key': delicious_account.links.filter(
+            link__in=[u'http://example.com/'], published=datetime.utcnow()).order_by(),
+        'delicious.latest': delicious_account.links.order_by('-published')[:1],
+        'flickr.natural_key': FlickrPhoto.objects.filter(photo_id__in=[1, 2, 3]).order_by(),
+        'flickr.latest': flickr.photos.order_by('-published')[:1],
+    }
+    unindexed = []
+    for name in sorted(queries):
+        plan = query_plan(queries[name])
+        for detail in plan:
+            if ('SCAN' in detail and 'USING' not in detail) or 'TEMP B-TREE' in detail:
+                unindexed.append((name, plan))
+                break
+    return unindexed
+
+
+##############################################################################
+# Reporting
+##############################################################################
+
+def compare(before, after, threshold):
+    """
+    Prints the change in every metric present in both runs, and returns the
+    names of those which got worse by more than ``threshold``.
+    """
+    regressions = []
+    for name in sorted(after):
+        if name not in before or not before[name]:
+            continue
+        change = (after[name] - before[name]) / float(before[name])
+        if name.endswith('_per_sec'):
+            worse = -change
+        else:
+            worse = change
+        flag = ''
+        if worse > threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print '%-45s %14.3f -> %14.3f  %+7.1f%%%s' % (name, before[name], after[name], change * 100, flag)
+    return regressions
+
+
+def main():
+    parser = OptionParser(usage="usage: %prog [options]")
+    parser.add_option("--items", type="int", default=2000,
+        help="Items per service in the ingest benchmarks [default: %default]")
+    parser.add_option("--sizes", default="10000,100000",
+        help="Comma-separated timeline sizes to render pages from [default: %default]")
+    parser.add_option("--calls", type="int", default=20000,
+        help="Calls per filter in the filter benchmarks [default: %default]")
+    parser.add_option("--repeat", type="int", default=5,
+        help="Repetitions of each timed operation; the best is kept [default: %default]")
+    parser.add_option("--output", metavar="FILE",
+        help="Write the results to this file as JSON")
+    parser.add_option("--compare", metavar="FILE",
+        help="Compare the results with an earlier run, exiting with status 1 on regressions")
+    parser.add_option("--threshold", type="float", default=0.10,
+        help="Relative change counted as a regression [default: %default]")
+    (options, args) = parser.parse_args()
+    
+    logging.basicConfig(level=logging.WARNING)
+    call_command('syncdb', interactive=False, verbosity=0)
+    serve_feeds()
+    
+    unindexed = check_indexes()
+    for name, plan in unindexed:
+        print 'UNINDEXED %s: %s' % (name, '; '.join(plan))
+    
+    results = {'explain.unindexed_queries': len(unindexed)}
+    for service in ('twitter', 'delicious', 'flickr'):
+        results.update(bench_ingest(service, options.items))
+    results.update(bench_timeline([int(size) for size in options.sizes.split(',')], options.repeat))
+    results.update(bench_filters(options.calls))
+    
+    report = {
+        'meta': {
+            'date': datetime.utcnow().isoformat(),
+            'python': sys.version.split()[0],
+            'django': django.get_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'options': options.__dict__,
+        },
+        'results': results,
+    }
+    if options.output:
+        f = open(options.output, 'w')
+        try:
+            json.dump(report, f, indent=2, sort_keys=True)
+        finally:
+            f.close()
+    
+    if options.compare:
+        f = open(options.compare)
+        try:
+            before = json.load(f)['results']
+        finally:
+            f.close()
+        if compare(before, results, options.threshold):
+            sys.exit(1)
+    elif not options.output:
+        print json.dumps(report, indent=2, sort_keys=True)
+    if unindexed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+"""
+Django settings for the benchmark suite: an in-memory SQLite database and
+just enough installed apps for djangregator.
+"""
+
+DEBUG = False
+TEMPLATE_DEBUG = False
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': ':memory:',
+    }
+}
+
+INSTALLED_APPS = (
+    'django.contrib.contenttypes',
+    'djangregator',
+)
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+SECRET_KEY = 'djangregator-benchmarks'
+USE_TZ = False
+
+# walk every page of the fixture feeds
+DJANGREGATOR_PAGING = {
+    'twitter': {'max_pages': None},
+    'flickr': {'max_pages': None},
+}
+
+# The stand-in services have no rate limits.
+DJANGREGATOR_RATE_LIMITS = {
+    'twitter': {'requests_per_hour': 10 ** 9},
+    'flickr': {'requests_per_hour': 10 ** 9},
+    'delicious': {'requests_per_hour': 10 ** 9},
+}
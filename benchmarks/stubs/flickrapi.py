@@ -0,0 +1,41 @@
+"""
+A stand-in for the flickrapi module which serves a photostream from memory
+as ElementTree responses. The benchmark runner fills in PHOTOS, newest
+first, as dictionaries of <photo> attributes.
+"""
+
+try:
+    from xml.etree import cElementTree as ElementTree
+except ImportError:
+    from xml.etree import ElementTree
+
+PHOTOS = []
+NSID = '12345678@N00'
+
+
+def _photos(photos, per_page, page):
+    per_page = int(per_page)
+    pages = max(1, (len(photos) + per_page - 1) // per_page)
+    rsp = ElementTree.Element('rsp', stat='ok')
+    element = ElementTree.SubElement(rsp, 'photos', page=str(page),
+        pages=str(pages), perpage=str(per_page), total=str(len(photos)))
+    for photo in photos[(page - 1) * per_page:page * per_page]:
+        ElementTree.SubElement(element, 'photo', **photo)
+    return rsp
+
+
+class FlickrAPI(object):
+    def __init__(self, api_key, secret=None, format='etree'):
+        self.api_key = api_key
+    
+    def people_findByUsername(self, username):
+        rsp = ElementTree.Element('rsp', stat='ok')
+        ElementTree.SubElement(rsp, 'user', id=NSID, nsid=NSID)
+        return rsp
+    
+    def people_getPublicPhotos(self, user_id, per_page=100, page=1, extras=''):
+        return _photos(PHOTOS, per_page, page)
+    
+    def photos_search(self, user_id, per_page=100, page=1, min_upload_date=0, extras=''):
+        photos = [p for p in PHOTOS if int(p['dateupload']) >= int(min_upload_date)]
+        return _photos(photos, per_page, page)
@@ -0,0 +1,27 @@
+"""
+A stand-in for python-twitter's twitterapi module which serves a timeline
+from memory. The benchmark runner fills in TIMELINE, newest first.
+"""
+
+TIMELINE = []
+
+
+class Status(object):
+    def __init__(self, id, created_at, text):
+        self.id = id
+        self.created_at = created_at
+        self.text = text
+
+
+class Api(object):
+    def GetUserTimeline(self, user=None, count=20, since_id=None, max_id=None):
+        statuses = []
+        for status in TIMELINE:
+            if max_id and status['id'] > max_id:
+                continue
+            if since_id and status['id'] <= since_id:
+                break
+            statuses.append(Status(status['id'], status['created_at'], status['text']))
+            if len(statuses) == count:
+                break
+        return statuses
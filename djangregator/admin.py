@@ -28,41 +28,395 @@
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 
+from django.conf import settings
 from django.contrib import admin
-from django.contrib.contenttypes import generic
+from django.contrib.admin import actions
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin import helpers
+from django.contrib.admin.views.main import ChangeList
+from django.contrib.contenttypes.models import ContentType
+from django.core.paginator import Paginator, Page, InvalidPage, EmptyPage, PageNotAnInteger
+from django.db import connections
+from django.db.models import Min, Max
+from django.template.response import TemplateResponse
+from django.utils import timezone
 from djangregator.models import *
+from djangregator.signals import timeline_updated
+from djangregator import registry, maintenance
+from datetime import datetime
+import logging
+import threading
 
-class TimelineEntryAdmin(admin.ModelAdmin):
-    list_display = ('published', 'content_type')
-    date_hierarchy = 'published'
-    list_filter = ('content_type',)
+##############################################################################
+# Large tables
+##############################################################################
+
+def estimated_count(queryset):
+    """
+    Returns the number of rows in the table of ``queryset``'s model as
+    estimated by the database's statistics, or None on databases which
+    don't keep any (or haven't gathered them yet).
+    """
+    connection = connections[queryset.db]
+    table = queryset.model._meta.db_table
+    if connection.vendor == 'postgresql':
+        sql = "SELECT reltuples FROM pg_class WHERE relname = %s"
+    elif connection.vendor == 'mysql':
+        sql = "SELECT table_rows FROM information_schema.tables " \
+              "WHERE table_schema = DATABASE() AND table_name = %s"
+    else:
+        return None
+    cursor = connection.cursor()
+    cursor.execute(sql, [table])
+    row = cursor.fetchone()
+    if not row or not row[0] or row[0] < 0:
+        return None
+    return int(row[0])
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    A paginator which never counts a whole table. An unfiltered list of a
+    large table is counted from the database's statistics; any other list
+    is counted only up to ``limit`` rows.
+    
+    Such a count is only an estimate, for display: pages past it are still
+    served, and the count grows to take in the pages fetched, so that there
+    is always a next page while there are more rows.
+    """
+    limit = 10000
+    exact = True
+    
+    def _get_count(self):
+        if self._count is None:
+            queryset = self.object_list
+            count = None
+            if not queryset.query.where:
+                count = estimated_count(queryset)
+            if count is None or count < self.limit:
+                count = len(queryset.order_by().values_list('pk', flat=True)[:self.limit])
+            self.exact = count < self.limit
+            self._count = count
+        return self._count
+    count = property(_get_count)
+    
+    def validate_number(self, number):
+        if self.count and self.exact:
+            return super(EstimatedCountPaginator, self).validate_number(number)
+        try:
+            number = int(number)
+        except ValueError:
+            raise PageNotAnInteger('That page number is not an integer')
+        if number < 1:
+            raise EmptyPage('That page number is less than 1')
+        return number
     
-class ActivityEntryAdmin(admin.ModelAdmin):
-    date_hierarchy = 'published'
+    def page(self, number):
+        number = self.validate_number(number)
+        if self.count and self.exact:
+            return super(EstimatedCountPaginator, self).page(number)
+        bottom = (number - 1) * self.per_page
+        # one row more than fits, to tell whether there is a next page
+        rows = list(self.object_list[bottom:bottom + self.per_page + 1])
+        if not rows and number > 1:
+            raise EmptyPage('That page contains no results')
+        if bottom + len(rows) > self._count:
+            self._count = bottom + len(rows)
+            self._num_pages = None
+        return Page(rows[:self.per_page], number, self)
+
+
+class LargeTableChangeList(ChangeList):
+    """
+    A change list which takes the total number of objects from
+    EstimatedCountPaginator, instead of counting the whole table whenever
+    the list is filtered.
+    """
+    def get_results(self, request):
+        paginator = self.model_admin.get_paginator(request, self.query_set, self.list_per_page)
+        result_count = paginator.count
+        if not self.query_set.query.where:
+            full_result_count = result_count
+        else:
+            full_result_count = self.model_admin.get_paginator(
+                request, self.root_query_set, self.list_per_page).count
+        
+        can_show_all = result_count <= self.list_max_show_all
+        multi_page = result_count > self.list_per_page
+        if (self.show_all and can_show_all) or not multi_page:
+            result_list = self.query_set._clone()
+        else:
+            try:
+                result_list = paginator.page(self.page_num + 1).object_list
+            except InvalidPage:
+                raise IncorrectLookupParameters
+        
+        self.result_count = result_count
+        self.full_result_count = full_result_count
+        self.result_list = result_list
+        self.can_show_all = can_show_all
+        self.multi_page = multi_page
+        self.paginator = paginator
+
+
+class PublishedFilter(admin.SimpleListFilter):
+    """
+    Drills down by year, then month, of publication. Unlike date_hierarchy,
+    which scans the table for the distinct dates, the years on offer come
+    from the index on published, and each choice filters on a range of it.
+    """
+    title = 'published'
+    parameter_name = 'published'
+    
+    def _range(self):
+        try:
+            parts = [int(part) for part in self.value().split('-')]
+            if len(parts) == 1:
+                start, end = datetime(parts[0], 1, 1), datetime(parts[0] + 1, 1, 1)
+            else:
+                year, month = parts
+                start = datetime(year, month, 1)
+                end = month == 12 and datetime(year + 1, 1, 1) or datetime(year, month + 1, 1)
+        except (AttributeError, ValueError):
+            return None
+        if settings.USE_TZ:
+            tz = timezone.get_current_timezone()
+            start, end = timezone.make_aware(start, tz), timezone.make_aware(end, tz)
+        return (start, end)
+    
+    def lookups(self, request, model_admin):
+        bounds = model_admin.model._default_manager.aggregate(
+            first=Min('published'), last=Max('published'))
+        if bounds['first'] is None:
+            return ()
+        choices = []
+        selected = self._range()
+        for year in range(bounds['last'].year, bounds['first'].year - 1, -1):
+            choices.append((str(year), str(year)))
+            if selected and selected[0].year == year:
+                for month in range(12, 0, -1):
+                    start = datetime(year, month, 1)
+                    choices.append(('%d-%02d' % (year, month), start.strftime('- %B')))
+        return choices
+    
+    def queryset(self, request, queryset):
+        selected = self._range()
+        if selected is None:
+            return queryset
+        return queryset.filter(published__gte=selected[0], published__lt=selected[1])
+
+
+class ServiceFilter(admin.SimpleListFilter):
+    """
+    Filters timeline entries by service, taking the choices from the
+    registry rather than from the table.
+    """
+    title = 'service'
+    parameter_name = 'service'
+    
+    def lookups(self, request, model_admin):
+        return [(service.name, service.name) for service in registry.services()]
+    
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(service=self.value())
+        return queryset
+
+
+def delete_selected(modeladmin, request, queryset):
+    """
+    Django's delete_selected action, which also expires the cached
+    timelines of the personas whose entries were deleted, with one
+    timeline_updated signal for the lot.
+    """
+    personas = None
+    if request.POST.get('post'):
+        personas = modeladmin.timeline_personas(queryset)
+    response = actions.delete_selected(modeladmin, request, queryset)
+    if personas:
+        timeline_updated.send(sender=modeladmin.model, personas=personas)
+    return response
+delete_selected.short_description = actions.delete_selected.short_description
+
+
+class TimelineAdmin(admin.ModelAdmin):
+    """
+    Admin options for models whose rows are (or have) timeline entries, so
+    that deleting them expires the cached timelines they were on.
+    ``persona_field`` is the lookup of the persona id from the model.
+    """
+    persona_field = 'persona'
+    actions = [delete_selected]
+    
+    def timeline_personas(self, queryset):
+        return list(queryset.order_by().values_list(self.persona_field, flat=True).distinct())
+    
+    def delete_model(self, request, obj):
+        personas = self.timeline_personas(self.model._default_manager.filter(pk=obj.pk))
+        super(TimelineAdmin, self).delete_model(request, obj)
+        timeline_updated.send(sender=self.model, personas=personas)
+
+
+class LargeTableAdmin(TimelineAdmin):
+    """
+    Admin options for tables which grow without bound.
+    """
+    paginator = EstimatedCountPaginator
+    
+    def get_changelist(self, request, **kwargs):
+        return LargeTableChangeList
+
+
+##############################################################################
+# Djangregator models
+##############################################################################
+
+class TimelineEntryAdmin(LargeTableAdmin):
+    list_display = ('published', 'service', 'title', 'persona')
+    list_filter = (PublishedFilter, ServiceFilter)
+    
+    def queryset(self, request):
+        return super(TimelineEntryAdmin, self).queryset(request).select_related('content_type', 'persona')
+    
+class ActivityEntryAdmin(LargeTableAdmin):
+    persona_field = 'account__persona'
+    list_display = ('published', 'title', 'account')
+    list_filter = (PublishedFilter,)
+    list_select_related = True
 
 class GenericServiceAccountAdmin(admin.StackedInline):
     extra = 1
 
-class TwitterAccountAdmin(GenericServiceAccountAdmin):
-    model = TwitterAccount
+def in_background(func, *args):
+    """
+    Calls ``func(*args)`` on a thread of its own, and returns the thread.
+    """
+    thread = threading.Thread(target=func, args=args, name="djangregator-admin-fetch")
+    thread.setDaemon(True)
+    thread.start()
+    return thread
 
-class DeliciousAccountAdmin(GenericServiceAccountAdmin):
-    model = DeliciousAccount
 
-class FlickrAccountAdmin(GenericServiceAccountAdmin):
-    model = FlickrAccount
+def fetch_summary(result, selected):
+    """
+    Describes the FetchResult of fetching ``selected`` accounts.
+    """
+    message = "Fetched %d new items from %d accounts." % (result.created, selected)
+    if result.failed:
+        message += " %d failed." % result.failed
+    if result.deferred:
+        message += " %d were deferred, as their service is throttling or failing;" \
+            " try them again later." % result.deferred
+    skipped = selected - len(result.accounts)
+    if skipped:
+        message += " %d were skipped, as another fetch process holds their lease." % skipped
+    return message
+
+
+# Summaries of the fetches queued from the admin which have finished, as
+# (account model, message) pairs, waiting to be shown to the next user to
+# open the account list.
+_fetched = []
+_fetched_lock = threading.Lock()
+
+
+class ServiceAccountAdmin(admin.ModelAdmin):
+    list_display = ('username', 'persona', 'active')
+    list_filter = ('active',)
+    list_select_related = True
+    actions = ['refetch', 'deactivate', 'purge']
+    
+    def changelist_view(self, request, extra_context=None):
+        _fetched_lock.acquire()
+        try:
+            messages = [message for (model, message) in _fetched if model is self.model]
+            _fetched[:] = [(model, message) for (model, message) in _fetched if model is not self.model]
+        finally:
+            _fetched_lock.release()
+        for message in messages:
+            self.message_user(request, message)
+        return super(ServiceAccountAdmin, self).changelist_view(request, extra_context)
+    
+    def fetch(self, accounts):
+        """
+        Fetches ``accounts``, and queues the summary for the account list.
+        """
+        from djangregator.fetch import fetch_accounts, close_connection
+        timeout = getattr(settings, 'DJANGREGATOR_ADMIN_FETCH_TIMEOUT', 60)
+        workers = getattr(settings, 'DJANGREGATOR_ADMIN_FETCH_WORKERS', 4)
+        try:
+            # Leasing the accounts for as long as a fetch may take keeps
+            # them from being fetched by two processes at once.
+            result = fetch_accounts(accounts, workers=min(workers, len(accounts)),
+                timeout=timeout, lease=timeout)
+            message = fetch_summary(result, len(accounts))
+        except:
+            logging.getLogger("Fetch").exception("Unable to fetch the accounts selected in the admin")
+            message = "Unable to fetch the %d selected accounts; see the log." % len(accounts)
+        finally:
+            close_connection()
+        _fetched_lock.acquire()
+        try:
+            _fetched.append((self.model, message))
+        finally:
+            _fetched_lock.release()
+    
+    def refetch(self, request, queryset):
+        accounts = list(queryset.select_related('persona'))
+        in_background(self.fetch, accounts)
+        self.message_user(request, "Fetching %d accounts in the background;"
+            " reload the list to see how it went." % len(accounts))
+    refetch.short_description = "Fetch new activity for the selected accounts now"
+    
+    def deactivate(self, request, queryset):
+        count = queryset.update(active=False)
+        self.message_user(request, "Deactivated %d accounts." % count)
+    deactivate.short_description = "Deactivate the selected accounts"
+    
+    def purge(self, request, queryset):
+        service = registry.get(self.model.service)
+        accounts = list(queryset.values_list('pk', flat=True))
+        activity = service.activity_model.objects.filter(account__in=accounts)
+        if not request.POST.get('post'):
+            opts = self.model._meta
+            return TemplateResponse(request, 'admin/djangregator/purge_selected_confirmation.html', {
+                'title': "Are you sure?",
+                'objects_name': len(accounts) == 1 and opts.verbose_name or opts.verbose_name_plural,
+                'queryset': queryset,
+                'items': activity.count(),
+                'opts': opts,
+                'app_label': opts.app_label,
+                'action_checkbox_name': helpers.ACTION_CHECKBOX_NAME,
+            }, current_app=self.admin_site.name)
+        # Deactivated first, so that no fetch starts over with the full
+        # history of an account while it is being purged; the sync state
+        # goes too, so reactivating it does exactly that.
+        queryset.update(active=False)
+        deleted = maintenance.delete_entries(activity)
+        SyncState.objects.filter(content_type=ContentType.objects.get_for_model(self.model),
+            object_id__in=accounts).delete()
+        self.message_user(request, "Purged %d items and their timeline entries from %d accounts,"
+            " and deactivated them." % (deleted, len(accounts)))
+    purge.short_description = "Purge the fetched activity and timeline entries of the selected accounts"
+
+def account_inlines():
+    """
+    Builds an inline admin for the account model of each registered service.
+    """
+    inlines = []
+    for service in registry.services():
+        model = service.account_model
+        inlines.append(type('%sAdmin' % model.__name__,
+            (GenericServiceAccountAdmin,), {'model': model}))
+    return tuple(inlines)
 
 class OnlinePersonaAdmin(admin.ModelAdmin):
-    inlines = (
-        TwitterAccountAdmin,
-        DeliciousAccountAdmin,
-        FlickrAccountAdmin
-    )
+    inlines = account_inlines()
 
 admin.site.register(TimelineEntry, TimelineEntryAdmin)
 admin.site.register(OnlinePersona, OnlinePersonaAdmin)
 
 # Service-specific models
-admin.site.register(TwitterStatus, ActivityEntryAdmin)
-admin.site.register(DeliciousLink, ActivityEntryAdmin)
-admin.site.register(FlickrPhoto, ActivityEntryAdmin)
\ No newline at end of file
+for service in registry.services():
+    admin.site.register(service.activity_model, ActivityEntryAdmin)
+    admin.site.register(service.account_model, ServiceAccountAdmin)
@@ -0,0 +1,79 @@
+# Copyright (c) 2008, Idan Gazit
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#     * Neither the name of the author nor the names of other
+#       contributors may be used to endorse or promote products derived
+#       from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Shared API clients.
+
+Building an API client for every account on every fetch throws away
+whatever the client keeps between requests. A ClientPool instead hands out
+one client per API key, created the first time the key is asked for and
+shared from then on by every account (and every fetch worker) using that key.
+Clients kept in a pool must therefore be safe to use from several threads.
+"""
+
+import threading
+
+class ClientPool(object):
+    """
+    Hands out one client per key. ``factory`` is called with a key to build
+    the client for it.
+    """
+    def __init__(self, factory):
+        self.factory = factory
+        self._clients = {}
+        self._lock = threading.Lock()
+    
+    def get(self, key=None):
+        try:
+            return self._clients[key]
+        except KeyError:
+            pass
+        self._lock.acquire()
+        try:
+            client = self._clients.get(key)
+            if client is None:
+                client = self._clients[key] = self.factory(key)
+            return client
+        finally:
+            self._lock.release()
+    
+    def clear(self):
+        """
+        Discards every client, so that the next get() of each key builds a
+        new one.
+        """
+        self._lock.acquire()
+        try:
+            self._clients = {}
+        finally:
+            self._lock.release()
+    
+    def __len__(self):
+        return len(self._clients)
@@ -0,0 +1,281 @@
+# Copyright (c) 2008, Idan Gazit
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#     * Neither the name of the author nor the names of other
+#       contributors may be used to endorse or promote products derived
+#       from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Syndication feeds of the aggregated timeline, as Atom, RSS 2.0 or JSON Feed.
+
+Feeds are written by generators which walk the timeline a page at a time
+(resolving each page's service objects in bulk), so a feed of any length is
+produced in constant memory. The views in this module serve them with
+ETag/Last-Modified validators taken from the newest entry, and keep the
+output of each feed cached until a fetch changes the persona's timeline.
+Feeds carry their own absolute URLs, so each host and scheme a feed is
+served under is cached separately.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, Http404
+from django.shortcuts import get_object_or_404
+from django.utils import simplejson as json
+from django.utils.feedgenerator import rfc2822_date, rfc3339_date
+from django.views.decorators.http import condition
+from djangregator.models import OnlinePersona, TimelineEntry, resolve_content_objects
+from djangregator import timeline
+from xml.sax.saxutils import escape, quoteattr
+from datetime import datetime
+import calendar
+import hashlib
+
+BATCH_SIZE = 200
+DEFAULT_LIMIT = 50
+MAX_CACHED_SIZE = 1024 * 1024
+
+
+def iter_entries(persona=None, services=None, limit=None, batch_size=BATCH_SIZE):
+    """
+    Yields up to ``limit`` timeline entries (or all of them), newest first,
+    with their content_object resolved. Only ``batch_size`` entries are held
+    in memory at a time.
+    """
+    cursor = None
+    remaining = limit
+    while remaining is None or remaining > 0:
+        size = batch_size
+        if remaining is not None:
+            size = min(size, remaining)
+            remaining -= size
+        page = timeline.get_page(persona, services, cursor, size, use_cache=False)
+        for entry in resolve_content_objects(page.entries):
+            yield entry
+        # a cursor which doesn't move would return the same page forever
+        if not page.has_next or page.next_cursor == cursor:
+            break
+        cursor = page.next_cursor
+
+
+def _summary(entry):
+    if entry.content_object is not None:
+        return entry.content_object.summary()
+    return entry.title or u''
+
+
+def _entry_id(entry):
+    return entry.link or u'tag:djangregator,%s:%d' % (entry.service, entry.object_id)
+
+
+def atom(entries, title, link, feed_url, updated):
+    yield u'<?xml version="1.0" encoding="utf-8"?>\n'
+    yield u'<feed xmlns="http://www.w3.org/2005/Atom">'
+    yield u'<title>%s</title>' % escape(title)
+    yield u'<link href=%s rel="alternate"/>' % quoteattr(link)
+    yield u'<link href=%s rel="self"/>' % quoteattr(feed_url)
+    yield u'<id>%s</id>' % escape(feed_url)
+    yield u'<updated>%s</updated>' % rfc3339_date(updated)
+    for entry in entries:
+        yield (u'<entry><title>%s</title><link href=%s rel="alternate"/>'
+               u'<id>%s</id><updated>%s</updated><category term=%s/>'
+               u'<summary>%s</summary></entry>') % (
+            escape(entry.title or u''),
+            quoteattr(entry.link or u''),
+            escape(_entry_id(entry)),
+            rfc3339_date(entry.published),
+            quoteattr(entry.service),
+            escape(_summary(entry)))
+    yield u'</feed>\n'
+
+
+def rss(entries, title, link, feed_url, updated):
+    yield u'<?xml version="1.0" encoding="utf-8"?>\n'
+    yield u'<rss version="2.0"><channel>'
+    yield u'<title>%s</title>' % escape(title)
+    yield u'<link>%s</link>' % escape(link)
+    yield u'<description>%s</description>' % escape(title)
+    yield u'<lastBuildDate>%s</lastBuildDate>' % rfc2822_date(updated)
+    for entry in entries:
+        yield (u'<item><title>%s</title><link>%s</link><guid>%s</guid>'
+               u'<pubDate>%s</pubDate><category>%s</category>'
+               u'<description>%s</description></item>') % (
+            escape(entry.title or u''),
+            escape(entry.link or u''),
+            escape(_entry_id(entry)),
+            rfc2822_date(entry.published),
+            escape(entry.service),
+            escape(_summary(entry)))
+    yield u'</channel></rss>\n'
+
+
+def json_feed(entries, title, link, feed_url, updated):
+    header = json.dumps({
+        'version': 'https://jsonfeed.org/version/1',
+        'title': title,
+        'home_page_url': link,
+        'feed_url': feed_url,
+    })
+    # open the items list inside the header object
+    yield header[:-1] + u', "items": ['
+    separator = u''
+    for entry in entries:
+        item = {
+            'id': _entry_id(entry),
+            'url': entry.link,
+            'title': entry.title,
+            'content_text': _summary(entry),
+            'date_published': rfc3339_date(entry.published),
+            'tags': [entry.service],
+        }
+        if entry.thumbnail:
+            item['image'] = entry.thumbnail
+        yield separator + json.dumps(item)
+        separator = u', '
+    yield u']}\n'
+
+
+FORMATS = {
+    'atom': (atom, 'application/atom+xml; charset=utf-8'),
+    'rss': (rss, 'application/rss+xml; charset=utf-8'),
+    'json': (json_feed, 'application/json; charset=utf-8'),
+}
+
+
+def generate(format, persona=None, services=None, limit=None, title=None, link=u'', feed_url=u'',
+        updated=None):
+    """
+    Returns a generator of unicode chunks making up a feed in the given
+    format ('atom', 'rss' or 'json'). ``updated`` is the time the feed was
+    last updated, by default that of its newest entry.
+    """
+    try:
+        writer = FORMATS[format][0]
+    except KeyError:
+        raise ValueError("Unknown feed format: %s" % format)
+    if title is None:
+        title = persona is not None and u'%s lifestream' % persona or u'Lifestream'
+    if updated is None:
+        newest = _newest(persona, services)
+        updated = newest is not None and newest.published or datetime.now()
+    return writer(iter_entries(persona, services, limit), title, link, feed_url, updated)
+
+
+##############################################################################
+# Views
+##############################################################################
+
+def _newest(persona, services=None):
+    entries = TimelineEntry.objects.order_by('-published', '-id')
+    if persona is not None:
+        entries = entries.filter(persona=persona)
+    if services:
+        entries = entries.filter(service__in=services)
+    try:
+        return entries.only('id', 'published')[0]
+    except IndexError:
+        return None
+
+
+def _persona(persona_id):
+    if persona_id is None:
+        return None
+    return get_object_or_404(OnlinePersona, pk=persona_id)
+
+
+def _request_newest(request, persona_id):
+    """
+    Returns the newest entry of the requested timeline, which the
+    validators and the feed itself all need, looking it up once per
+    request.
+    """
+    if not hasattr(request, '_djangregator_newest'):
+        request._djangregator_newest = _newest(persona_id)
+    return request._djangregator_newest
+
+
+def _limit():
+    return getattr(settings, 'DJANGREGATOR_FEED_LIMIT', DEFAULT_LIMIT)
+
+
+def _etag(request, format, persona_id=None):
+    # The newest entry alone misses edits and deletions further down the
+    # feed, which the timeline's generation catches.
+    newest = _request_newest(request, persona_id)
+    if newest is None:
+        return None
+    return '%s-%s-%s-%d-%s-%d' % (format, persona_id or 'all',
+        calendar.timegm(newest.published.timetuple()), newest.pk,
+        timeline.generation(persona_id), _limit())
+
+
+def _last_modified(request, format, persona_id=None):
+    newest = _request_newest(request, persona_id)
+    return newest and newest.published or None
+
+
+def _cached(chunks, key):
+    """
+    Passes the chunks through, storing the whole feed in the cache once it
+    has been generated, unless it grew too large.
+    """
+    parts = []
+    size = 0
+    for chunk in chunks:
+        chunk = chunk.encode('utf-8')
+        if parts is not None:
+            parts.append(chunk)
+            size += len(chunk)
+            if size > MAX_CACHED_SIZE:
+                parts = None
+        yield chunk
+    if parts is not None:
+        cache.set(key, ''.join(parts), getattr(settings, 'DJANGREGATOR_TIMELINE_CACHE_TIMEOUT', 3600))
+
+
+@condition(etag_func=_etag, last_modified_func=_last_modified)
+def feed(request, format, persona_id=None):
+    """
+    Serves the timeline of a persona (or of everyone) as a feed. The number
+    of entries is set by the DJANGREGATOR_FEED_LIMIT setting.
+    """
+    if format not in FORMATS:
+        raise Http404
+    persona = _persona(persona_id)
+    limit = _limit()
+    content_type = FORMATS[format][1]
+    
+    feed_url = request.build_absolute_uri()
+    key = 'djangregator:feed:%s:%s:%s:%d:%s' % (format, persona_id or 'all',
+        timeline.generation(persona_id), limit, hashlib.md5(feed_url.encode('utf-8')).hexdigest())
+    body = cache.get(key)
+    if body is None:
+        newest = _request_newest(request, persona_id)
+        updated = newest is not None and newest.published or datetime.now()
+        chunks = generate(format, persona, limit=limit, link=request.build_absolute_uri('/'),
+            feed_url=feed_url, updated=updated)
+        body = _cached(chunks, key)
+    return HttpResponse(body, content_type=content_type)
@@ -29,65 +29,398 @@
 
 
 from djangregator.models import *
+from djangregator import registry, metrics, maintenance, ratelimit, retention
+from djangregator.sharding import in_shard, LeaseQueue
+from django.conf import settings
+from Queue import Queue, Empty
+import threading
 import logging
 import sys
 
-def fetch():
+class FetchTimeout(Exception):
+    """
+    Raised when a backend fails to finish fetching an account within the
+    allotted wall-clock time.
+    """
+    pass
+
+
+def close_connection():
+    """
+    Django hands each thread its own database connection; worker threads
+    must close theirs when they are done with it.
+    """
+    from django.db import connection
+    connection.close()
+
+
+def _call_backend(backend, account, stats):
+    """
+    Calls the backend's fetch callable for the given account, with ``stats``
+    active for the current thread and the queries it makes counted. Timeline
+    writes are deferred until the backend returns.
+    """
+    from django.db import connection
+    metrics.activate(stats)
+    use_debug_cursor = connection.use_debug_cursor
+    connection.use_debug_cursor = True
+    start = len(connection.queries)
+    try:
+        with maintenance.deferred():
+            return backend(account)
+    finally:
+        stats.queries += len(connection.queries) - start
+        if not settings.DEBUG:
+            del connection.queries[start:]
+        connection.use_debug_cursor = use_debug_cursor
+        metrics.deactivate()
+
+
+def _run_backend(backend, account, stats, timeout=None):
+    """
+    Calls the backend's fetch callable for the given account. When a timeout
+    (in seconds) is given, the backend runs in a separate daemon thread which
+    is abandoned if it does not finish in time.
+    
+    The thread measures into its own AccountMetrics, which is only added to
+    ``stats`` once the thread has finished in time; an abandoned thread may
+    run on, but never touches metrics which have been reported.
+    """
+    if not timeout:
+        return _call_backend(backend, account, stats)
+    
+    outcome = {}
+    thread_stats = metrics.AccountMetrics(account)
+    def target():
+        try:
+            try:
+                outcome['result'] = _call_backend(backend, account, thread_stats)
+            except:
+                outcome['error'] = sys.exc_info()
+        finally:
+            close_connection()
+    
+    thread = threading.Thread(target=target,
+        name="djangregator-%s-%s" % (account.service, account.pk))
+    thread.setDaemon(True)
+    thread.start()
+    thread.join(timeout)
+    if thread.isAlive():
+        raise FetchTimeout("no response after %s seconds" % timeout)
+    stats.add(thread_stats)
+    if 'error' in outcome:
+        exc_type, exc_value, exc_tb = outcome['error']
+        raise exc_type, exc_value, exc_tb
+    return outcome['result']
+
+
+def load_backends():
+    """
+    Imports the backend of every registered service up-front, so that the
+    backends and the API libraries they import are loaded once, before any
+    worker thread starts, rather than by the first account of each service.
+    """
+    logger = logging.getLogger("Fetch")
+    for service in registry.services():
+        try:
+            service.fetch
+        except ImportError, e:
+            logger.warn("Unable to load a backend for fetching from %s: %s" % (service.name, e))
+
+
+def apply_retention(accounts):
+    """
+    Applies the retention policies to the accounts which were just fetched,
+    when the DJANGREGATOR_RETENTION_AFTER_FETCH setting is on. Errors are
+    logged and otherwise ignored.
+    """
+    if not accounts or not getattr(settings, 'DJANGREGATOR_RETENTION_AFTER_FETCH', False):
+        return
+    try:
+        retention.apply_policy(accounts=accounts)
+    except:
+        logging.getLogger("Fetch").exception("Unable to apply the retention policies")
+
+
+def fetch_account(account, persona=None, timeout=None):
+    """
+    Fetches new activity for a single account. Any error raised by the
+    backend is logged and contained here, so that one misbehaving account
+    never affects the others.
+    
+    The account is deferred rather than fetched while its service's circuit
+    breaker is open, and deferred rather than failed when the service keeps
+    rate limiting it. Only timeouts and errors which say the service itself
+    is in trouble count against the breaker; any other answer from the
+    service resets it.
+    
+    Returns the AccountMetrics of the fetch.
+    """
+    logger = logging.getLogger("Fetch")
+    logger.info("Fetching activity from %s account \"%s\"" % (account.service, account))
+    stats = metrics.AccountMetrics(account, persona)
+    
+    try:
+        backend = registry.get(account.service).fetch
+    except (KeyError, ImportError):
+        logger.error("Unable to load a backend for fetching from %s. Skipping..." % account.service)
+        stats.fail("no backend for %s" % account.service)
+        stats.finish()
+        return stats
+    
+    breaker = ratelimit.breaker(account.service)
+    if not breaker.allow():
+        logger.warn('Deferring %s account "%s": %s is failing, retrying in %d seconds.' %
+            (account.service, account, account.service, breaker.retry_after()))
+        stats.defer("%s is failing" % account.service)
+        stats.finish()
+        return stats
+    
+    try:
+        (created, existing) = _run_backend(backend, account, stats, timeout)
+        logger.info('%s: fetched %d new, skipped %d existing' % (account.service, created, existing))
+        stats.created = created
+        stats.existing = existing
+        breaker.success()
+    except:
+        exc_type, exc_value = sys.exc_info()[:2]
+        if isinstance(exc_value, FetchTimeout) or ratelimit.is_service_failure(exc_value):
+            breaker.failure()
+        else:
+            breaker.success()
+        if isinstance(exc_value, ratelimit.RateLimited):
+            logger.warn('Deferring %s account "%s": %s' % (account.service, account, exc_value))
+            stats.defer(str(exc_value))
+        else:
+            logger.exception('Failed to fetch activity from %s account "%s": %s: "%s"' % 
+            (account.service,
+            account,
+            exc_type.__name__,
+            exc_value if exc_value else "no additional information"))
+            stats.fail("%s: %s" % (exc_type.__name__, exc_value))
+    stats.finish()
+    return stats
+
+
+def execute(jobs, workers=1, timeout=None, claim=None):
+    """
+    Runs the given (persona, account) jobs, yielding a (persona, account,
+    stats) tuple for each one as soon as it completes, where stats is the
+    AccountMetrics returned by fetch_account(). With more than one
+    worker, jobs are spread across a bounded pool of threads and results are
+    yielded in completion order.
+    
+    When given, ``claim`` is called with each account just before it is
+    fetched; an account it returns False for, or raises an error for, is
+    skipped, and yielded with stats of None.
+    
+    Every job yields exactly one result, whatever goes wrong along the way.
+    """
+    logger = logging.getLogger("Fetch")
+    
+    def run(persona, account):
+        try:
+            if claim is not None and not claim(account):
+                return None
+        except:
+            logger.exception('Unable to lease %s account "%s". Skipping...' % (account.service, account))
+            return None
+        try:
+            return fetch_account(account, persona, timeout)
+        except:
+            # fetch_account() contains the backend's errors; anything else
+            # is still reported as a failure of this account.
+            exc_type, exc_value = sys.exc_info()[:2]
+            logger.exception('Failed to fetch %s account "%s"' % (account.service, account))
+            stats = metrics.AccountMetrics(account, persona)
+            stats.fail("%s: %s" % (exc_type.__name__, exc_value))
+            stats.finish()
+            return stats
+    
+    if workers <= 1 or len(jobs) <= 1:
+        for persona, account in jobs:
+            yield (persona, account, run(persona, account))
+        return
+    
+    pending = Queue()
+    results = Queue()
+    for job in jobs:
+        pending.put(job)
+    
+    def worker():
+        try:
+            while True:
+                try:
+                    persona, account = pending.get_nowait()
+                except Empty:
+                    break
+                results.put((persona, account, run(persona, account)))
+        finally:
+            close_connection()
+    
+    for i in range(min(workers, len(jobs))):
+        thread = threading.Thread(target=worker, name="djangregator-fetch-%d" % i)
+        thread.setDaemon(True)
+        thread.start()
+    
+    for i in range(len(jobs)):
+        while True:
+            # A blocking get() without a timeout can't be interrupted by
+            # ctrl-c, so poll instead.
+            try:
+                yield results.get(True, 1)
+                break
+            except Empty:
+                continue
+
+
+def emit(result, sinks=None):
+    """
+    Hands a FetchResult to the given metrics sinks, or to those configured
+    in settings. A failing sink is logged and otherwise ignored.
+    """
+    logger = logging.getLogger("Fetch")
+    if sinks is None:
+        sinks = metrics.configured_sinks()
+    for sink in sinks:
+        try:
+            sink.emit(result)
+        except:
+            logger.exception("Unable to emit fetch metrics to %r" % sink)
+
+
+PERSONA_REPORT = '--- Persona "%s" fetch report: %d OK, %d failed, %d deferred.'
+
+
+def _run(jobs, personas, workers, timeout, sinks, lease):
+    """
+    Fetches the given (persona, account) jobs, logging a report for each
+    persona as its last account completes, then applies the retention
+    policies and emits the metrics. ``personas`` is the number of personas
+    the jobs were drawn from. Returns the FetchResult.
+    """
     logger = logging.getLogger("Fetch")
     success_total = 0
     fail_total = 0
+    defer_total = 0
+    result = metrics.FetchResult()
+    result.personas = personas
+    fetched = []
+    
+    outstanding = {}
+    tallies = {}
+    for persona, account in jobs:
+        outstanding[persona.pk] = outstanding.get(persona.pk, 0) + 1
+        tallies[persona.pk] = [0, 0, 0]
+    
+    load_backends()
+    claim = None
+    if lease:
+        leases = LeaseQueue(lease)
+        leases.prepare([account for persona, account in jobs])
+        claim = leases.claim
+    for persona, account, stats in execute(jobs, workers, timeout, claim):
+        tally = tallies[persona.pk]
+        outstanding[persona.pk] -= 1
+        # stats is None for accounts which could not be leased, usually
+        # because another process holds the lease
+        if stats is not None:
+            result.add(stats)
+            if stats.failed:
+                tally[1] += 1
+                fail_total += 1
+            elif stats.deferred:
+                tally[2] += 1
+                defer_total += 1
+                if lease:
+                    leases.release(account)
+            else:
+                tally[0] += 1
+                success_total += 1
+                fetched.append(account)
+        
+        if outstanding[persona.pk] or not sum(tally):
+            continue
+        
+        if not tally[1] and not tally[2]:
+            logger.info(PERSONA_REPORT % ((persona.name,) + tuple(tally)))
+        else:
+            logger.warn(PERSONA_REPORT % ((persona.name,) + tuple(tally)))
+    
+    if not fail_total and not defer_total:
+        logger.info('=== Fetch completed with no errors: %s personas / %d accounts.' % (personas, success_total))
+    else:
+        logger.warn('=== Fetch completed with some errors: %s personas / %d accounts OK / %d accounts failed / %d accounts deferred' %
+        (personas, success_total, fail_total, defer_total))
+    
+    apply_retention(fetched)
+    result.finish()
+    emit(result, sinks)
+    return result
+
+
+def fetch(workers=1, timeout=None, sinks=None, shard=None, lease=None):
+    """
+    Fetches new activity from every active account of every online persona.
+    
+    ``workers`` sets how many accounts are fetched concurrently; the default
+    of 1 fetches serially. ``timeout`` is a per-account wall-clock limit in
+    seconds: an account whose backend takes longer is reported as failed and
+    the run moves on without it. ``sinks`` is a list of metrics sinks to
+    report to, instead of those configured in the DJANGREGATOR_METRICS
+    setting.
+    
+    To split the accounts between several processes, either give each one
+    a ``shard``, an (index, count) tuple, so that it only fetches its share
+    of the accounts; or give them all a ``lease`` time in seconds, so that
+    each account is leased in the database by the first process to get to
+    it and isn't fetched again by any process until the lease runs out. See
+    djangregator.sharding.
+    
+    Returns a FetchResult holding the metrics of every account fetched.
+    """
+    logger = logging.getLogger("Fetch")
     logger.info("Commencing fetch.")
-    personas = OnlinePersona.objects.all()
+    personas = list(OnlinePersona.objects.with_accounts())
+    
+    jobs = []
     for persona in personas:
-        success_persona = 0
-        fail_persona = 0
         logger.info("Fetching accounts related to \"%s\"" % persona.name)
         accounts = persona.accounts()
         
-        if accounts.count == 0:
+        if not accounts:
             logger.info('Persona "%s" has no defined accounts. Skipping...' % persona.name)
             continue
         
+        active = []
         for account in accounts:
             if not account.active:
                 logger.info("Skipping inactive %s account \"%s\"" % (account.service, account))
                 continue
-            
-            logger.info("Fetching activity from %s account \"%s\"" % (account.service, account))
-            
-            modulename = "djangregator.services.%s" % account.service
-            try:
-                module = __import__(modulename, globals(), locals(), ['fetch'])
-            except ImportError:
-                fail_persona += 1
-                fail_total += 1
-                logger.error("Unable to load a backend for fetching from %s. Skipping..." % account.service)
+            if shard is not None and not in_shard(account, *shard):
                 continue
-            
-            try:
-                (created, existing) = module.fetch(account)
-                logger.info('%s: fetched %d new, skipped %d existing' % (account.service, created, existing))
-            except:
-                fail_persona += 1
-                fail_total += 1
-                exc_type, exc_value = sys.exc_info()[:2]
-                logger.exception('Failed to fetch activity from %s account "%s": %s: "%s"' % 
-                (account.service,
-                account,
-                exc_type.__name__,
-                exc_value if exc_value else "no additional information"))
-            else:
-                success_persona += 1
-                success_total += 1
+            active.append(account)
         
-        persona_report = '--- Persona "%s" fetch report: %d OK, %d failed.'
-        if not fail_persona:
-            logger.info(persona_report % (persona.name, success_persona, fail_persona))
-        else:
-            logger.warn(persona_report % (persona.name, success_persona, fail_persona))
+        if not active:
+            logger.info(PERSONA_REPORT % (persona.name, 0, 0, 0))
+            continue
+        
+        jobs.extend([(persona, account) for account in active])
     
-    if not fail_total:
-        logger.info('=== Fetch completed with no errors: %s personas / %d accounts.' % (personas.count(), success_total))
-    else:
-        logger.warn('=== Fetch completed with some errors: %s personas / %d accounts OK / %d accounts failed' %
-        (personas.count(), success_total, fail_total))
\ No newline at end of file
+    return _run(jobs, len(personas), workers, timeout, sinks, lease)
+
+
+def fetch_accounts(accounts, workers=1, timeout=None, sinks=None, lease=None):
+    """
+    Fetches new activity from the given accounts right away, active or not,
+    the way fetch() does: their metrics are emitted, the retention policies
+    are applied after them and, given a ``lease`` time, accounts leased by
+    another process are left alone. The other arguments are as for fetch().
+    
+    Returns a FetchResult holding the metrics of every account fetched.
+    """
+    logger = logging.getLogger("Fetch")
+    logger.info("Commencing fetch of %d accounts." % len(accounts))
+    jobs = [(account.persona, account) for account in accounts]
+    personas = len(set([persona.pk for persona, account in jobs]))
+    return _run(jobs, personas, workers, timeout, sinks, lease)
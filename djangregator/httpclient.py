@@ -0,0 +1,226 @@
+# Copyright (c) 2008, Idan Gazit
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#     * Neither the name of the author nor the names of other
+#       contributors may be used to endorse or promote products derived
+#       from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+A small HTTP client shared by the service backends.
+
+Connections are kept alive and pooled per host, so that fetching many
+accounts from the same service doesn't pay for a new connection (and TLS
+handshake) every time. Responses may be gzip or deflate encoded, and
+requests can be made conditional on the validators stored in an account's
+SyncState, so an unchanged feed costs a single 304 response.
+"""
+
+from djangregator import metrics
+import httplib
+import socket
+import threading
+import urlparse
+import zlib
+
+USER_AGENT = "djangregator (+http://github.com/idangazit/djangregator/)"
+DEFAULT_TIMEOUT = 30
+
+
+class HTTPError(Exception):
+    """
+    Raised for any response other than 200 OK or 304 Not Modified.
+    """
+    def __init__(self, url, status, reason, headers=None):
+        Exception.__init__(self, "%s %s: %s" % (status, reason, url))
+        self.url = url
+        self.status = status
+        self.reason = reason
+        self.headers = headers or {}
+
+
+class Response(object):
+    def __init__(self, url, status, reason, headers, body):
+        self.url = url
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+    
+    @property
+    def not_modified(self):
+        return self.status == httplib.NOT_MODIFIED
+    
+    @property
+    def etag(self):
+        return self.headers.get('etag', '')
+    
+    @property
+    def last_modified(self):
+        return self.headers.get('last-modified', '')
+
+
+def _decode(body, encoding):
+    if encoding == 'gzip':
+        return zlib.decompress(body, 16 + zlib.MAX_WBITS)
+    if encoding == 'deflate':
+        try:
+            return zlib.decompress(body)
+        except zlib.error:
+            # some servers send a raw deflate stream without the zlib header
+            return zlib.decompress(body, -zlib.MAX_WBITS)
+    return body
+
+
+class HTTPClient(object):
+    """
+    A thread-safe HTTP client which keeps up to ``max_idle`` idle
+    connections per host for reuse.
+    """
+    def __init__(self, timeout=DEFAULT_TIMEOUT, max_idle=4):
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self._idle = {}
+        self._lock = threading.Lock()
+    
+    def _connect(self, scheme, netloc):
+        if scheme == 'https':
+            return httplib.HTTPSConnection(netloc, timeout=self.timeout)
+        return httplib.HTTPConnection(netloc, timeout=self.timeout)
+    
+    def _acquire(self, scheme, netloc):
+        self._lock.acquire()
+        try:
+            idle = self._idle.get((scheme, netloc))
+            if idle:
+                return idle.pop(), True
+        finally:
+            self._lock.release()
+        return self._connect(scheme, netloc), False
+    
+    def _release(self, scheme, netloc, connection):
+        self._lock.acquire()
+        try:
+            idle = self._idle.setdefault((scheme, netloc), [])
+            if len(idle) < self.max_idle:
+                idle.append(connection)
+                return
+        finally:
+            self._lock.release()
+        connection.close()
+    
+    def close(self):
+        """
+        Closes every idle connection.
+        """
+        self._lock.acquire()
+        try:
+            idle, self._idle = self._idle, {}
+        finally:
+            self._lock.release()
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+    
+    def get(self, url, etag=None, last_modified=None, headers=None):
+        """
+        Performs a GET request and returns a Response with the decoded body.
+        When ``etag`` or ``last_modified`` are given the request is made
+        conditional, and an unchanged resource yields a Response whose
+        not_modified is True.
+        
+        Raises HTTPError for any other unsuccessful response.
+        """
+        with metrics.phase('network'):
+            return self._get(url, etag, last_modified, headers)
+    
+    def _get(self, url, etag, last_modified, headers):
+        scheme, netloc, path, query, fragment = urlparse.urlsplit(url)
+        if query:
+            path = '%s?%s' % (path, query)
+        request_headers = {
+            'User-Agent': USER_AGENT,
+            'Accept-Encoding': 'gzip, deflate',
+        }
+        if etag:
+            request_headers['If-None-Match'] = etag
+        if last_modified:
+            request_headers['If-Modified-Since'] = last_modified
+        request_headers.update(headers or {})
+        
+        connection, reused = self._acquire(scheme, netloc)
+        try:
+            connection.request('GET', path or '/', headers=request_headers)
+            response = connection.getresponse()
+        except (httplib.HTTPException, socket.error):
+            connection.close()
+            if not reused:
+                raise
+            # The server may have dropped an idle keep-alive connection;
+            # retry once on a fresh one.
+            connection = self._connect(scheme, netloc)
+            try:
+                connection.request('GET', path or '/', headers=request_headers)
+                response = connection.getresponse()
+            except:
+                connection.close()
+                raise
+        
+        try:
+            body = response.read()
+        except:
+            connection.close()
+            raise
+        if response.will_close:
+            connection.close()
+        else:
+            self._release(scheme, netloc, connection)
+        metrics.record_http(len(body))
+        
+        response_headers = dict([(name.lower(), value) for name, value in response.getheaders()])
+        if response.status not in (httplib.OK, httplib.NOT_MODIFIED):
+            raise HTTPError(url, response.status, response.reason, response_headers)
+        body = _decode(body, response_headers.get('content-encoding'))
+        return Response(url, response.status, response.reason, response_headers, body)
+
+
+client = HTTPClient()
+
+
+def get(url, state=None, **kwargs):
+    """
+    Performs a GET request through the shared client. If the SyncState of
+    an account is given, the request is made conditional on its stored
+    validators, and the validators of a fresh response are copied onto it
+    (the state is not saved).
+    """
+    if state is not None:
+        kwargs.setdefault('etag', state.etag)
+        kwargs.setdefault('last_modified', state.last_modified)
+    response = client.get(url, **kwargs)
+    if state is not None and not response.not_modified:
+        state.etag = response.etag
+        state.last_modified = response.last_modified
+    return response
@@ -0,0 +1,126 @@
+# Copyright (c) 2008, Idan Gazit
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#     * Neither the name of the author nor the names of other
+#       contributors may be used to endorse or promote products derived
+#       from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+The shared ingestion layer used by the service backends.
+
+Backends normalize a whole page of feed items into dictionaries of field
+values and hand them to ingest(), which works out which of them are new using
+one query on the model's natural key, then bulk-inserts the new activity
+entries and their timeline entries.
+"""
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from djangregator.models import TimelineEntry
+from djangregator.signals import timeline_updated
+from djangregator import metrics
+
+DEFAULT_BATCH_SIZE = 100
+
+
+def _batches(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _lookup(model, account, key, rows):
+    """
+    Returns a queryset matching existing instances of ``model`` which share
+    a natural key with any of ``rows``. The first key field is matched with
+    an IN clause; keys which are not globally unique are scoped to the
+    account. The default ordering is cleared, as sorting the matches would
+    only slow the lookup down.
+    """
+    field = key[0]
+    queryset = model.objects.filter(**{
+        '%s__in' % field: list(set([row[field] for row in rows]))})
+    if len(key) > 1 or not model._meta.get_field(field).unique:
+        queryset = queryset.filter(account=account)
+    return queryset.order_by()
+
+
+def ingest(model, account, rows, key, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Saves the activity described by ``rows`` (a list of dictionaries of
+    field values) for ``account``, skipping any which already exist.
+    ``key`` is a tuple of the field names which identify an item.
+    
+    New entries and their TimelineEntry rows are created with bulk inserts,
+    ``batch_size`` rows at a time. Since bulk_create() sends no signals,
+    update_timeline never fires for these; one timeline_updated signal is
+    sent instead.
+    
+    Returns a tuple containing the number of items created, and the number of
+    items skipped because they already existed.
+    """
+    if not rows:
+        return (0, 0)
+    with metrics.phase('db'):
+        return _ingest(model, account, rows, key, batch_size)
+
+
+def _ingest(model, account, rows, key, batch_size):
+    keyof = lambda row: tuple([row[field] for field in key])
+    
+    existing = set(_lookup(model, account, key, rows).values_list(*key))
+    items_existing = 0
+    new_rows = []
+    for row in rows:
+        k = keyof(row)
+        if k in existing:
+            items_existing += 1
+            continue
+        existing.add(k)
+        new_rows.append(row)
+    
+    content_type = ContentType.objects.get_for_model(model)
+    for batch in _batches(new_rows, batch_size):
+        with transaction.commit_on_success():
+            instances = dict([(keyof(row), model(account=account, **row)) for row in batch])
+            model.objects.bulk_create(instances.values())
+            # bulk_create() doesn't hand back primary keys, so read them
+            # back in one more query to build the timeline entries.
+            fields = ('pk',) + tuple(key)
+            entries = []
+            for values in _lookup(model, account, key, batch).values_list(*fields):
+                instance = instances.get(tuple(values[1:]))
+                if instance is None:
+                    continue
+                entries.append(TimelineEntry(
+                    content_type=content_type,
+                    object_id=values[0],
+                    published=instance.published,
+                    **instance.timeline_values()))
+            TimelineEntry.objects.bulk_create(entries)
+    
+    if new_rows:
+        timeline_updated.send(sender=model, personas=[account.persona_id])
+    return (len(new_rows), items_existing)
@@ -0,0 +1,91 @@
+# Copyright (c) 2008, Idan Gazit
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#     * Neither the name of the author nor the names of other
+#       contributors may be used to endorse or promote products derived
+#       from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+A bounded, least recently used cache, for memoizing pure functions such as
+tweet rendering and timestamp parsing.
+"""
+
+import threading
+
+
+class LRUCache(object):
+    """
+    A thread-safe mapping which holds at most ``size`` items, discarding the
+    least recently used item when full.
+    """
+    def __init__(self, size):
+        self.size = size
+        self._lock = threading.Lock()
+        self.clear()
+    
+    def clear(self):
+        # entries are [prev, next, key, value] links in a circular list
+        self._map = {}
+        self._root = root = []
+        root[:] = [root, root, None, None]
+    
+    def get(self, key, default=None):
+        self._lock.acquire()
+        try:
+            link = self._map.get(key)
+            if link is None:
+                return default
+            prev, next, key, value = link
+            prev[1] = next
+            next[0] = prev
+            last = self._root[0]
+            last[1] = self._root[0] = link
+            link[0] = last
+            link[1] = self._root
+            return value
+        finally:
+            self._lock.release()
+    
+    def set(self, key, value):
+        self._lock.acquire()
+        try:
+            if key in self._map:
+                self._map[key][3] = value
+                return
+            root = self._root
+            if len(self._map) >= self.size:
+                oldest = root[1]
+                root[1] = oldest[1]
+                oldest[1][0] = root
+                del self._map[oldest[2]]
+            last = root[0]
+            link = [last, root, key, value]
+            last[1] = root[0] = self._map[key] = link
+        finally:
+            self._lock.release()
+    
+    def __len__(self):
+        return len(self._map)
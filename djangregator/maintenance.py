@@ -0,0 +1,269 @@
+# Copyright (c) 2008, Idan Gazit
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#     * Neither the name of the author nor the names of other
+#       contributors may be used to endorse or promote products derived
+#       from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Deferred, batched maintenance of the timeline.
+
+Saving a service model instance queues its TimelineEntry to be written
+rather than writing it straight away. Inside deferred() the queue is only
+flushed when the block exits, so all of the changes an account's fetch makes
+are written with one query to find the existing entries, one bulk insert and
+one update per entry which actually changed. Outside of it the queue is
+flushed after every save, which behaves like the old synchronous handler
+without its extra queries.
+
+suspended() turns timeline maintenance off altogether, for bulk imports which
+write the timeline themselves or rebuild it afterwards.
+
+delete_entries() deletes activity entries together with their timeline
+entries, a chunk at a time.
+"""
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from djangregator.models import TimelineEntry
+from djangregator.signals import timeline_updated
+from djangregator import metrics
+from contextlib import contextmanager
+import threading
+
+_local = threading.local()
+
+
+def entry_values(instance):
+    """
+    Returns the field values which the TimelineEntry of ``instance`` should
+    have, other than its content type and object id.
+    """
+    values = instance.timeline_values()
+    values['published'] = instance.published
+    return values
+
+
+def changed_values(entry, values):
+    """
+    Returns those of ``values`` which differ from the TimelineEntry's.
+    """
+    return dict([(field, value) for field, value in values.items()
+        if getattr(entry, field) != value])
+
+
+def update_entry(pk, values):
+    """
+    Writes ``values`` onto the TimelineEntry with primary key ``pk``.
+    QuerySet.update() takes field names, so ``persona_id`` is passed on as
+    ``persona``.
+    """
+    values = dict(values)
+    if 'persona_id' in values:
+        values['persona'] = values.pop('persona_id')
+    TimelineEntry.objects.filter(pk=pk).update(**values)
+
+
+class TimelineBatch(object):
+    """
+    Collects service model instances whose timeline entries need writing,
+    and writes them all at once when flushed.
+    """
+    def __init__(self):
+        self.pending = {}
+    
+    def __len__(self):
+        return len(self.pending)
+    
+    def add(self, instance):
+        """
+        Queues the timeline entry of ``instance``. Adding the same instance
+        again only keeps the latest copy.
+        """
+        self.pending[(type(instance), instance.pk)] = instance
+    
+    def flush(self):
+        """
+        Creates the missing timeline entries of every queued instance and
+        updates the existing ones whose values changed, leaving the rest
+        alone. Sends timeline_updated for the personas whose timelines were
+        written.
+        
+        Returns a tuple of the number of entries created, updated and left
+        unchanged.
+        """
+        pending, self.pending = self.pending, {}
+        if not pending:
+            return (0, 0, 0)
+        
+        by_model = {}
+        for (model, pk), instance in pending.items():
+            by_model.setdefault(model, {})[pk] = instance
+        
+        created = updated = unchanged = 0
+        personas = set()
+        with metrics.phase('db'):
+            with transaction.commit_on_success():
+                for model, instances in by_model.items():
+                    content_type = ContentType.objects.get_for_model(model)
+                    entries = {}
+                    for entry in TimelineEntry.objects.filter(
+                            content_type=content_type, object_id__in=instances.keys()).order_by():
+                        entries.setdefault(entry.object_id, entry)
+                    
+                    missing = []
+                    for pk, instance in instances.items():
+                        values = entry_values(instance)
+                        entry = entries.get(pk)
+                        if entry is None:
+                            # Either a new instance, or one whose entry was
+                            # lost; either way it gets one now.
+                            missing.append(TimelineEntry(content_type=content_type,
+                                object_id=pk, **values))
+                            personas.add(values['persona_id'])
+                            continue
+                        changed = changed_values(entry, values)
+                        if not changed:
+                            unchanged += 1
+                            continue
+                        update_entry(entry.pk, changed)
+                        personas.add(entry.persona_id)
+                        personas.add(values['persona_id'])
+                        updated += 1
+                    TimelineEntry.objects.bulk_create(missing)
+                    created += len(missing)
+        
+        personas.discard(None)
+        if personas:
+            timeline_updated.send(sender=TimelineEntry, personas=list(personas))
+        return (created, updated, unchanged)
+
+
+def current_batch():
+    """
+    Returns the TimelineBatch of the innermost deferred() block in this
+    thread, or None.
+    """
+    return getattr(_local, 'batch', None)
+
+
+def is_suspended():
+    """
+    Returns True if timeline maintenance is suspended in this thread.
+    """
+    return getattr(_local, 'suspended', 0) > 0
+
+
+@contextmanager
+def deferred():
+    """
+    Defers the timeline writes of every save made in this thread inside the
+    block until it exits, then writes them in one batch. Nested blocks join
+    the outermost one. Yields the TimelineBatch.
+    """
+    batch = current_batch()
+    if batch is not None:
+        yield batch
+        return
+    
+    batch = _local.batch = TimelineBatch()
+    try:
+        yield batch
+    finally:
+        _local.batch = None
+        batch.flush()
+
+
+@contextmanager
+def suspended():
+    """
+    Turns timeline maintenance off for saves made in this thread inside the
+    block. Nothing is queued, so whatever is saved meanwhile has to have its
+    timeline written some other way, such as the rebuild_timeline command.
+    """
+    _local.suspended = getattr(_local, 'suspended', 0) + 1
+    try:
+        yield
+    finally:
+        _local.suspended -= 1
+
+
+def queue(instance):
+    """
+    Queues the timeline entry of ``instance`` to be written: at the end of
+    the enclosing deferred() block if there is one, otherwise straight away.
+    Does nothing while maintenance is suspended.
+    """
+    if is_suspended():
+        return
+    batch = current_batch()
+    if batch is not None:
+        batch.add(instance)
+    else:
+        batch = TimelineBatch()
+        batch.add(instance)
+        batch.flush()
+
+
+def delete_entries(queryset, chunk_size=1000, archive=None):
+    """
+    Deletes the activity entries matched by ``queryset`` along with their
+    timeline entries, ``chunk_size`` primary keys at a time, each chunk in
+    its own transaction. If ``archive`` is given, it is called with each
+    chunk of instances before they are deleted. Returns the number of
+    activity entries deleted.
+    """
+    model = queryset.model
+    content_type = ContentType.objects.get_for_model(model)
+    personas = set()
+    deleted = 0
+    last_pk = None
+    while True:
+        chunk = queryset.order_by('pk')
+        if last_pk is not None:
+            chunk = chunk.filter(pk__gt=last_pk)
+        if archive is not None:
+            instances = list(chunk[:chunk_size])
+            pks = [instance.pk for instance in instances]
+        else:
+            pks = list(chunk.values_list('pk', flat=True)[:chunk_size])
+        if not pks:
+            break
+        last_pk = pks[-1]
+        with transaction.commit_on_success():
+            if archive is not None:
+                archive(instances)
+            entries = TimelineEntry.objects.filter(content_type=content_type,
+                object_id__in=pks).order_by()
+            personas.update(entries.values_list('persona_id', flat=True).distinct())
+            entries.delete()
+            model.objects.filter(pk__in=pks).delete()
+        deleted += len(pks)
+    
+    personas.discard(None)
+    if personas:
+        timeline_updated.send(sender=model, personas=list(personas))
+    return deleted
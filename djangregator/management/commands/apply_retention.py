@@ -0,0 +1,58 @@
+# Copyright (c) 2008, Idan Gazit
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#     * Neither the name of the author nor the names of other
+#       contributors may be used to endorse or promote products derived
+#       from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+from django.core.management.base import NoArgsCommand
+from djangregator.retention import apply_policy, DEFAULT_CHUNK_SIZE
+from optparse import make_option
+
+class Command(NoArgsCommand):
+    help = "Archives and removes the activity, and its timeline entries, " \
+           "which falls outside of the DJANGREGATOR_RETENTION policies."
+    option_list = NoArgsCommand.option_list + (
+        make_option('--dry-run', action='store_true', dest='dry_run', default=False,
+            help='Only report how many items would be removed.'),
+        make_option('--service', action='append', dest='services',
+            help='Only apply the policy of the given service; may be repeated [default: all services]'),
+        make_option('--archive-dir', dest='archive_dir',
+            help='Directory to archive removed items to [default: DJANGREGATOR_ARCHIVE_DIR]'),
+        make_option('--chunk-size', type='int', dest='chunk_size', default=DEFAULT_CHUNK_SIZE,
+            help='Number of items to remove per transaction [default: %default]'),
+    )
+    
+    def handle_noargs(self, **options):
+        removed = apply_policy(services=options['services'],
+            archive_dir=options['archive_dir'], dry_run=options['dry_run'],
+            chunk_size=options['chunk_size'])
+        
+        if int(options.get('verbosity', 1)) >= 1:
+            verb = options['dry_run'] and "Would remove" or "Removed"
+            for service, count in sorted(removed.items()):
+                self.stdout.write("%s: %s %d items.\n" % (service, verb.lower(), count))
+            self.stdout.write("%s %d items in total.\n" % (verb, sum(removed.values())))
@@ -0,0 +1,128 @@
+# Copyright (c) 2008, Idan Gazit
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#     * Neither the name of the author nor the names of other
+#       contributors may be used to endorse or promote products derived
+#       from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+from django.core.management.base import NoArgsCommand
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from djangregator.models import TimelineEntry
+from djangregator.maintenance import entry_values, update_entry
+from djangregator.signals import timeline_updated
+from djangregator import registry
+from optparse import make_option
+
+class Command(NoArgsCommand):
+    help = "Copies title, link, service, persona and thumbnail from each " \
+           "activity entry onto its TimelineEntry, creating the entries " \
+           "of any activity which has none."
+    option_list = NoArgsCommand.option_list + (
+        make_option('--all', action='store_true', dest='all', default=False,
+            help='Refresh every timeline entry, not just those which were never filled in.'),
+        make_option('--chunk-size', type='int', dest='chunk_size', default=500,
+            help='Number of entries to process per transaction [default: %default]'),
+    )
+    
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+        chunk_size = options['chunk_size']
+        total = 0
+        total_created = 0
+        personas = set()
+        
+        for service in registry.services():
+            model = service.activity_model
+            content_type = ContentType.objects.get_for_model(model)
+            created = self.create_missing(model, content_type, chunk_size, personas)
+            total_created += created
+            entries = TimelineEntry.objects.filter(content_type=content_type)
+            if not options['all']:
+                entries = entries.filter(service='')
+            
+            updated = 0
+            last_pk = 0
+            while True:
+                chunk = list(entries.filter(pk__gt=last_pk).order_by('pk')
+                    .values_list('pk', 'object_id')[:chunk_size])
+                if not chunk:
+                    break
+                last_pk = chunk[-1][0]
+                objects = model.objects.select_related('account').in_bulk(
+                    [object_id for pk, object_id in chunk])
+                
+                with transaction.commit_on_success():
+                    for pk, object_id in chunk:
+                        instance = objects.get(object_id)
+                        if instance is None:
+                            continue
+                        values = instance.timeline_values()
+                        update_entry(pk, values)
+                        personas.add(values['persona_id'])
+                        updated += 1
+            
+            total += updated
+            if verbosity >= 1:
+                self.stdout.write("%s: created %d and backfilled %d timeline entries.\n" %
+                    (model._meta.verbose_name_plural, created, updated))
+        
+        personas.discard(None)
+        if personas:
+            timeline_updated.send(sender=TimelineEntry, personas=list(personas))
+        if verbosity >= 1:
+            self.stdout.write("Created %d and backfilled %d timeline entries in total.\n" %
+                (total_created, total))
+    
+    def create_missing(self, model, content_type, chunk_size, personas):
+        """
+        Creates the timeline entries of the activity entries of ``model``
+        which have none, walking the activity a chunk at a time. Adds the
+        ids of the personas whose timelines grew to ``personas``, and
+        returns the number of entries created.
+        """
+        created = 0
+        last_pk = 0
+        while True:
+            pks = list(model.objects.filter(pk__gt=last_pk).order_by('pk')
+                .values_list('pk', flat=True)[:chunk_size])
+            if not pks:
+                return created
+            last_pk = pks[-1]
+            existing = set(TimelineEntry.objects.filter(content_type=content_type,
+                object_id__in=pks).order_by().values_list('object_id', flat=True))
+            missing = [pk for pk in pks if pk not in existing]
+            if not missing:
+                continue
+            instances = model.objects.select_related('account').in_bulk(missing)
+            entries = []
+            for pk, instance in instances.items():
+                values = entry_values(instance)
+                personas.add(values['persona_id'])
+                entries.append(TimelineEntry(content_type=content_type, object_id=pk, **values))
+            with transaction.commit_on_success():
+                TimelineEntry.objects.bulk_create(entries)
+            created += len(entries)
@@ -0,0 +1,80 @@
+# Copyright (c) 2008, Idan Gazit
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#     * Neither the name of the author nor the names of other
+#       contributors may be used to endorse or promote products derived
+#       from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+from django.core.management.base import NoArgsCommand, CommandError
+from djangregator.models import OnlinePersona
+from djangregator import feeds
+from optparse import make_option
+import sys
+
+class Command(NoArgsCommand):
+    help = "Writes a timeline out as an Atom, RSS or JSON feed, streaming " \
+           "it a page at a time."
+    option_list = NoArgsCommand.option_list + (
+        make_option('--persona', type='int', dest='persona',
+            help='Id of the persona whose timeline to export [default: everyone]'),
+        make_option('--format', dest='format', default='atom',
+            choices=sorted(feeds.FORMATS.keys()),
+            help='One of atom, json or rss [default: %default]'),
+        make_option('--service', action='append', dest='services',
+            help='Only export entries from this service; may be repeated'),
+        make_option('--limit', type='int', dest='limit',
+            help='Export at most this many entries [default: all]'),
+        make_option('--output', dest='output',
+            help='File to write the feed to [default: standard output]'),
+        make_option('--title', dest='title', help='Title of the feed'),
+        make_option('--link', dest='link', default='',
+            help='URL of the site the feed belongs to'),
+        make_option('--feed-url', dest='feed_url', default='',
+            help='URL the feed will be published at'),
+    )
+    
+    def handle_noargs(self, **options):
+        persona = None
+        if options['persona'] is not None:
+            try:
+                persona = OnlinePersona.objects.get(pk=options['persona'])
+            except OnlinePersona.DoesNotExist:
+                raise CommandError("No persona with id %s" % options['persona'])
+        
+        chunks = feeds.generate(options['format'], persona,
+            services=options['services'], limit=options['limit'],
+            title=options['title'], link=options['link'],
+            feed_url=options['feed_url'])
+        
+        output = sys.stdout
+        if options['output']:
+            output = open(options['output'], 'w')
+        try:
+            for chunk in chunks:
+                output.write(chunk.encode('utf-8'))
+        finally:
+            if options['output']:
+                output.close()
@@ -0,0 +1,70 @@
+# Copyright (c) 2008, Idan Gazit
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#     * Neither the name of the author nor the names of other
+#       contributors may be used to endorse or promote products derived
+#       from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+from django.core.management.base import BaseCommand, CommandError
+from djangregator.models import DeliciousAccount
+from djangregator.ingest import DEFAULT_BATCH_SIZE
+from djangregator.services import delicious
+from optparse import make_option
+
+class Command(BaseCommand):
+    args = '<account id> <export file>'
+    help = "Imports the full history of bookmarks from a Delicious or " \
+           "Pinboard JSON or XML export into a Delicious account."
+    option_list = BaseCommand.option_list + (
+        make_option('--format', dest='format', choices=['json', 'xml'],
+            help='One of json or xml [default: guessed from the file name]'),
+        make_option('--batch-size', type='int', dest='batch_size', default=DEFAULT_BATCH_SIZE,
+            help='Number of bookmarks to save per transaction [default: %default]'),
+    )
+    
+    def handle(self, *args, **options):
+        if len(args) != 2:
+            raise CommandError("Usage: import_delicious %s" % self.args)
+        account_id, path = args
+        try:
+            account = DeliciousAccount.objects.get(pk=account_id)
+        except (DeliciousAccount.DoesNotExist, ValueError):
+            raise CommandError("No Delicious account with id %s" % account_id)
+        
+        format = options['format']
+        if format is None:
+            format = path.lower().endswith('.xml') and 'xml' or 'json'
+        
+        f = open(path, 'rb')
+        try:
+            created, existing = delicious.import_dump(account, f, format,
+                batch_size=options['batch_size'])
+        finally:
+            f.close()
+        
+        if int(options.get('verbosity', 1)) >= 1:
+            self.stdout.write("Imported %d new bookmarks, skipped %d existing.\n" %
+                (created, existing))
@@ -0,0 +1,186 @@
+# Copyright (c) 2008, Idan Gazit
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#     * Neither the name of the author nor the names of other
+#       contributors may be used to endorse or promote products derived
+#       from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+from django.core.management.base import NoArgsCommand
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from djangregator.models import TimelineEntry
+from djangregator.maintenance import entry_values, changed_values, update_entry
+from djangregator.signals import timeline_updated
+from djangregator import registry
+from optparse import make_option
+
+class Command(NoArgsCommand):
+    help = "Checks the timeline against the activity entries of every " \
+           "service and repairs missing, stale, duplicate and orphaned " \
+           "timeline entries."
+    option_list = NoArgsCommand.option_list + (
+        make_option('--dry-run', action='store_true', dest='dry_run', default=False,
+            help='Only report the differences, without repairing them.'),
+        make_option('--service', action='append', dest='services', default=[],
+            help='Only check the given service; may be repeated [default: all services]'),
+        make_option('--chunk-size', type='int', dest='chunk_size', default=1000,
+            help='Number of activity entries to check per query and transaction [default: %default]'),
+    )
+    
+    def handle_noargs(self, **options):
+        self.verbosity = int(options.get('verbosity', 1))
+        self.dry_run = options['dry_run']
+        self.chunk_size = options['chunk_size']
+        self.personas = set()
+        
+        services = registry.services()
+        if options['services']:
+            services = [registry.get(name) for name in options['services']]
+        
+        totals = dict.fromkeys(('missing', 'stale', 'duplicate', 'orphaned'), 0)
+        for service in services:
+            counts = self.check(service.activity_model)
+            for key, value in counts.items():
+                totals[key] += value
+        
+        self.personas.discard(None)
+        if self.personas:
+            timeline_updated.send(sender=TimelineEntry, personas=list(self.personas))
+        
+        if self.verbosity >= 1:
+            self.stdout.write("%s %d missing, %d stale, %d duplicate and %d orphaned timeline entries in total.\n" %
+                (self.dry_run and "Found" or "Repaired", totals['missing'], totals['stale'],
+                totals['duplicate'], totals['orphaned']))
+    
+    def check(self, model):
+        """
+        Walks the activity entries of ``model`` in primary key order, one
+        chunk at a time, comparing each chunk with the timeline entries
+        whose object ids fall in the same range. The ranges run from just
+        past the end of the previous chunk, so together they cover every
+        object id, including those of activity deleted before the first
+        surviving entry or between chunks.
+        """
+        content_type = ContentType.objects.get_for_model(model)
+        entries = TimelineEntry.objects.filter(content_type=content_type)
+        name = model._meta.verbose_name_plural
+        counts = dict.fromkeys(('missing', 'stale', 'duplicate', 'orphaned'), 0)
+        checked = 0
+        last_pk = 0
+        
+        while True:
+            chunk = model.objects.select_related('account').filter(
+                pk__gt=last_pk).order_by('pk')[:self.chunk_size]
+            instances = dict([(instance.pk, instance) for instance in chunk])
+            if not instances:
+                counts['orphaned'] += self.check_tail(content_type, entries, last_pk)
+                break
+            first_pk, last_pk = last_pk, max(instances)
+            checked += len(instances)
+            
+            by_object = {}
+            extra = []
+            for entry in entries.filter(object_id__gt=first_pk, object_id__lte=last_pk).order_by():
+                # of several entries for the same object, keep the oldest
+                kept = by_object.get(entry.object_id)
+                if kept is not None and kept.pk < entry.pk:
+                    extra.append((entry.pk, entry.persona_id))
+                    continue
+                if kept is not None:
+                    extra.append((kept.pk, kept.persona_id))
+                by_object[entry.object_id] = entry
+            
+            missing = set(instances) - set(by_object)
+            orphaned = set(by_object) - set(instances)
+            stale = []
+            for object_id in set(instances) & set(by_object):
+                entry = by_object[object_id]
+                changed = changed_values(entry, entry_values(instances[object_id]))
+                if changed:
+                    stale.append((entry, changed))
+            
+            counts['missing'] += len(missing)
+            counts['stale'] += len(stale)
+            counts['duplicate'] += len(extra)
+            counts['orphaned'] += len(orphaned)
+            self.repair(content_type,
+                [instances[object_id] for object_id in missing],
+                stale,
+                extra + [(by_object[object_id].pk, by_object[object_id].persona_id)
+                    for object_id in orphaned])
+            
+            if self.verbosity >= 2:
+                self.stdout.write("%s: checked %d (up to #%d), %d missing, %d stale, %d duplicate, %d orphaned\n" %
+                    (name, checked, last_pk, counts['missing'], counts['stale'],
+                    counts['duplicate'], counts['orphaned']))
+        
+        if self.verbosity >= 1:
+            self.stdout.write("%s: checked %d, %d missing, %d stale, %d duplicate, %d orphaned.\n" %
+                (name, checked, counts['missing'], counts['stale'],
+                counts['duplicate'], counts['orphaned']))
+        return counts
+    
+    def check_tail(self, content_type, entries, last_pk):
+        """
+        Removes the timeline entries beyond the last activity entry, which
+        are all orphaned. Returns how many there were.
+        """
+        orphaned = 0
+        last_entry = 0
+        while True:
+            orphans = list(entries.filter(object_id__gt=last_pk, pk__gt=last_entry)
+                .order_by('pk').values_list('pk', 'persona_id')[:self.chunk_size])
+            if not orphans:
+                return orphaned
+            last_entry = orphans[-1][0]
+            orphaned += len(orphans)
+            self.repair(content_type, [], [], orphans)
+    
+    def repair(self, content_type, missing, stale, delete):
+        """
+        Creates the timeline entries of the ``missing`` activity entries,
+        updates the ``stale`` (entry, changed values) pairs and deletes the
+        ``delete`` (pk, persona id) pairs, all in one transaction.
+        """
+        if self.dry_run or not (missing or stale or delete):
+            return
+        with transaction.commit_on_success():
+            created = []
+            for instance in missing:
+                values = entry_values(instance)
+                created.append(TimelineEntry(content_type=content_type,
+                    object_id=instance.pk, **values))
+                self.personas.add(values['persona_id'])
+            TimelineEntry.objects.bulk_create(created)
+            for entry, changed in stale:
+                update_entry(entry.pk, changed)
+                self.personas.add(entry.persona_id)
+                if 'persona_id' in changed:
+                    self.personas.add(changed['persona_id'])
+            for i in range(0, len(delete), self.chunk_size):
+                pks = delete[i:i + self.chunk_size]
+                TimelineEntry.objects.filter(pk__in=[pk for pk, persona_id in pks]).delete()
+                self.personas.update([persona_id for pk, persona_id in pks])
@@ -0,0 +1,379 @@
+# Copyright (c) 2008, Idan Gazit
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#     * Neither the name of the author nor the names of other
+#       contributors may be used to endorse or promote products derived
+#       from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Measurements of what fetching costs.
+
+Every account fetch is measured by an AccountMetrics, which records its wall
+time (split into network, throttle, parse and db phases), the HTTP requests
+and bytes and the database queries it made, the number of items created and
+skipped, and the number of timestamps which could not be parsed. fetch()
+gathers these into a FetchResult and hands it to each configured metrics
+sink.
+
+Code running on behalf of an account reports to the AccountMetrics which is
+active in the current thread, through the module-level phase(),
+record_http() and record_parse_failure() functions. Outside of a fetch
+those are no-ops.
+"""
+
+from django.conf import settings
+from django.utils import simplejson as json
+from django.utils.importlib import import_module
+import os
+import tempfile
+import threading
+import time
+
+_local = threading.local()
+
+
+class AccountMetrics(object):
+    """
+    Measurements taken while fetching a single account.
+    """
+    def __init__(self, account, persona=None):
+        self.service = account.service
+        self.account = unicode(account)
+        self.account_id = account.pk
+        self.persona = persona is not None and persona.name or None
+        self.started = time.time()
+        self.wall_time = 0.0
+        self.phases = {}
+        self.http_requests = 0
+        self.http_bytes = 0
+        self.queries = 0
+        self.created = 0
+        self.existing = 0
+        self.parse_failures = 0
+        self.failed = False
+        self.deferred = False
+        self.error = None
+    
+    def phase(self, name):
+        return _Phase(self, name)
+    
+    def fail(self, error):
+        self.failed = True
+        self.error = error
+    
+    def defer(self, reason):
+        """
+        Marks the account as left for a later fetch, e.g. because its
+        service is rate limiting us; unlike a failure, this says nothing
+        about the account itself.
+        """
+        self.deferred = True
+        self.error = reason
+    
+    def finish(self):
+        self.wall_time = time.time() - self.started
+    
+    def add(self, other):
+        """
+        Adds the phases, requests, queries and parse failures measured by
+        another AccountMetrics of the same fetch.
+        """
+        for name, seconds in other.phases.items():
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+        self.http_requests += other.http_requests
+        self.http_bytes += other.http_bytes
+        self.queries += other.queries
+        self.parse_failures += other.parse_failures
+    
+    def as_dict(self):
+        return {
+            'service': self.service,
+            'account': self.account,
+            'account_id': self.account_id,
+            'persona': self.persona,
+            'started': self.started,
+            'wall_time': self.wall_time,
+            'phases': self.phases,
+            'http_requests': self.http_requests,
+            'http_bytes': self.http_bytes,
+            'queries': self.queries,
+            'created': self.created,
+            'existing': self.existing,
+            'parse_failures': self.parse_failures,
+            'failed': self.failed,
+            'deferred': self.deferred,
+            'error': self.error,
+        }
+
+
+class _Phase(object):
+    """
+    Context manager which adds the time spent inside it to one phase of an
+    AccountMetrics.
+    """
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+    
+    def __enter__(self):
+        self.started = time.time()
+    
+    def __exit__(self, *exc_info):
+        if self.metrics is not None:
+            phases = self.metrics.phases
+            phases[self.name] = phases.get(self.name, 0.0) + time.time() - self.started
+        return False
+
+
+class FetchResult(object):
+    """
+    The outcome of a fetch run: the AccountMetrics of every account fetched,
+    along with totals.
+    """
+    def __init__(self):
+        self.started = time.time()
+        self.wall_time = 0.0
+        self.personas = 0
+        self.accounts = []
+    
+    def add(self, metrics):
+        self.accounts.append(metrics)
+    
+    def finish(self):
+        self.wall_time = time.time() - self.started
+    
+    def _total(self, attr):
+        return sum([getattr(metrics, attr) for metrics in self.accounts])
+    
+    succeeded = property(lambda self: len([m for m in self.accounts if not (m.failed or m.deferred)]))
+    failed = property(lambda self: len([m for m in self.accounts if m.failed]))
+    deferred = property(lambda self: len([m for m in self.accounts if m.deferred]))
+    created = property(lambda self: self._total('created'))
+    existing = property(lambda self: self._total('existing'))
+    queries = property(lambda self: self._total('queries'))
+    http_requests = property(lambda self: self._total('http_requests'))
+    http_bytes = property(lambda self: self._total('http_bytes'))
+    parse_failures = property(lambda self: self._total('parse_failures'))
+    
+    def as_dict(self):
+        return {
+            'started': self.started,
+            'wall_time': self.wall_time,
+            'personas': self.personas,
+            'succeeded': self.succeeded,
+            'failed': self.failed,
+            'deferred': self.deferred,
+            'created': self.created,
+            'existing': self.existing,
+            'queries': self.queries,
+            'http_requests': self.http_requests,
+            'http_bytes': self.http_bytes,
+            'parse_failures': self.parse_failures,
+            'accounts': [metrics.as_dict() for metrics in self.accounts],
+        }
+
+
+##############################################################################
+# Reporting from instrumented code
+##############################################################################
+
+def activate(metrics):
+    """
+    Makes ``metrics`` the AccountMetrics reported to from this thread.
+    """
+    _local.metrics = metrics
+
+
+def deactivate():
+    _local.metrics = None
+
+
+def current():
+    """
+    Returns the AccountMetrics active in this thread, or None.
+    """
+    return getattr(_local, 'metrics', None)
+
+
+def phase(name):
+    """
+    Returns a context manager which charges the time spent inside it to the
+    named phase of the active AccountMetrics.
+    """
+    return _Phase(current(), name)
+
+
+def record_http(nbytes=0):
+    """
+    Records one HTTP request which transferred ``nbytes`` bytes.
+    """
+    metrics = current()
+    if metrics is not None:
+        metrics.http_requests += 1
+        metrics.http_bytes += nbytes
+
+
+def record_parse_failure():
+    """
+    Records an item which was skipped or incomplete because its timestamp
+    could not be parsed.
+    """
+    metrics = current()
+    if metrics is not None:
+        metrics.parse_failures += 1
+
+
+##############################################################################
+# Sinks
+##############################################################################
+
+class MetricsSink(object):
+    """
+    Receives the FetchResult of every fetch run.
+    """
+    def emit(self, result):
+        raise NotImplementedError
+
+
+class MemorySink(MetricsSink):
+    """
+    Keeps every FetchResult in memory, in the ``results`` list.
+    """
+    def __init__(self):
+        self.results = []
+    
+    def emit(self, result):
+        self.results.append(result)
+
+
+class JSONLinesSink(MetricsSink):
+    """
+    Appends each FetchResult to a file as a single line of JSON.
+    """
+    def __init__(self, path):
+        self.path = path
+    
+    def emit(self, result):
+        f = open(self.path, 'a')
+        try:
+            f.write(json.dumps(result.as_dict()) + '\n')
+        finally:
+            f.close()
+
+
+def _label(value):
+    return unicode(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class PrometheusTextfileSink(MetricsSink):
+    """
+    Writes the latest FetchResult in the Prometheus text exposition format,
+    for collection by node_exporter's textfile collector. The file is
+    replaced atomically.
+    """
+    def __init__(self, path):
+        self.path = path
+    
+    def render(self, result):
+        lines = []
+        def metric(name, help, samples):
+            lines.append('# HELP %s %s' % (name, help))
+            lines.append('# TYPE %s gauge' % name)
+            for labels, value in samples:
+                if labels:
+                    labels = '{%s}' % ','.join(['%s="%s"' % (k, _label(v)) for k, v in labels])
+                lines.append('%s%s %s' % (name, labels or '', repr(float(value))))
+        
+        accounts = [(m, (('service', m.service), ('account', m.account))) for m in result.accounts]
+        metric('djangregator_fetch_last_run_timestamp_seconds',
+            'Time the last fetch run started.', [((), result.started)])
+        metric('djangregator_fetch_run_seconds',
+            'Wall time of the last fetch run.', [((), result.wall_time)])
+        metric('djangregator_fetch_accounts',
+            'Accounts fetched in the last run, by outcome.',
+            [((('status', 'ok'),), result.succeeded), ((('status', 'failed'),), result.failed),
+             ((('status', 'deferred'),), result.deferred)])
+        metric('djangregator_account_fetch_seconds',
+            'Wall time of the last fetch of each account.',
+            [(labels, m.wall_time) for m, labels in accounts])
+        metric('djangregator_account_phase_seconds',
+            'Time spent in each phase of the last fetch of each account.',
+            [(labels + (('phase', name),), seconds)
+                for m, labels in accounts for name, seconds in sorted(m.phases.items())])
+        metric('djangregator_account_items',
+            'Items seen in the last fetch of each account, by outcome.',
+            [(labels + (('status', status),), getattr(m, status))
+                for m, labels in accounts for status in ('created', 'existing')])
+        metric('djangregator_account_queries',
+            'Database queries made by the last fetch of each account.',
+            [(labels, m.queries) for m, labels in accounts])
+        metric('djangregator_account_http_requests',
+            'HTTP requests made by the last fetch of each account.',
+            [(labels, m.http_requests) for m, labels in accounts])
+        metric('djangregator_account_http_bytes',
+            'HTTP bytes received by the last fetch of each account.',
+            [(labels, m.http_bytes) for m, labels in accounts])
+        metric('djangregator_account_parse_failures',
+            'Timestamps which could not be parsed in the last fetch of each account.',
+            [(labels, m.parse_failures) for m, labels in accounts])
+        metric('djangregator_account_failed',
+            'Whether the last fetch of each account failed.',
+            [(labels, int(m.failed)) for m, labels in accounts])
+        metric('djangregator_account_deferred',
+            'Whether the last fetch of each account was deferred.',
+            [(labels, int(m.deferred)) for m, labels in accounts])
+        return u'\n'.join(lines) + u'\n'
+    
+    def emit(self, result):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix='.djangregator')
+        try:
+            try:
+                os.write(fd, self.render(result).encode('utf-8'))
+            finally:
+                os.close(fd)
+            os.chmod(tmp, 0644)
+            os.rename(tmp, self.path)
+        except:
+            # leave the previous file in place, and no half-written copy
+            os.unlink(tmp)
+            raise
+
+
+def configured_sinks():
+    """
+    Instantiates the sinks listed in the DJANGREGATOR_METRICS setting, a
+    sequence of (dotted class path, keyword arguments) pairs::
+    
+        DJANGREGATOR_METRICS = (
+            ('djangregator.metrics.JSONLinesSink', {'path': '/var/log/djangregator.jsonl'}),
+        )
+    """
+    sinks = []
+    for path, kwargs in getattr(settings, 'DJANGREGATOR_METRICS', ()):
+        module, name = path.rsplit('.', 1)
+        sinks.append(getattr(import_module(module), name)(**kwargs))
+    return sinks
@@ -32,12 +32,51 @@ from django.db import models
 from django.db.models import signals
 from django.contrib.contenttypes import generic
 from django.contrib.contenttypes.models import ContentType
+from djangregator import registry
+from djangregator.signals import timeline_updated
 from datetime import datetime
 
 ##############################################################################
 # Common/Abstract Djangregator Models
 ##############################################################################
 
+def resolve_content_objects(entries):
+    """
+    Fills in content_object on each of the given timeline entries, issuing
+    one in_bulk() query per service model instead of one query per entry.
+    Returns the entries as a list.
+    """
+    entries = list(entries)
+    by_type = {}
+    for entry in entries:
+        by_type.setdefault(entry.content_type_id, []).append(entry)
+    
+    cache_attr = TimelineEntry.content_object.cache_attr
+    for content_type_id, group in by_type.items():
+        model = ContentType.objects.get_for_id(content_type_id).model_class()
+        objects = model._default_manager.in_bulk([entry.object_id for entry in group])
+        for entry in group:
+            setattr(entry, cache_attr, objects.get(entry.object_id))
+    return entries
+
+
+class TimelineEntryQuerySet(models.query.QuerySet):
+    def resolve(self):
+        """
+        Evaluates the queryset, resolving the content_object of every entry
+        in one query per service. See resolve_content_objects().
+        """
+        return resolve_content_objects(self)
+
+
+class TimelineEntryManager(models.Manager):
+    def get_query_set(self):
+        return TimelineEntryQuerySet(self.model, using=self._db)
+    
+    def resolve(self):
+        return self.get_query_set().resolve()
+
+
 class TimelineEntry(models.Model):
     """
     Generically related to an entry from any online service.
@@ -47,22 +86,47 @@ class TimelineEntry(models.Model):
     published = models.DateTimeField()
     content_object = generic.GenericForeignKey('content_type', 'object_id')
     
+    # Copied from the related entry so that timelines can be rendered
+    # without resolving content_object.
+    persona = models.ForeignKey('OnlinePersona', null=True, blank=True, related_name='timeline')
+    service = models.CharField(max_length=50, blank=True)
+    title = models.CharField(max_length=255, null=True, blank=True)
+    link = models.URLField(max_length=255, verify_exists=False, null=True, blank=True)
+    thumbnail = models.URLField(max_length=255, verify_exists=False, null=True, blank=True)
+    
+    objects = TimelineEntryManager()
+    
     class Meta:
         ordering = ['-published']
         get_latest_by = 'published'
+        unique_together = (('content_type', 'object_id'),)
         verbose_name = 'Timeline Entry'
         verbose_name_plural = 'Timeline Entries'
     
     def __unicode__(self):
+        if self.service:
+            return self.title or self.link or u''
         return self.content_object.__str__()
 
 
+class OnlinePersonaManager(models.Manager):
+    def with_accounts(self):
+        """
+        Returns a queryset of personas whose accounts are all fetched
+        up-front, using one query per service rather than per persona.
+        """
+        return self.get_query_set().prefetch_related(
+            *[service.account_relation for service in registry.services()])
+
+
 class OnlinePersona(models.Model):
     """
     Generically related to one or more different service accounts.
     """
     name = models.CharField(null=False, blank=False, max_length=100)
     
+    objects = OnlinePersonaManager()
+    
     class Meta:
         ordering = ['name',]
         verbose_name = "Online Persona"
@@ -72,13 +136,77 @@ class OnlinePersona(models.Model):
         return self.name
     
     def accounts(self):
-        related_managers = [getattr(self, method) for method in dir(self) if method.endswith('_accounts')]
+        """
+        Returns a list of this persona's accounts across all services. Uses
+        the prefetched accounts when the persona came from
+        OnlinePersona.objects.with_accounts().
+        """
         accounts = []
-        for related in related_managers:
-            for account in related.iterator():
-                accounts.append(account)
+        for service in registry.services():
+            accounts.extend(getattr(self, service.account_relation).all())
         return accounts
-            
+
+
+class SyncStateManager(models.Manager):
+    def for_account(self, account):
+        """
+        Returns the sync state of the given service account, creating an
+        empty one if the account has never been synchronized.
+        """
+        state, created = self.get_or_create(
+            content_type=ContentType.objects.get_for_model(type(account)),
+            object_id=account.pk)
+        return state
+
+
+class SyncState(models.Model):
+    """
+    Remembers how far a single service account has been synchronized, so
+    that each fetch only asks for activity that is newer than what was seen
+    last time.
+    """
+    content_type = models.ForeignKey(ContentType)
+    object_id = models.PositiveIntegerField()
+    account = generic.GenericForeignKey('content_type', 'object_id')
+    last_id = models.BigIntegerField(null=True, blank=True)
+    last_published = models.DateTimeField(null=True, blank=True)
+    etag = models.CharField(max_length=255, blank=True)
+    last_modified = models.CharField(max_length=64, blank=True)
+    last_success = models.DateTimeField(null=True, blank=True)
+    backfill_cursor = models.BigIntegerField(null=True, blank=True,
+        help_text="Where an unfinished history backfill resumes from")
+    leased_by = models.CharField(max_length=100, blank=True,
+        help_text="The fetch process which last leased the account")
+    leased_until = models.DateTimeField(null=True, blank=True)
+    
+    objects = SyncStateManager()
+    
+    class Meta:
+        unique_together = (('content_type', 'object_id'),)
+        verbose_name = 'Sync State'
+        verbose_name_plural = 'Sync States'
+    
+    def __unicode__(self):
+        return u'%s #%s' % (self.content_type, self.object_id)
+    
+    def advance(self, rows, id_field=None):
+        """
+        Moves the cursor past the given rows (as handed to ingest()). If
+        ``id_field`` is given, the highest value of that field is remembered
+        as ``last_id``. The state is not saved.
+        """
+        for row in rows:
+            if self.last_published is None or row['published'] > self.last_published:
+                self.last_published = row['published']
+            if id_field and (self.last_id is None or row[id_field] > self.last_id):
+                self.last_id = row[id_field]
+    
+    def mark_success(self):
+        """
+        Records a successful sync and saves the state.
+        """
+        self.last_success = datetime.now()
+        self.save()
 
 
 class AbstractActivityEntry(models.Model):
@@ -86,7 +214,7 @@ class AbstractActivityEntry(models.Model):
     An abstract base class which encapsulates the common information which
     describes activities from all sources of online activity.
     """
-    published = models.DateTimeField(null=False, blank=False)
+    published = models.DateTimeField(null=False, blank=False, db_index=True)
     title = models.CharField(max_length=255, null=True, blank=True)
     link = models.URLField(max_length=255, verify_exists=False, null=True, blank=True)
     timelineentry = generic.GenericRelation(TimelineEntry)
@@ -98,6 +226,29 @@ class AbstractActivityEntry(models.Model):
         
     def __unicode__(self):
         return self.title or self.link
+    
+    def thumbnail_link(self):
+        return None
+    
+    def summary(self):
+        """
+        Returns a plain-text summary of the activity, used in syndication
+        feeds.
+        """
+        return self.title or u''
+    
+    def timeline_values(self):
+        """
+        Returns the field values which are copied onto this entry's
+        TimelineEntry.
+        """
+        return {
+            'persona_id': self.account.persona_id,
+            'service': self.servicename,
+            'title': self.title,
+            'link': self.link,
+            'thumbnail': self.thumbnail_link(),
+        }
 
 
 class AbstractServiceAccount(models.Model):
@@ -143,13 +294,26 @@ class TwitterStatus(AbstractActivityEntry):
     Represents a single tweet from Twitter.
     """
     account = models.ForeignKey(TwitterAccount, related_name="tweets")
-    twitter_id = models.PositiveIntegerField(blank=False, null=False, unique=True)
+    twitter_id = models.BigIntegerField(blank=False, null=False, unique=True)
+    html = models.TextField(blank=True, editable=False,
+        help_text="The tweet rendered as HTML, when pre-rendered at fetch time")
     
     class Meta(AbstractActivityEntry.Meta):
         verbose_name = 'Twitter Status'
         verbose_name_plural = 'Twitter Statuses'    
     
     servicename = u'twitter'
+    
+    def as_html(self):
+        """
+        Returns the tweet as HTML with its @mentions, #hashtags and URLs
+        linked, using the pre-rendered copy when there is one.
+        """
+        from django.utils.safestring import mark_safe
+        if self.html:
+            return mark_safe(self.html)
+        from djangregator import tweetmarkup
+        return tweetmarkup.render(self.title or u'')
 
 ##############################################################################
 # Delicious
@@ -177,10 +341,14 @@ class DeliciousLink(AbstractActivityEntry):
     description = models.TextField(blank=True)
     
     class Meta(AbstractActivityEntry.Meta):
+        unique_together = (('account', 'link', 'published'),)
         verbose_name = 'Delicious Link'
         verbose_name_plural = 'Delicious Links'
     
     servicename = u'delicious'
+    
+    def summary(self):
+        return self.description or self.title or u''
 
 
 
@@ -213,7 +381,7 @@ class FlickrPhoto(AbstractActivityEntry):
     Represents a single photo from Flickr.
     """
     account = models.ForeignKey(FlickrAccount, related_name="photos")
-    photo_id = models.PositiveIntegerField(blank=False, null=False, unique=True)
+    photo_id = models.BigIntegerField(blank=False, null=False, unique=True)
     square_thumb_link = models.URLField(max_length=255, verify_exists=False, null=True, blank=True)
     image_500px_link = models.URLField(max_length=255, verify_exists=False, null=True, blank=True)
     taken_on_date = models.DateTimeField(blank=True, default=datetime.now)
@@ -223,6 +391,9 @@ class FlickrPhoto(AbstractActivityEntry):
         verbose_name_plural = 'Flickr Photos'
     
     servicename = u'flickr'
+    
+    def thumbnail_link(self):
+        return self.square_thumb_link
 
 ##############################################################################
 # Signals
@@ -231,18 +402,43 @@ class FlickrPhoto(AbstractActivityEntry):
 def update_timeline(sender, instance, created, raw, **kwargs):
     """
     Post-save handler which creates or updates TimelineEntry instances
-    whenever service-specific model instances are saved.
+    whenever service-specific model instances are saved. The write is
+    batched with the others of an enclosing maintenance.deferred() block;
+    see djangregator.maintenance.
+    """
+    from djangregator import maintenance
+    maintenance.queue(instance)
+
+
+def expire_timeline(sender, instance=None, personas=None, **kwargs):
+    """
+    Expires the cached timeline pages of personas whose timelines changed,
+    whether through saving a TimelineEntry or through a timeline_updated
+    signal.
+    
+    Deletions aren't hooked up: they come in batches, and every code path
+    which deletes timeline entries sends one timeline_updated for the whole
+    batch instead of expiring the cache once per row.
     """
-    if created:
-        item = TimelineEntry()
-        item.content_type = ContentType.objects.get_for_model(type(instance))
-        item.object_id = instance.id
-    else:
-        item = instance.timelineentry.all()[0]
-    item.published = instance.published
-    item.save()
+    from djangregator import timeline
+    if instance is not None:
+        personas = [instance.persona_id]
+    timeline.invalidate([persona for persona in personas or [] if persona])
+
+
+signals.post_save.connect(expire_timeline, TimelineEntry,
+    dispatch_uid='djangregator.models.expire_timeline')
+timeline_updated.connect(expire_timeline,
+    dispatch_uid='djangregator.models.expire_timeline')
 
 
-for source in [TwitterStatus, DeliciousLink, FlickrPhoto,]:
-    signals.post_save.connect(update_timeline, source,
-        dispatch_uid='djangregator.models')
\ No newline at end of file
+##############################################################################
+# Built-in services
+##############################################################################
+
+registry.register('twitter', TwitterAccount, TwitterStatus,
+    'djangregator.services.twitter.fetch')
+registry.register('delicious', DeliciousAccount, DeliciousLink,
+    'djangregator.services.delicious.fetch')
+registry.register('flickr', FlickrAccount, FlickrPhoto,
+    'djangregator.services.flickr.fetch')
@@ -0,0 +1,70 @@
+# Copyright (c) 2008, Idan Gazit
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#     * Neither the name of the author nor the names of other
+#       contributors may be used to endorse or promote products derived
+#       from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Helpers for walking paginated service APIs one page at a time.
+"""
+
+from django.conf import settings
+
+def paging_options(service, page_size, max_pages):
+    """
+    Returns a (page_size, max_pages) tuple for the given service. The
+    defaults passed in can be overridden per service through the
+    DJANGREGATOR_PAGING setting, e.g.::
+    
+        DJANGREGATOR_PAGING = {
+            'flickr': {'page_size': 250, 'max_pages': 40},
+        }
+    
+    A max_pages of None means there is no limit.
+    """
+    options = getattr(settings, 'DJANGREGATOR_PAGING', {}).get(service, {})
+    return (options.get('page_size', page_size),
+            options.get('max_pages', max_pages))
+
+
+def walk(fetch_page, cursor, max_pages=None):
+    """
+    Generator which walks a paginated API, yielding an (items, next_cursor)
+    tuple for each page. ``fetch_page(cursor)`` must return the items on the
+    page at ``cursor`` along with the cursor of the following page, or None
+    if it was the last one.
+    
+    Only one page is held in memory at a time. The walk stops after
+    ``max_pages`` pages; the last next_cursor yielded is where a later walk
+    should resume.
+    """
+    pages = 0
+    while cursor is not None and (max_pages is None or pages < max_pages):
+        items, next_cursor = fetch_page(cursor)
+        pages += 1
+        yield (items, next_cursor)
+        cursor = next_cursor
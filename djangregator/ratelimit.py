@@ -0,0 +1,391 @@
+# Copyright (c) 2008, Idan Gazit
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#     * Neither the name of the author nor the names of other
+#       contributors may be used to endorse or promote products derived
+#       from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Rate limiting, backoff and circuit breaking for requests to the services.
+
+Every request a backend makes goes through call(), which first takes a token
+from the service's token bucket (one bucket per service and API key, shared
+by every fetch worker in the process), then makes the request. When the
+service says we are over its limit -- through a 420, 429 or 503 response, a
+rate-limit error, or rate-limit headers saying there is nothing left -- the
+bucket is held shut for as long as the service asked, or for an exponential
+backoff with jitter which keeps growing for as long as the service keeps
+refusing, and the request is retried a few times before giving up with
+RateLimited. Rather than tie up a fetch worker, a request which would have to
+wait longer than ``max_wait`` seconds gives up with RateLimited at once.
+
+Each service also has a circuit breaker. After several accounts in a row
+fail because the service is throttling or unreachable, the breaker opens and
+the remaining accounts of that service are deferred rather than fetched,
+until a cooldown has passed.
+
+Limits are set per service in your settings.py, e.g.::
+
+    DJANGREGATOR_RATE_LIMITS = {
+        'twitter': {'requests_per_hour': 150, 'burst': 10},
+    }
+"""
+
+from django.conf import settings
+from djangregator import metrics
+from email.utils import parsedate_tz, mktime_tz
+import httplib
+import random
+import socket
+import threading
+import time
+import urllib2
+
+DEFAULT_RATE_LIMIT = {
+    'requests_per_hour': 3600,
+    'burst': 5,
+    'retries': 3,
+    'max_backoff': 900,
+    'max_wait': 30,
+    'failures': 3,
+    'cooldown': 600,
+}
+
+SERVICE_RATE_LIMITS = {
+    'twitter': {'requests_per_hour': 70},
+    'flickr': {'requests_per_hour': 3600},
+    'delicious': {'requests_per_hour': 3600},
+}
+
+RATE_LIMITED_STATUSES = (420, 429, 503)
+
+_buckets = {}
+_breakers = {}
+_lock = threading.Lock()
+
+
+class RateLimited(Exception):
+    """
+    Raised when a service keeps refusing requests because we are over its
+    rate limit. ``retry_after`` is how long it asked us to wait, in seconds.
+    """
+    def __init__(self, message, retry_after=None):
+        Exception.__init__(self, message)
+        self.retry_after = retry_after
+
+
+def rate_limit_options(service):
+    """
+    Returns the rate-limiting options for the given service: the built-in
+    defaults, overridden by the DJANGREGATOR_RATE_LIMITS setting.
+    """
+    options = dict(DEFAULT_RATE_LIMIT)
+    options.update(SERVICE_RATE_LIMITS.get(service, {}))
+    options.update(getattr(settings, 'DJANGREGATOR_RATE_LIMITS', {}).get(service, {}))
+    return options
+
+
+class TokenBucket(object):
+    """
+    Allows ``rate`` requests per second on average, in bursts of at most
+    ``burst``. Safe to share between threads.
+    """
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.time()
+        self.held_until = 0
+        self.strikes = 0
+        self._lock = threading.Lock()
+    
+    def reserve(self):
+        """
+        Takes a token, and returns how many seconds the caller has to wait
+        before using it.
+        """
+        self._lock.acquire()
+        try:
+            now = time.time()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = 0
+            if self.tokens < 0:
+                wait = -self.tokens / self.rate
+            return max(wait, self.held_until - now)
+        finally:
+            self._lock.release()
+    
+    def acquire(self):
+        """
+        Waits for a token. Returns the number of seconds waited.
+        """
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+    
+    def hold(self, seconds):
+        """
+        Hands out no tokens for the next ``seconds``.
+        """
+        self._lock.acquire()
+        try:
+            self.held_until = max(self.held_until, time.time() + seconds)
+        finally:
+            self._lock.release()
+    
+    def held_for(self):
+        """
+        Returns the number of seconds until the bucket is no longer held.
+        """
+        return max(0, self.held_until - time.time())
+    
+    def strike(self):
+        """
+        Records a request refused for being over the rate limit. Returns
+        how many were refused in a row before this one.
+        """
+        self._lock.acquire()
+        try:
+            self.strikes += 1
+            return self.strikes - 1
+        finally:
+            self._lock.release()
+
+
+class CircuitBreaker(object):
+    """
+    Opens after ``threshold`` consecutive failures, and stays open for
+    ``cooldown`` seconds. After that one trial is let through, which closes
+    the breaker if it succeeds and reopens it if it fails.
+    """
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened = None
+        self._lock = threading.Lock()
+    
+    def allow(self):
+        """
+        Returns True if a request may be made.
+        """
+        self._lock.acquire()
+        try:
+            if self.opened is None:
+                return True
+            if time.time() - self.opened >= self.cooldown:
+                # let one trial through, keeping the rest out until it's done
+                self.opened = time.time()
+                return True
+            return False
+        finally:
+            self._lock.release()
+    
+    def retry_after(self):
+        """
+        Returns the number of seconds until the breaker lets a trial through.
+        """
+        if self.opened is None:
+            return 0
+        return max(0, self.opened + self.cooldown - time.time())
+    
+    def success(self):
+        self._lock.acquire()
+        try:
+            self.failures = 0
+            self.opened = None
+        finally:
+            self._lock.release()
+    
+    def failure(self):
+        self._lock.acquire()
+        try:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened = time.time()
+        finally:
+            self._lock.release()
+
+
+def bucket(service, key=None):
+    """
+    Returns the token bucket of the given service and API key.
+    """
+    _lock.acquire()
+    try:
+        if (service, key) not in _buckets:
+            options = rate_limit_options(service)
+            _buckets[(service, key)] = TokenBucket(
+                options['requests_per_hour'] / 3600.0, options['burst'])
+        return _buckets[(service, key)]
+    finally:
+        _lock.release()
+
+
+def breaker(service):
+    """
+    Returns the circuit breaker of the given service.
+    """
+    _lock.acquire()
+    try:
+        if service not in _breakers:
+            options = rate_limit_options(service)
+            _breakers[service] = CircuitBreaker(options['failures'], options['cooldown'])
+        return _breakers[service]
+    finally:
+        _lock.release()
+
+
+def reset():
+    """
+    Forgets every bucket and breaker.
+    """
+    _lock.acquire()
+    try:
+        _buckets.clear()
+        _breakers.clear()
+    finally:
+        _lock.release()
+
+
+def backoff(attempt, cap):
+    """
+    Returns the delay after ``attempt`` requests in a row (counting from 0)
+    were refused: an exponentially growing ceiling of at most ``cap``
+    seconds, with full jitter so that workers which were throttled together
+    don't retry together.
+    """
+    return random.uniform(0, min(cap, 2 ** attempt))
+
+
+def _headers(obj):
+    """
+    Returns the lower-cased response headers carried by a response or an
+    HTTP error, if any.
+    """
+    headers = getattr(obj, 'headers', None)
+    if headers is None and isinstance(obj, urllib2.HTTPError):
+        headers = obj.info()
+    if not headers:
+        return {}
+    return dict([(name.lower(), value) for name, value in headers.items()])
+
+
+def rate_limit_delay(headers):
+    """
+    Returns how long the rate-limit headers of a response ask us to wait, in
+    seconds, or None if they don't. Understands Retry-After and the
+    X-RateLimit-Remaining / X-RateLimit-Reset pair.
+    """
+    retry_after = headers.get('retry-after')
+    if retry_after:
+        if retry_after.isdigit():
+            return int(retry_after)
+        parsed = parsedate_tz(retry_after)
+        if parsed:
+            return max(0, mktime_tz(parsed) - time.time())
+    remaining = headers.get('x-ratelimit-remaining')
+    reset = headers.get('x-ratelimit-reset')
+    if remaining == '0' and reset and reset.isdigit():
+        return max(0, int(reset) - time.time())
+    return None
+
+
+def is_rate_limited(error):
+    """
+    Returns True if ``error`` says we are over the service's rate limit.
+    """
+    if isinstance(error, RateLimited):
+        return True
+    status = getattr(error, 'status', None) or getattr(error, 'code', None)
+    if status in RATE_LIMITED_STATUSES:
+        return True
+    return 'rate limit' in repr(error).lower()
+
+
+def is_service_failure(error):
+    """
+    Returns True if ``error`` says the service itself is in trouble -- it is
+    throttling us, failing or unreachable -- rather than that something is
+    wrong with one account.
+    """
+    if is_rate_limited(error):
+        return True
+    if isinstance(error, (socket.error, httplib.HTTPException, urllib2.URLError)):
+        if isinstance(error, urllib2.HTTPError):
+            return error.code >= 500
+        return True
+    status = getattr(error, 'status', None)
+    return isinstance(status, int) and status >= 500
+
+
+def call(service, key, func, *args, **kwargs):
+    """
+    Makes a request to ``service`` by calling ``func(*args, **kwargs)``
+    once the token bucket of the service and ``key`` allows it. Requests
+    refused for being over the rate limit are retried after a backoff; when
+    the retries run out RateLimited is raised. It is raised straight away,
+    without sleeping, when the service asks for a break of more than the
+    ``max_wait`` option.
+    
+    The backoff is counted across calls, from the first of the refusals in
+    a row for the service and ``key``, so that it keeps growing up to the
+    ``max_backoff`` option while the service keeps refusing.
+    
+    Time spent waiting for the bucket is charged to the 'throttle' phase of
+    the active metrics.
+    """
+    options = rate_limit_options(service)
+    limiter = bucket(service, key)
+    attempt = 0
+    while True:
+        held = limiter.held_for()
+        if held > options['max_wait']:
+            raise RateLimited("%s: held back for another %d seconds" % (service, held), held)
+        with metrics.phase('throttle'):
+            limiter.acquire()
+        try:
+            result = func(*args, **kwargs)
+        except Exception, e:
+            if not is_rate_limited(e):
+                raise
+            strikes = limiter.strike()
+            delay = rate_limit_delay(_headers(e))
+            if delay is None:
+                delay = backoff(strikes, options['max_backoff'])
+            limiter.hold(delay)
+            if attempt >= options['retries'] or delay > options['max_wait']:
+                raise RateLimited("%s: %s" % (service, e), delay)
+            attempt += 1
+            continue
+        limiter.strikes = 0
+        delay = rate_limit_delay(_headers(result))
+        if delay:
+            limiter.hold(delay)
+        return result
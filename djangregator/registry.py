@@ -0,0 +1,135 @@
+# Copyright (c) 2008, Idan Gazit
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#     * Neither the name of the author nor the names of other
+#       contributors may be used to endorse or promote products derived
+#       from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+The registry of online services which djangregator knows how to fetch.
+
+Each service maps a name (the ``service`` attribute of its account model) to
+its account model, its activity model and the callable which fetches new
+activity for an account. The built-in services are registered by
+djangregator.models. Third-party services register themselves with
+register() from any module listed in the DJANGREGATOR_SERVICES setting; those
+modules are imported once, the first time the registry is consulted.
+"""
+
+from django.conf import settings
+from django.db.models import signals
+from django.utils.importlib import import_module
+import threading
+
+class Service(object):
+    """
+    A single registered online service.
+    """
+    def __init__(self, name, account_model, activity_model, fetch):
+        self.name = name
+        self.account_model = account_model
+        self.activity_model = activity_model
+        self.account_relation = account_model._meta.get_field('persona').rel.related_name
+        self._fetch = fetch
+    
+    def __repr__(self):
+        return '<Service: %s>' % self.name
+    
+    @property
+    def fetch(self):
+        """
+        The service's fetch callable. When it was registered as a dotted
+        path, the backend module is imported on first access only, and may
+        raise ImportError.
+        """
+        if isinstance(self._fetch, basestring):
+            module, attr = self._fetch.rsplit('.', 1)
+            self._fetch = getattr(import_module(module), attr)
+        return self._fetch
+
+
+_services = []
+_by_name = {}
+_loaded = False
+_lock = threading.RLock()
+
+
+def register(name, account_model, activity_model, fetch):
+    """
+    Registers an online service. ``fetch`` is either a callable taking an
+    account and returning a (created, existing) tuple, or the dotted path
+    to one.
+    
+    The activity model's saves are hooked up to the timeline.
+    """
+    from djangregator.models import update_timeline
+    _lock.acquire()
+    try:
+        if name in _by_name:
+            _services.remove(_by_name[name])
+        service = Service(name, account_model, activity_model, fetch)
+        _services.append(service)
+        _by_name[name] = service
+    finally:
+        _lock.release()
+    signals.post_save.connect(update_timeline, activity_model,
+        dispatch_uid='djangregator.models')
+
+
+def _load():
+    global _loaded
+    if _loaded:
+        return
+    _lock.acquire()
+    try:
+        if _loaded:
+            return
+        import djangregator.models
+        for path in getattr(settings, 'DJANGREGATOR_SERVICES', ()):
+            import_module(path)
+        # Only once every module imported, so that a failed import is
+        # retried (and raised again) by the next caller instead of leaving
+        # the registry half loaded.
+        _loaded = True
+    finally:
+        _lock.release()
+
+
+def services():
+    """
+    Returns a list of all registered services, in registration order.
+    """
+    _load()
+    return list(_services)
+
+
+def get(name):
+    """
+    Returns the registered service with the given name. Raises KeyError if
+    there is none.
+    """
+    _load()
+    return _by_name[name]
@@ -0,0 +1,193 @@
+# Copyright (c) 2008, Idan Gazit
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#     * Neither the name of the author nor the names of other
+#       contributors may be used to endorse or promote products derived
+#       from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Retention of old activity.
+
+Each service can be given a retention policy in your settings.py, keeping
+only the activity of the last so many days, and at most so many of the
+newest items of each account::
+
+    DJANGREGATOR_RETENTION = {
+        'twitter': {'days': 365},
+        'flickr': {'items': 1000},
+        'delicious': {'days': 730, 'items': 5000},
+    }
+    DJANGREGATOR_ARCHIVE_DIR = '/var/lib/djangregator/archive'
+
+Activity outside of a policy is removed, a chunk at a time, together with
+its timeline entries. When DJANGREGATOR_ARCHIVE_DIR is set, every removed
+item is first written to a gzipped JSON lines file there (one per service
+per run), in the format of Django's "python" serializer.
+"""
+
+from django.conf import settings
+from django.core import serializers
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import simplejson as json
+from django.utils import timezone
+from djangregator import maintenance, registry
+from datetime import timedelta
+import gzip
+import logging
+import os
+import time
+
+logger = logging.getLogger("Retention")
+
+DEFAULT_CHUNK_SIZE = 1000
+
+
+def retention_policy(service):
+    """
+    Returns the retention policy of the given service, a dictionary which
+    may hold 'days' and 'items', or None to keep everything.
+    """
+    return getattr(settings, 'DJANGREGATOR_RETENTION', {}).get(service)
+
+
+class Archive(object):
+    """
+    A gzipped JSON lines file which removed activity is written to. The
+    file is only created once something is written, and is flushed to disk
+    after every chunk, before the chunk is deleted.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.written = 0
+    
+    def __call__(self, instances):
+        if self.file is None:
+            self.raw = open(self.path, 'ab')
+            self.file = gzip.GzipFile(fileobj=self.raw, mode='ab')
+        for record in serializers.serialize('python', instances):
+            self.file.write(json.dumps(record, cls=DjangoJSONEncoder) + '\n')
+        self.file.flush()
+        self.raw.flush()
+        os.fsync(self.raw.fileno())
+        self.written += len(instances)
+    
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.raw.close()
+            self.file = None
+
+
+def cutoff(activity_model, account, policy, now=None):
+    """
+    Returns the publication time before which the account's activity falls
+    outside of ``policy``, or None if all of it is kept.
+    """
+    candidates = []
+    if policy.get('days'):
+        candidates.append((now or timezone.now()) - timedelta(days=policy['days']))
+    if policy.get('items'):
+        # the last item within the limit and the first beyond it, found
+        # through the index on (account, published)
+        items = policy['items']
+        boundary = list(activity_model.objects.filter(account=account)
+            .order_by('-published').values_list('published', flat=True)[items - 1:items + 1])
+        if len(boundary) == 2:
+            # anything older than the last item kept goes, though items
+            # published at the same time as it stay
+            candidates.append(boundary[0])
+    if not candidates:
+        return None
+    return max(candidates)
+
+
+def backfill_cutoff(service, account, now=None):
+    """
+    Returns the publication time before which a backfill of the account's
+    history need not go, as the service's retention policy would remove
+    anything older; or None if all of it is kept.
+    """
+    policy = retention_policy(service)
+    if not policy:
+        return None
+    return cutoff(registry.get(service).activity_model, account, policy, now)
+
+
+def apply_policy(services=None, accounts=None, archive_dir=None, dry_run=False,
+                 chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Removes the activity which falls outside of its service's retention
+    policy, from the given ``services`` (names; by default every service
+    with a policy) or just from the given ``accounts``. ``archive_dir``
+    overrides the DJANGREGATOR_ARCHIVE_DIR setting. With ``dry_run``
+    nothing is archived or removed.
+    
+    Returns a dictionary of the number of items removed (or, with
+    ``dry_run``, to be removed) from each service.
+    """
+    if archive_dir is None:
+        archive_dir = getattr(settings, 'DJANGREGATOR_ARCHIVE_DIR', None)
+    if accounts is None:
+        accounts = []
+        for service in registry.services():
+            if services is None or service.name in services:
+                accounts.extend(service.account_model._default_manager.all())
+    
+    by_service = {}
+    for account in accounts:
+        by_service.setdefault(account.service, []).append(account)
+    
+    removed = {}
+    now = timezone.now()
+    for name, service_accounts in by_service.items():
+        policy = retention_policy(name)
+        if not policy:
+            continue
+        model = registry.get(name).activity_model
+        archive = None
+        if archive_dir and not dry_run:
+            archive = Archive(os.path.join(archive_dir, '%s-%s-%d.jsonl.gz' %
+                (name, time.strftime('%Y%m%dT%H%M%S'), os.getpid())))
+        removed[name] = 0
+        try:
+            for account in service_accounts:
+                before = cutoff(model, account, policy, now)
+                if before is None:
+                    continue
+                old = model.objects.filter(account=account, published__lt=before)
+                if dry_run:
+                    count = old.count()
+                else:
+                    count = maintenance.delete_entries(old, chunk_size, archive)
+                if count:
+                    logger.info('%s account "%s": %s %d items published before %s.' %
+                        (name, account, dry_run and 'would remove' or 'removed', count, before))
+                removed[name] += count
+        finally:
+            if archive is not None:
+                archive.close()
+    return removed
@@ -0,0 +1,279 @@
+# Copyright (c) 2008, Idan Gazit
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#     * Neither the name of the author nor the names of other
+#       contributors may be used to endorse or promote products derived
+#       from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+A long-running alternative to calling fetch() from cron.
+
+The scheduler keeps every active account in a priority queue ordered by the
+time of its next fetch. Each account has its own polling interval, which is
+halved whenever a fetch finds new activity and doubled whenever it doesn't,
+within per-service bounds. Fetches are also spaced out so that no service is
+asked for more than its hourly request budget, which is the requests_per_hour
+of its rate limit (see djangregator.ratelimit).
+"""
+
+from django.conf import settings
+from django.db import reset_queries
+from djangregator.models import OnlinePersona
+from djangregator.fetch import apply_retention, close_connection, execute, load_backends, emit
+from djangregator.sharding import in_shard
+from djangregator.ratelimit import rate_limit_options
+from djangregator import metrics
+import heapq
+import logging
+import signal
+import time
+
+# Intervals are in seconds.
+DEFAULT_SCHEDULE = {
+    'interval': 900,
+    'min_interval': 300,
+    'max_interval': 6 * 3600,
+}
+
+# How long to wait before trying again after a round of fetching failed.
+ERROR_DELAY = 60
+
+logger = logging.getLogger("Scheduler")
+
+
+def schedule_options(service):
+    """
+    Returns the scheduling options for the given service: the built-in
+    defaults, overridden by the DJANGREGATOR_SCHEDULE setting, e.g.::
+    
+        DJANGREGATOR_SCHEDULE = {
+            'twitter': {'interval': 600, 'max_interval': 3600},
+        }
+    
+    The request budget, ``requests_per_hour``, comes from the service's rate
+    limit unless the setting gives one.
+    """
+    options = dict(DEFAULT_SCHEDULE)
+    options['requests_per_hour'] = rate_limit_options(service)['requests_per_hour']
+    options.update(getattr(settings, 'DJANGREGATOR_SCHEDULE', {}).get(service, {}))
+    return options
+
+
+class Scheduler(object):
+    """
+    Fetches each active account whenever it falls due, until stop() is
+    called or the process receives SIGINT or SIGTERM.
+    
+    ``workers``, ``timeout`` and ``sinks`` are as for fetch(); the metrics
+    of each round of due accounts are emitted as one FetchResult. The set of
+    accounts is reloaded from the database every ``refresh`` seconds, so
+    that accounts added or deactivated in the admin are picked up.
+    
+    Given a ``shard`` (an (index, count) tuple), the scheduler only fetches
+    that shard's share of the accounts; the request budgets apply to each
+    scheduler separately.
+    """
+    def __init__(self, workers=1, timeout=None, refresh=300, sinks=None, shard=None):
+        self.workers = workers
+        self.shard = shard
+        self.timeout = timeout
+        self.sinks = sinks
+        self.refresh_interval = refresh
+        self.stopping = False
+        self._queue = []
+        self._scheduled = set()
+        self._jobs = {}
+        self._intervals = {}
+        self._next_request = {}
+        self._next_refresh = 0
+        self._running = []
+    
+    def stop(self, *args):
+        if not self.stopping:
+            logger.info("Shutting down after the current fetches complete.")
+        self.stopping = True
+    
+    def refresh(self):
+        """
+        Reloads the active accounts. New accounts are due immediately.
+        """
+        jobs = {}
+        for persona in OnlinePersona.objects.with_accounts():
+            for account in persona.accounts():
+                if not account.active:
+                    continue
+                if self.shard is not None and not in_shard(account, *self.shard):
+                    continue
+                jobs[(account.service, account.pk)] = (persona, account)
+        
+        now = time.time()
+        for key in jobs:
+            if key not in self._scheduled:
+                self._intervals.setdefault(key, schedule_options(key[0])['interval'])
+                heapq.heappush(self._queue, (now, key))
+                self._scheduled.add(key)
+        self._jobs = jobs
+        self._next_refresh = now + self.refresh_interval
+        logger.debug("Scheduling %d active accounts." % len(jobs))
+    
+    def due(self, now):
+        """
+        Pops and returns the (persona, account) jobs which are due, pushing
+        back any whose service has used up its request budget.
+        """
+        jobs = []
+        deferred = []
+        while self._queue and self._queue[0][0] <= now:
+            when, key = heapq.heappop(self._queue)
+            if key not in self._jobs:
+                # the account was removed or deactivated
+                self._scheduled.discard(key)
+                continue
+            service = key[0]
+            allowed = self._next_request.get(service, 0)
+            if allowed > now:
+                deferred.append((allowed, key))
+                continue
+            # every fetch makes at least one request; the rest are charged
+            # once it is known how many it made.
+            self.charge(service, 1, now)
+            jobs.append(self._jobs[key])
+        for item in deferred:
+            heapq.heappush(self._queue, item)
+        return jobs
+    
+    def charge(self, service, requests, now=None):
+        """
+        Spends ``requests`` of the service's request budget, pushing back
+        the time at which its next fetch may start.
+        """
+        if now is None:
+            now = time.time()
+        options = schedule_options(service)
+        start = max(now, self._next_request.get(service, 0))
+        self._next_request[service] = start + requests * 3600.0 / options['requests_per_hour']
+    
+    def reschedule(self, account, stats):
+        """
+        Adapts the account's interval to the outcome of its last fetch (as
+        described by its AccountMetrics) and queues its next fetch.
+        """
+        key = (account.service, account.pk)
+        options = schedule_options(account.service)
+        interval = self._intervals.get(key, options['interval'])
+        if stats.http_requests > 1:
+            self.charge(account.service, stats.http_requests - 1)
+        if stats.deferred:
+            # the service is in trouble, not the account; try again soon
+            # without touching the account's interval.
+            heapq.heappush(self._queue, (time.time() + options['min_interval'], key))
+            logger.debug('Deferred fetch of %s account "%s".' % (account.service, account))
+            return
+        if not stats.failed and stats.created:
+            interval = max(options['min_interval'], interval / 2)
+        else:
+            interval = min(options['max_interval'], interval * 2)
+        self._intervals[key] = interval
+        heapq.heappush(self._queue, (time.time() + interval, key))
+        logger.debug('Next fetch of %s account "%s" in %d seconds.' % (account.service, account, interval))
+    
+    def sleep(self):
+        """
+        Sleeps until the next account falls due, waking every second to
+        check whether a shutdown was requested.
+        """
+        wake = self._next_refresh
+        if self._queue:
+            wake = min(wake, self._queue[0][0])
+        while not self.stopping and time.time() < wake:
+            time.sleep(min(1, max(0, wake - time.time())))
+    
+    def run(self):
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGTERM, self.stop)
+        logger.info("Scheduler started.")
+        load_backends()
+        
+        while not self.stopping:
+            try:
+                self.round()
+            except Exception:
+                # A failing round -- the database going away, say -- mustn't
+                # take the scheduler down with it.
+                logger.exception("Scheduler round failed; retrying in %d seconds." % ERROR_DELAY)
+                self.recover()
+            # Don't hold on to the connection or, with DEBUG on, to the
+            # log of every query made since startup.
+            close_connection()
+            reset_queries()
+            self.sleep()
+        
+        logger.info("Scheduler stopped.")
+    
+    def round(self):
+        """
+        Refreshes the accounts if it is time to, then fetches those which
+        are due and queues their next fetches.
+        """
+        if time.time() >= self._next_refresh:
+            self.refresh()
+        jobs = self.due(time.time())
+        # whatever is left in here when a round fails goes back in the queue
+        self._running = list(jobs)
+        if jobs:
+            result = metrics.FetchResult()
+            fetched = []
+            for persona, account, stats in execute(jobs, self.workers, self.timeout):
+                self._running.remove((persona, account))
+                result.add(stats)
+                self.reschedule(account, stats)
+                if not (stats.failed or stats.deferred):
+                    fetched.append(account)
+            apply_retention(fetched)
+            result.finish()
+            emit(result, self.sinks)
+        self._running = []
+    
+    def recover(self):
+        """
+        Puts the accounts of a failed round back in the queue, to be tried
+        again after ERROR_DELAY, and holds off the next refresh as long if
+        it was the refresh which failed.
+        """
+        retry = time.time() + ERROR_DELAY
+        for persona, account in self._running:
+            heapq.heappush(self._queue, (retry, (account.service, account.pk)))
+        self._running = []
+        if self._next_refresh <= time.time():
+            self._next_refresh = retry
+
+
+def run(workers=1, timeout=None, refresh=300, sinks=None, shard=None):
+    """
+    Runs a Scheduler in the current process until it receives SIGINT or
+    SIGTERM.
+    """
+    Scheduler(workers, timeout, refresh, sinks, shard).run()
@@ -28,48 +28,196 @@
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 
-from djangregator.models import DeliciousLink, DeliciousAccount
+from djangregator.models import DeliciousLink, SyncState
+from djangregator.ingest import ingest, DEFAULT_BATCH_SIZE
+from djangregator import httpclient, metrics, ratelimit, timestamps
+from itertools import islice
+from cStringIO import StringIO
+import codecs
 import logging
+import re
+
+try:
+    import json
+except ImportError:
+    import django.utils.simplejson as json
+
+try:
+    from xml.etree import cElementTree as ElementTree
+except ImportError:
+    from xml.etree import ElementTree
 
 logger = logging.getLogger("Delicious")
 
+FEED_URL = "http://feeds.delicious.com/v2/json/%s"
+
+# How much of a JSON document is read at a time.
+CHUNK_SIZE = 64 * 1024
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+ITEM_ENDS = (u' ', u'\t', u'\n', u'\r', u',', u']')
+
+def iter_json(fileobj, chunk_size=CHUNK_SIZE):
+    """
+    Yields the items of the JSON array in ``fileobj`` one at a time, reading
+    only as much of the file as the next item needs.
+    """
+    decoder = json.JSONDecoder()
+    reader = codecs.getreader('utf-8')(fileobj)
+    # ``pos`` walks through the buffer, which is only cut down to what is
+    # left of it when the next chunk is read, so every item costs one decode
+    # and no copying.
+    buf = u''
+    pos = 0
+    started = False
+    eof = False
+    while True:
+        pos = WHITESPACE.match(buf, pos).end()
+        char = buf[pos:pos + 1]
+        if char and not started:
+            if char != u'[':
+                raise ValueError("Expected a JSON array")
+            started = True
+            pos += 1
+            continue
+        if char == u']':
+            return
+        if char == u',':
+            pos += 1
+            continue
+        
+        end = None
+        if char:
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                pass
+        # an item which runs to the end of the buffer may have been cut
+        # short, and so may a number followed by anything but the end of
+        # the item (u'-1.' of u'-1.5'), so only trust it once what follows
+        # is in.
+        if end is None or (not eof and buf[end:end + 1] not in ITEM_ENDS):
+            if eof:
+                raise ValueError("Malformed or truncated JSON array")
+            chunk = reader.read(chunk_size)
+            eof = not chunk
+            buf = buf[pos:] + chunk
+            pos = 0
+            continue
+        pos = end
+        yield item
+
+
+def iter_xml(fileobj):
+    """
+    Yields the attributes of each <post> element of a Delicious or Pinboard
+    XML export, discarding every element once it has been read.
+    """
+    context = iter(ElementTree.iterparse(fileobj, events=('start', 'end')))
+    event, root = context.next()
+    for event, element in context:
+        if event == 'end' and element.tag == 'post':
+            yield dict(element.items())
+            root.clear()
+
+
+def bookmarks(items):
+    """
+    Turns bookmarks, either from the Delicious feed or from a Delicious or
+    Pinboard export, into rows for ingest().
+    """
+    for item in items:
+        if 'u' in item:
+            # feed: {"u": link, "d": title, "n": notes, "dt": date}
+            link, title, description, timestamp = item['u'], item.get('d'), item.get('n'), item['dt']
+        else:
+            # export: {"href": link, "description": title, "extended": notes, "time": date}
+            link, title, description, timestamp = item['href'], item.get('description'), item.get('extended'), item['time']
+        try:
+            published = timestamps.parse(timestamp, 'iso8601')
+        except timestamps.TimestampError, e:
+            logger.warning('Skipping bookmark %s: %s' % (link, e))
+            continue
+        yield {
+            'link': link,
+            'published': published,
+            'title': title,
+            'description': description or u'',
+        }
+
+
+def _save(account, state, rows, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Ingests the rows yielded by ``rows`` ``batch_size`` at a time, moving
+    the sync state past each batch. The state is not saved.
+    
+    Returns a tuple containing the number of items created, and the number of
+    items skipped because they already existed.
+    """
+    items_created = items_existing = 0
+    while True:
+        with metrics.phase('parse'):
+            batch = list(islice(rows, batch_size))
+        if not batch:
+            return (items_created, items_existing)
+        created, existing = ingest(DeliciousLink, account, batch,
+            key=('link', 'published'), batch_size=batch_size)
+        items_created += created
+        items_existing += existing
+        state.advance(batch)
+
+
 def fetch(account):
     """
     Fetch a list of recent bookmarks from the delicious servers using the
     supplied credentials, and save them to the DB.
     
+    The request is conditional on the validators saved from the previous
+    fetch, so an unchanged feed is neither downloaded nor parsed.
+    
     Returns a tuple containing the number of items created, and the number of 
     items updated or skipped.
     """
+    state = SyncState.objects.for_account(account)
+    response = ratelimit.call('delicious', None, httpclient.get,
+        FEED_URL % account.username, state=state)
+    if response.not_modified:
+        logger.debug('Feed for "%s" has not changed.' % account)
+        state.mark_success()
+        return (0, 0)
     
-    # python 2.6-safe import of json module:
-    try:
-        import simplejson as json
-    except ImportError:
-        try:
-            import json
-        except ImportError:
-            import django.utils.simplejson as json
-            
-    import urllib
-    import dateutil.parser
+    # _save() moves the state on after every batch, so compare against
+    # where the previous fetch left off rather than the state itself.
+    last_published = state.last_published
+    skipped = [0]
+    def new_rows():
+        for row in bookmarks(iter_json(StringIO(response.body))):
+            # the feed can't be asked for only new bookmarks, so skip anything
+            # older than the last sync without touching the DB.
+            if last_published and row['published'] < last_published:
+                skipped[0] += 1
+                continue
+            yield row
     
-    items_existing = 0
-    items_created = 0
-    feedurl = "http://feeds.delicious.com/v2/json/%s" % account.username
-    bookmarks = json.load(urllib.urlopen(feedurl))
-    for bookmark in bookmarks:
-        timestamp = dateutil.parser.parse(bookmark['dt'])
-        entry, created = DeliciousLink.objects.get_or_create(
-            account = account,
-            link = bookmark['u'],
-            published = timestamp)
-        if created:
-            entry.title = bookmark['d']
-            entry.description = bookmark['n']
-            entry.save()
-            items_created += 1
-        else:
-            items_existing += 1
+    items_created, existing = _save(account, state, new_rows())
+    state.mark_success()
+    return (items_created, skipped[0] + existing)
+
+
+def import_dump(account, fileobj, format='json', batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Imports the bookmarks in a Delicious or Pinboard export, in JSON or XML
+    ``format``, into ``account``. The file is read as it is ingested, so
+    exports of any size are imported in constant memory.
     
-    return (items_created, items_existing)
\ No newline at end of file
+    Returns a tuple containing the number of items created, and the number of 
+    items skipped because they already existed.
+    """
+    if format == 'xml':
+        items = iter_xml(fileobj)
+    else:
+        items = iter_json(fileobj)
+    state = SyncState.objects.for_account(account)
+    result = _save(account, state, bookmarks(items), batch_size)
+    state.save()
+    return result
@@ -28,70 +28,178 @@
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 
-from djangregator.models import FlickrPhoto, FlickrAccount
-from datetime import datetime
-from dateutil import parser
-import calendar
+from djangregator.models import FlickrPhoto, SyncState
+from djangregator.ingest import ingest
+from djangregator.paging import paging_options, walk
+from djangregator.clients import ClientPool
+from djangregator import metrics, ratelimit, retention, timestamps
+import flickrapi
 import logging
 
 logger = logging.getLogger("Flickr")
 
+# One client per (api key, api secret).
+clients = ClientPool(lambda key: flickrapi.FlickrAPI(key[0], key[1] or None, format='etree'))
+
+# username -> NSID, as looked up with people_findByUsername
+_nsids = {}
+
+EXTRAS = 'date_upload, date_taken'
+
+def _rows(account, photos):
+    with metrics.phase('parse'):
+        return _parse(account, photos)
+
+
+def _parse(account, photos):
+    rows = []
+    for photo in photos.getiterator('photo'):
+        photo_id = int(photo.attrib['id'])
+        try:
+            published = timestamps.parse(photo.attrib['dateupload'], 'unix')
+        except timestamps.TimestampError, e:
+            logger.warning('Skipping photo %s: %s' % (photo_id, e))
+            continue
+        try:
+            taken = timestamps.parse(photo.attrib['datetaken'], 'local')
+        except timestamps.TimestampError, e:
+            logger.warning('Photo %s has no date taken: %s' % (photo_id, e))
+            taken = published
+        base_url = u'http://farm%s.static.flickr.com/%s/%s_%s' % (
+            photo.attrib['farm'],
+            photo.attrib['server'],
+            photo_id,
+            photo.attrib['secret']            
+        )
+        rows.append({
+            'photo_id': photo_id,
+            'published': published,
+            'title': photo.attrib['title'],
+            'link': u'http://flickr.com/photos/%s/%s' % (account.userid, photo_id),
+            'square_thumb_link': base_url + u'_s.jpg',
+            'image_500px_link': base_url + u'.jpg',
+            'taken_on_date': taken,
+        })
+    return rows
+
+
+def _request(api, method, **kwargs):
+    """
+    Calls an API method, within the rate limit of the client's API key.
+    """
+    def request():
+        with metrics.phase('network'):
+            return getattr(api, method)(**kwargs)
+    response = ratelimit.call('flickr', api.api_key, request)
+    metrics.record_http()
+    return response
+
+
+def _pager(api, method, **kwargs):
+    """
+    Returns a fetch_page callable for walk(), which calls the given API
+    method for successive page numbers.
+    """
+    def fetch_page(page):
+        response = _request(api, method, page=page, **kwargs)
+        photos = response.find('photos')
+        if page >= int(photos.attrib.get('pages', 0)):
+            return (response, None)
+        return (response, page + 1)
+    return fetch_page
+
+
+def find_nsid(api, username):
+    """
+    Returns the NSID of the Flickr user with the given username, asking
+    Flickr only the first time each username is looked up.
+    """
+    try:
+        return _nsids[username]
+    except KeyError:
+        pass
+    response = _request(api, 'people_findByUsername', username=username)
+    nsid = _nsids[username] = response.find('user').attrib['nsid']
+    return nsid
+
+
 def fetch(account):
     """
     Fetch a list of recent photos from the flickr servers using the supplied
     credentials, and save them to the DB.
     
+    The first fetch of an account starts a backfill of its history, which
+    continues on later fetches (within the page budget of each run) until the
+    last page of the photostream is reached, or the photos which the
+    retention policy would remove.
+    
     Returns a tuple containing the number of items created, and the number of 
     items updated or skipped.
     """
     
-    import flickrapi
-    items_existing = 0
-    items_created = 0
-    api = flickrapi.FlickrAPI(account.api_key, format='etree')
+    api = clients.get((account.api_key, account.api_secret))
     
     # check that the nsid is present, if not fetch it and save to the model
     if not account.userid:
         try:
-            account.userid = api.people_findByUsername(username=account.username).find('user').attrib['nsid']
+            account.userid = find_nsid(api, account.username)
             account.save()
+        except ratelimit.RateLimited:
+            raise
         except:
             return (0, 0) # TODO: gperhaps a more useful exception handler?
     
-    extras = 'date_upload, date_taken'
-    per_page = 500
-    if FlickrPhoto.objects.count() > 0:
-        latestphoto = FlickrPhoto.objects.latest()
-        timestamp = calendar.timegm(latestphoto.published.timetuple())
-        recentphotos = api.photos_search(user_id=account.userid, per_page=per_page, min_upload_date=timestamp, extras=extras)
-    else:
-        recentphotos = api.people_getPublicPhotos(user_id=account.userid, per_page=per_page, extras=extras)
+    per_page, max_pages = paging_options('flickr', page_size=500, max_pages=10)
+    state = SyncState.objects.for_account(account)
+    if state.last_success is None and state.backfill_cursor is None:
+        state.backfill_cursor = 1
+    
+    items_created = 0
+    items_existing = 0
+    pages = 0
+    
+    # Catch up with photos uploaded since the last one seen on this account.
+    # The cursor only moves once every new page has been seen, so running
+    # out of budget never leaves a gap.
+    if state.last_published:
+        timestamp = timestamps.to_unix(state.last_published)
+        newest = state.last_published
+        complete = False
+        pager = _pager(api, 'photos_search', user_id=account.userid,
+            per_page=per_page, min_upload_date=timestamp, extras=EXTRAS)
+        for photos, next_page in walk(pager, 1, max_pages):
+            pages += 1
+            rows = _rows(account, photos)
+            created, existing = ingest(FlickrPhoto, account, rows, key=('photo_id',))
+            items_created += created
+            items_existing += existing
+            newest = max([newest] + [row['published'] for row in rows])
+            complete = next_page is None
+        if complete:
+            state.last_published = newest
     
-    iter = recentphotos.getiterator('photo');
-    for photo in iter:
-        upload_date = datetime.fromtimestamp(int(photo.attrib['dateupload']))
-        entry, created = FlickrPhoto.objects.get_or_create(
-            account = account,
-            photo_id = photo.attrib['id'],
-            published = upload_date)
-        if created:
-            entry.title = photo.attrib['title']
-            entry.link = u'http://flickr.com/photos/%s/%s' % (
-                account.userid,
-                entry.photo_id
-            )
-            base_url = u'http://farm%s.static.flickr.com/%s/%s_%s' % (
-                photo.attrib['farm'],
-                photo.attrib['server'],
-                entry.photo_id,
-                photo.attrib['secret']            
-            )
-            entry.square_thumb_link = base_url + u'_s.jpg'
-            entry.image_500px_link = base_url + u'.jpg'
-            entry.taken_on_date = parser.parse(photo.attrib['datetaken'])
-            entry.save()
-            items_created += 1
-        else:
-            items_existing += 1
+    # Continue walking through the photostream's history, checkpointing
+    # after every page.
+    if state.backfill_cursor is not None:
+        if max_pages is not None:
+            max_pages -= pages
+        pager = _pager(api, 'people_getPublicPhotos', user_id=account.userid,
+            per_page=per_page, extras=EXTRAS)
+        for photos, next_page in walk(pager, state.backfill_cursor, max_pages):
+            rows = _rows(account, photos)
+            cutoff = retention.backfill_cutoff('flickr', account)
+            kept = [row for row in rows if cutoff is None or row['published'] >= cutoff]
+            created, existing = ingest(FlickrPhoto, account, kept, key=('photo_id',))
+            items_created += created
+            items_existing += existing
+            state.advance(kept, id_field='photo_id')
+            state.backfill_cursor = next_page
+            if len(kept) < len(rows):
+                # the rest of the photostream is past the retention policy
+                state.backfill_cursor = None
+            state.save()
+            if state.backfill_cursor is None:
+                break
     
-    return (items_created, items_existing)
\ No newline at end of file
+    state.mark_success()
+    return (items_created, items_existing)
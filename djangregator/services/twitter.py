@@ -28,53 +28,133 @@
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 
-from djangregator.models import TwitterStatus, TwitterAccount
-from datetime import datetime
+from djangregator.models import TwitterStatus, SyncState
+from djangregator.ingest import ingest
+from djangregator.paging import paging_options, walk
+from djangregator.clients import ClientPool
+from djangregator import metrics, ratelimit, retention, timestamps, tweetmarkup
+from django.conf import settings
 import logging
+import twitterapi
 
 logger = logging.getLogger("Twitter")
 
+# Tweets are fetched without authentication, so every account shares one
+# client.
+clients = ClientPool(lambda key: twitterapi.Api())
+
+def _rows(account, tweets):
+    with metrics.phase('parse'):
+        return _parse(account, tweets)
+
+
+def _parse(account, tweets):
+    prerender = getattr(settings, 'DJANGREGATOR_PRERENDER_TWEETS', False)
+    rows = []
+    for status in tweets:
+        try:
+            tweetdate = timestamps.parse(status.created_at, 'twitter')
+        except timestamps.TimestampError, e:
+            logger.warning('Skipping tweet %s: %s' % (status.id, e))
+            continue
+        
+        row = {
+            'twitter_id': status.id,
+            'published': tweetdate,
+            'title': status.text,
+            'link': u'http://twitter.com/%s/%s' % (account.username, status.id),
+        }
+        if prerender:
+            row['html'] = unicode(tweetmarkup.render(status.text))
+        rows.append(row)
+    return rows
+
+
+def _pager(api, account, count, since_id=None):
+    """
+    Returns a fetch_page callable for walk(), which pages backwards through
+    the user's timeline using max_id. A cursor of 0 means the newest page.
+    """
+    def fetch_page(max_id):
+        kwargs = {'user': account.username, 'count': count}
+        if since_id:
+            kwargs['since_id'] = since_id
+        if max_id:
+            kwargs['max_id'] = max_id
+        def request():
+            with metrics.phase('network'):
+                return api.GetUserTimeline(**kwargs)
+        tweets = ratelimit.call('twitter', None, request)
+        metrics.record_http()
+        if not tweets:
+            return (tweets, None)
+        return (tweets, min([status.id for status in tweets]) - 1)
+    return fetch_page
+
+
 def fetch(account):
     """
     Fetch a list of recent tweets from the twitter servers using the supplied
     credentials, and save them to the DB.
     
+    The first fetch of an account starts a backfill of its history, which
+    continues on later fetches (within the page budget of each run) until the
+    oldest available tweet is reached, or the tweets which the retention
+    policy would remove.
+    
     Returns a tuple containing the number of items created, and the number of 
     items updated or skipped.
     """
     
-    import twitterapi
-    import rfc822
-    import datetime
-    items_existing = 0
+    twitterapi = clients.get()
+    count, max_pages = paging_options('twitter', page_size=200, max_pages=16)
+    state = SyncState.objects.for_account(account)
+    if state.last_success is None and state.backfill_cursor is None:
+        state.backfill_cursor = 0
+    
     items_created = 0
-    twitterapi = twitterapi.Api()
+    items_existing = 0
+    pages = 0
     
-    # get the latest tweet we already have
-    if TwitterStatus.objects.count() > 0:
-        latest_id = TwitterStatus.objects.latest().twitter_id
-        tweets = twitterapi.GetUserTimeline(
-            user=account.username,
-            since_id=latest_id)
-    else:
-        tweets = twitterapi.GetUserTimeline(user=account.username)
-        
-    for status in tweets:
-        try:
-            tweetdate = datetime.datetime(*rfc822.parsedate(status.created_at)[:6])
-        except: # TODO: more specific exception handling?
-            continue
-        
-        entry, created = TwitterStatus.objects.get_or_create(
-            account = account,
-            twitter_id = status.id,
-            published = tweetdate)
-        if created:
-            entry.title = status.text
-            entry.link = u'http://twitter.com/%s/%s' % (account.username, status.id)
-            entry.save()
-            items_created += 1
-        else:
-            items_existing += 1
+    # Catch up with tweets newer than the last one seen on this account.
+    # The cursor only moves once every new page has been seen, so running
+    # out of budget never leaves a gap.
+    if state.last_id:
+        newest = state.last_id
+        complete = False
+        pager = _pager(twitterapi, account, count, since_id=state.last_id)
+        for tweets, next_max_id in walk(pager, 0, max_pages):
+            pages += 1
+            rows = _rows(account, tweets)
+            created, existing = ingest(TwitterStatus, account, rows, key=('twitter_id',))
+            items_created += created
+            items_existing += existing
+            newest = max([newest] + [row['twitter_id'] for row in rows])
+            complete = next_max_id is None
+        if complete:
+            state.last_id = newest
+    
+    # Continue walking back through the account's history, checkpointing
+    # after every page.
+    if state.backfill_cursor is not None:
+        if max_pages is not None:
+            max_pages -= pages
+        pager = _pager(twitterapi, account, count)
+        for tweets, next_max_id in walk(pager, state.backfill_cursor, max_pages):
+            rows = _rows(account, tweets)
+            cutoff = retention.backfill_cutoff('twitter', account)
+            kept = [row for row in rows if cutoff is None or row['published'] >= cutoff]
+            created, existing = ingest(TwitterStatus, account, kept, key=('twitter_id',))
+            items_created += created
+            items_existing += existing
+            state.advance(kept, id_field='twitter_id')
+            state.backfill_cursor = next_max_id
+            if len(kept) < len(rows):
+                # the rest of the history is past the retention policy
+                state.backfill_cursor = None
+            state.save()
+            if state.backfill_cursor is None:
+                break
     
-    return (items_created, items_existing)
\ No newline at end of file
+    state.mark_success()
+    return (items_created, items_existing)
@@ -0,0 +1,150 @@
+# Copyright (c) 2008, Idan Gazit
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#     * Neither the name of the author nor the names of other
+#       contributors may be used to endorse or promote products derived
+#       from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Splitting the accounts to fetch between several processes or hosts.
+
+There are two ways to do it. With static sharding, each of ``count``
+processes is given its own ``index``, and fetches only the accounts which
+in_shard() assigns to it; the split costs nothing, but a process which is
+down leaves its share unfetched. With leasing, every process goes through
+all of the accounts and claims each one in the database before fetching it,
+so that only one process fetches it. A lease lasts for a fixed time, even
+once the fetch is done, so the account isn't fetched again by a process
+which gets to it later in the same round; and when a process dies, its
+leases simply run out and the accounts are picked up by the next round.
+"""
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+from djangregator.models import SyncState
+from datetime import timedelta
+import os
+import socket
+import zlib
+
+def parse_shard(value):
+    """
+    Parses a shard given as 'INDEX/COUNT', e.g. '0/4', into a tuple.
+    """
+    try:
+        index, count = [int(part) for part in value.split('/')]
+    except ValueError:
+        raise ValueError("A shard is given as INDEX/COUNT, e.g. 0/4, not %r" % value)
+    if not 0 <= index < count:
+        raise ValueError("Shard index %d is out of range for %d shards" % (index, count))
+    return (index, count)
+
+
+def in_shard(account, index, count):
+    """
+    Returns True if ``account`` belongs to shard ``index`` of ``count``.
+    Every process computes the same assignment, which only changes for an
+    account when the number of shards does.
+    """
+    key = '%s:%s' % (account.service, account.pk)
+    return (zlib.crc32(key) & 0xffffffff) % count == index
+
+
+class LeaseQueue(object):
+    """
+    Hands out leases on accounts, stored on their SyncStates. A lease is
+    held by ``owner`` (by default the host name and process id) for
+    ``duration`` seconds.
+    """
+    def __init__(self, duration, owner=None):
+        self.duration = duration
+        self.owner = owner or '%s:%d' % (socket.gethostname(), os.getpid())
+        self._states = {}
+    
+    def prepare(self, accounts):
+        """
+        Looks up the SyncStates of the given accounts, creating any which
+        are missing, using one query per service rather than per account.
+        """
+        by_model = {}
+        for account in accounts:
+            by_model.setdefault(type(account), []).append(account.pk)
+        for model, pks in by_model.items():
+            content_type = ContentType.objects.get_for_model(model)
+            states = SyncState.objects.filter(content_type=content_type)
+            existing = dict(states.filter(object_id__in=pks).values_list('object_id', 'pk'))
+            missing = [pk for pk in pks if pk not in existing]
+            if missing:
+                try:
+                    with transaction.commit_on_success():
+                        SyncState.objects.bulk_create([
+                            SyncState(content_type=content_type, object_id=pk) for pk in missing])
+                except IntegrityError:
+                    # Another process created some of them first, and the
+                    # whole insert was rolled back; create the rest one at
+                    # a time.
+                    created = set(states.filter(object_id__in=missing).values_list('object_id', flat=True))
+                    for pk in missing:
+                        if pk in created:
+                            continue
+                        try:
+                            with transaction.commit_on_success():
+                                SyncState.objects.create(content_type=content_type, object_id=pk)
+                        except IntegrityError:
+                            pass
+                existing.update(states.filter(object_id__in=missing).values_list('object_id', 'pk'))
+            for object_id, pk in existing.items():
+                self._states[(model, object_id)] = pk
+    
+    def claim(self, account):
+        """
+        Leases ``account`` to this queue's owner if nobody holds a lease on
+        it. Returns True if the lease was taken.
+        
+        The lease is taken with a single conditional UPDATE, so the database
+        row lock decides between processes claiming the same account.
+        """
+        pk = self._states.get((type(account), account.pk))
+        if pk is None:
+            self.prepare([account])
+            pk = self._states[(type(account), account.pk)]
+        now = timezone.now()
+        claimed = SyncState.objects.filter(pk=pk).filter(
+            Q(leased_until__isnull=True) | Q(leased_until__lte=now)).update(
+            leased_by=self.owner, leased_until=now + timedelta(seconds=self.duration))
+        return claimed == 1
+    
+    def release(self, account):
+        """
+        Gives up this owner's lease on ``account`` early, so that another
+        process may fetch it straight away.
+        """
+        pk = self._states.get((type(account), account.pk))
+        if pk is not None:
+            SyncState.objects.filter(pk=pk, leased_by=self.owner).update(
+                leased_by='', leased_until=None)
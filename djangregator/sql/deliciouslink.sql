@@ -0,0 +1,3 @@
+-- Each account's newest entry is looked up with latest('published').
+CREATE INDEX djangregator_deliciouslink_account_published
+    ON djangregator_deliciouslink (account_id, published);
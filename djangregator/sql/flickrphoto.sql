@@ -0,0 +1,3 @@
+-- Each account's newest entry is looked up with latest('published').
+CREATE INDEX djangregator_flickrphoto_account_published
+    ON djangregator_flickrphoto (account_id, published);
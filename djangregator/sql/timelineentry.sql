@@ -0,0 +1,6 @@
+-- Timelines are read one persona at a time, newest first.
+CREATE INDEX djangregator_timelineentry_persona_published
+    ON djangregator_timelineentry (persona_id, published);
+-- The combined timeline is read newest first, with ties broken by id.
+CREATE INDEX djangregator_timelineentry_published
+    ON djangregator_timelineentry (published, id);
@@ -0,0 +1,3 @@
+-- Each account's newest entry is looked up with latest('published').
+CREATE INDEX djangregator_twitterstatus_account_published
+    ON djangregator_twitterstatus (account_id, published);
@@ -29,9 +29,14 @@
 
 
 from django import template
+from django.conf import settings
+from django.core.cache import cache
 from django.template.defaultfilters import stringfilter
+from django.template.loader import select_template
 from django.utils.html import conditional_escape
 from django.utils.safestring import mark_safe
+from djangregator import timeline, tweetmarkup
+from djangregator.models import resolve_content_objects
 import re
 
 """
@@ -78,6 +83,74 @@ def twitterize(value, autoescape=None):
 twitterize.is_safe = True
 twitterize.needs_autoescape = True
 
-# TODO: Implement some test fixtures.
-# A sample string to test against...
-# @yes XXX @yes:yyy XXX @yes: yyy XXX @no.com XXX @yes XXX foo@no.net @yes XXX @yes15characters XXX @notoomanycharacters XXX thank you @yes. @yes asdas@no.com @no.c foo:@yes XXX @yes,@yes;
\ No newline at end of file
+@register.filter()
+def tweetify(value, autoescape=None):
+    """
+    Converts @replies, #hashtags and bare URLs in the plain text of a tweet
+    into links, in a single pass. Rendered tweets are memoized, so rendering
+    the same tweet again costs a dictionary lookup.
+    
+    Given a TwitterStatus rather than a string, its pre-rendered HTML is
+    used when there is some.
+    """
+    if hasattr(value, 'as_html'):
+        return value.as_html()
+    return tweetmarkup.render(value, autoescape)
+tweetify.is_safe = True
+tweetify.needs_autoescape = True
+
+##############################################################################
+# Timeline rendering
+##############################################################################
+
+# service name -> compiled template, filled in as services are first seen
+_entry_templates = {}
+
+def entry_template(service):
+    """
+    Returns the compiled template for rendering a timeline entry from the
+    given service: djangregator/timeline/<service>.html if there is one,
+    otherwise djangregator/timeline/entry.html. Templates are only looked up
+    and compiled once per service.
+    """
+    try:
+        return _entry_templates[service]
+    except KeyError:
+        compiled = select_template([
+            'djangregator/timeline/%s.html' % service,
+            'djangregator/timeline/entry.html'])
+        _entry_templates[service] = compiled
+        return compiled
+
+
+@register.simple_tag(takes_context=True)
+def render_timeline(context, persona=None, limit=timeline.DEFAULT_LIMIT, services=None):
+    """
+    Renders the newest ``limit`` entries of a persona's timeline (or of
+    everyone's) as an ordered list, each entry with its service's template.
+    ``services`` optionally limits the timeline to a comma-separated list of
+    service names. For example::
+    
+        {% render_timeline persona limit=20 services="twitter,flickr" %}
+    
+    The service objects of all entries are fetched with one query per
+    service, and the rendered list is cached until the timeline changes.
+    """
+    persona_id = getattr(persona, 'pk', persona)
+    if services:
+        services = sorted([name.strip() for name in services.split(',')])
+    key = 'djangregator:render_timeline:%s:%s:%s:%d:%d' % (
+        persona_id or 'all', timeline.generation(persona_id),
+        services and ','.join(services) or 'all', int(limit),
+        bool(context.autoescape))
+    html = cache.get(key)
+    if html is None:
+        page = timeline.get_page(persona_id, services, limit=int(limit))
+        items = []
+        for entry in resolve_content_objects(page.entries):
+            items.append(entry_template(entry.service).render(template.Context(
+                {'entry': entry, 'object': entry.content_object},
+                autoescape=context.autoescape)))
+        html = u'<ol class="timeline">%s</ol>' % u''.join(items)
+        cache.set(key, html, getattr(settings, 'DJANGREGATOR_TIMELINE_CACHE_TIMEOUT', 3600))
+    return mark_safe(html)
@@ -0,0 +1,53 @@
+# Copyright (c) 2008, Idan Gazit
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#     * Neither the name of the author nor the names of other
+#       contributors may be used to endorse or promote products derived
+#       from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+from djangregator.tests.test_httpclient import *
+from djangregator.tests.test_timeline import *
+from djangregator.tests.test_feeds import *
+from djangregator.tests.test_rebuild_timeline import *
+from djangregator.tests.test_delicious import *
+from djangregator.tests.test_ratelimit import *
+from djangregator.tests.test_sharding import *
+from djangregator.tests.test_fetch import *
+from djangregator.tests.test_retention import *
+from djangregator.tests.test_ingest import *
+from djangregator.tests.test_backfill_timeline import *
+from djangregator.tests.test_models import *
+from djangregator.tests.test_twitter import *
+from djangregator.tests.test_flickr import *
+from djangregator.tests.test_registry import *
+from djangregator.tests.test_scheduler import *
+from djangregator.tests.test_metrics import *
+from djangregator.tests.test_admin import *
+from djangregator.tests.test_tweetmarkup import *
+from djangregator.tests.test_render_timeline import *
+from djangregator.tests.test_maintenance import *
+from djangregator.tests.test_timestamps import *
+from djangregator.tests.test_clients import *
@@ -0,0 +1,206 @@
+# Copyright (c) 2008, Idan Gazit
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#     * Neither the name of the author nor the names of other
+#       contributors may be used to endorse or promote products derived
+#       from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.test.client import RequestFactory
+from django.core.paginator import EmptyPage
+from djangregator.models import OnlinePersona, SyncState, TimelineEntry, TwitterAccount, TwitterStatus
+from djangregator import admin as djangregator_admin, metrics, timeline
+from datetime import datetime, timedelta
+
+
+class AdminTestCase(TestCase):
+    """
+    Calls the djangregator admin's views and actions directly, as a
+    superuser.
+    """
+    def setUp(self):
+        self.user = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.factory = RequestFactory()
+        self.persona = OnlinePersona.objects.create(name='admin')
+        self.account = TwitterAccount.objects.create(persona=self.persona, username='admin')
+        start = datetime(2008, 8, 27, 14, 0, 0)
+        self.statuses = [TwitterStatus.objects.create(account=self.account, twitter_id=i + 1,
+            title=u'Tweet %d' % i, published=start - timedelta(minutes=i)) for i in range(3)]
+        self.messages = []
+        self.invalidated = []
+        self.invalidate = timeline.invalidate
+        timeline.invalidate = self.invalidated.append
+    
+    def tearDown(self):
+        timeline.invalidate = self.invalidate
+    
+    def model_admin(self, model):
+        model_admin = admin.site._registry[model]
+        model_admin.message_user = lambda request, message: self.messages.append(message)
+        return model_admin
+    
+    def request(self, method='post', data=None):
+        request = getattr(self.factory, method)('/admin/', data or {})
+        request.user = self.user
+        return request
+
+
+class DeleteTests(AdminTestCase):
+    def test_bulk_deletes_expire_nothing_per_row(self):
+        TimelineEntry.objects.all().delete()
+        self.assertEqual(self.invalidated, [])
+    
+    def test_delete_selected_entries(self):
+        model_admin = self.model_admin(TimelineEntry)
+        queryset = TimelineEntry.objects.all()
+        # the confirmation page deletes nothing
+        djangregator_admin.delete_selected(model_admin, self.request('get'), queryset)
+        self.assertEqual(TimelineEntry.objects.count(), 3)
+        self.assertEqual(self.invalidated, [])
+        
+        djangregator_admin.delete_selected(model_admin, self.request(data={'post': 'yes'}), queryset)
+        self.assertEqual(TimelineEntry.objects.count(), 0)
+        self.assertEqual(self.invalidated, [[self.persona.pk]])
+    
+    def test_delete_selected_activity(self):
+        model_admin = self.model_admin(TwitterStatus)
+        self.assertTrue('delete_selected' in model_admin.get_actions(self.request()))
+        djangregator_admin.delete_selected(model_admin, self.request(data={'post': 'yes'}),
+            TwitterStatus.objects.filter(pk__in=[status.pk for status in self.statuses[:2]]))
+        self.assertEqual(TwitterStatus.objects.count(), 1)
+        # their timeline entries went with them, in one expiry
+        self.assertEqual(TimelineEntry.objects.count(), 1)
+        self.assertEqual(self.invalidated, [[self.persona.pk]])
+    
+    def test_delete_model(self):
+        self.model_admin(TwitterStatus).delete_model(self.request(), self.statuses[0])
+        self.assertEqual(TimelineEntry.objects.count(), 2)
+        self.assertEqual(self.invalidated, [[self.persona.pk]])
+
+
+class PurgeTests(AdminTestCase):
+    def test_confirmation(self):
+        response = self.model_admin(TwitterAccount).purge(self.request('get'),
+            TwitterAccount.objects.all())
+        response.render()
+        self.assertTrue('The 3 items fetched from them' in response.content)
+        self.assertEqual(TwitterStatus.objects.count(), 3)
+    
+    def test_purge(self):
+        SyncState.objects.for_account(self.account)
+        self.model_admin(TwitterAccount).purge(self.request(data={'post': 'yes'}),
+            TwitterAccount.objects.all())
+        self.assertEqual(TwitterStatus.objects.count(), 0)
+        self.assertEqual(TimelineEntry.objects.count(), 0)
+        self.assertEqual(SyncState.objects.count(), 0)
+        # or the next fetch would download the whole history again
+        self.assertFalse(TwitterAccount.objects.get(pk=self.account.pk).active)
+
+
+class RefetchTests(AdminTestCase):
+    def setUp(self):
+        super(RefetchTests, self).setUp()
+        self.queued = []
+        self.in_background = djangregator_admin.in_background
+        djangregator_admin.in_background = lambda func, *args: self.queued.append((func, args))
+    
+    def tearDown(self):
+        djangregator_admin.in_background = self.in_background
+        super(RefetchTests, self).tearDown()
+    
+    def test_queued(self):
+        model_admin = self.model_admin(TwitterAccount)
+        model_admin.refetch(self.request(), TwitterAccount.objects.all())
+        self.assertEqual(self.queued, [(model_admin.fetch, ([self.account],))])
+        self.assertEqual(self.messages, ["Fetching 1 accounts in the background;"
+            " reload the list to see how it went."])
+    
+    def test_summary_shown_once(self):
+        model_admin = self.model_admin(TwitterAccount)
+        model_admin.fetch([self.account])
+        self.assertEqual(self.messages, [])
+        model_admin.changelist_view(self.request('get'))
+        self.assertEqual(len(self.messages), 1)
+        self.assertTrue(self.messages[0].startswith("Fetched 0 new items from 1 accounts."))
+        model_admin.changelist_view(self.request('get'))
+        self.assertEqual(len(self.messages), 1)
+    
+    def test_summary(self):
+        result = metrics.FetchResult()
+        for failed, deferred in [(False, False), (True, False), (False, True)]:
+            stats = metrics.AccountMetrics(self.account)
+            stats.created = 2
+            if failed:
+                stats.fail("broken")
+            if deferred:
+                stats.defer("throttled")
+            result.add(stats)
+        self.assertEqual(djangregator_admin.fetch_summary(result, 4),
+            "Fetched 6 new items from 4 accounts. 1 failed. 1 were deferred, as their service"
+            " is throttling or failing; try them again later. 1 were skipped, as another fetch"
+            " process holds their lease.")
+
+
+class EstimatedCountPaginatorTests(TestCase):
+    def setUp(self):
+        persona = OnlinePersona.objects.create(name='paging')
+        account = TwitterAccount.objects.create(persona=persona, username='paging')
+        start = datetime(2008, 8, 27, 14, 0, 0)
+        for i in range(25):
+            TwitterStatus.objects.create(account=account, twitter_id=i + 1,
+                title=u'Tweet %d' % i, published=start - timedelta(minutes=i))
+        self.limit = djangregator_admin.EstimatedCountPaginator.limit
+        djangregator_admin.EstimatedCountPaginator.limit = 10
+    
+    def tearDown(self):
+        djangregator_admin.EstimatedCountPaginator.limit = self.limit
+    
+    def paginator(self):
+        return djangregator_admin.EstimatedCountPaginator(
+            TimelineEntry.objects.filter(service='twitter').order_by('-published'), 4)
+    
+    def test_pages_past_the_count(self):
+        paginator = self.paginator()
+        self.assertEqual(paginator.count, 10)
+        self.assertEqual(paginator.num_pages, 3)
+        page = paginator.page(5)
+        self.assertEqual([entry.title for entry in page.object_list],
+            [u'Tweet %d' % i for i in range(16, 20)])
+        # the count takes in the pages seen, so there is a next one
+        self.assertTrue(page.has_next())
+        self.assertEqual(paginator.num_pages, 6)
+        self.assertEqual(len(paginator.page(7).object_list), 1)
+        self.assertFalse(paginator.page(7).has_next())
+        self.assertRaises(EmptyPage, paginator.page, 8)
+    
+    def test_exact_counts(self):
+        djangregator_admin.EstimatedCountPaginator.limit = 100
+        paginator = self.paginator()
+        self.assertEqual(paginator.count, 25)
+        self.assertEqual(len(paginator.page(7).object_list), 1)
+        self.assertRaises(EmptyPage, paginator.page, 8)
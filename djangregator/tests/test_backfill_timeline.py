@@ -0,0 +1,88 @@
+# Copyright (c) 2008, Idan Gazit
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#     * Neither the name of the author nor the names of other
+#       contributors may be used to endorse or promote products derived
+#       from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+from django.core.management import call_command
+from django.test import TestCase
+from djangregator.models import OnlinePersona, TimelineEntry, TwitterAccount, TwitterStatus
+from djangregator import maintenance
+from datetime import datetime, timedelta
+from cStringIO import StringIO
+
+
+class BackfillTimelineTests(TestCase):
+    """
+    Tests the backfill_timeline command.
+    """
+    def setUp(self):
+        persona = OnlinePersona.objects.create(name='backfill')
+        account = TwitterAccount.objects.create(persona=persona, username='backfill')
+        start = datetime(2008, 8, 27, 14, 0, 0)
+        # activity saved without timeline maintenance has no entries
+        with maintenance.suspended():
+            self.statuses = [TwitterStatus.objects.create(account=account, twitter_id=i + 1,
+                title=u'Tweet %d' % i, link=u'http://twitter.com/backfill/statuses/%d' % (i + 1),
+                published=start - timedelta(minutes=i)) for i in range(7)]
+    
+    def backfill(self, **options):
+        call_command('backfill_timeline', stdout=StringIO(), chunk_size=3, **options)
+    
+    def test_creates_missing_entries(self):
+        self.assertEqual(TimelineEntry.objects.count(), 0)
+        self.backfill()
+        self.assertEqual(TimelineEntry.objects.count(), 7)
+        for status in self.statuses:
+            entry = TimelineEntry.objects.get(object_id=status.pk)
+            self.assertEqual(entry.title, status.title)
+            self.assertEqual(entry.link, status.link)
+            self.assertEqual(entry.published, status.published)
+            self.assertEqual(entry.service, u'twitter')
+            self.assertEqual(entry.persona_id, status.account.persona_id)
+    
+    def test_fills_in_blank_entries(self):
+        self.backfill()
+        TimelineEntry.objects.filter(object_id=self.statuses[0].pk).update(service='', title=None)
+        self.backfill()
+        entry = TimelineEntry.objects.get(object_id=self.statuses[0].pk)
+        self.assertEqual(entry.service, u'twitter')
+        self.assertEqual(entry.title, u'Tweet 0')
+    
+    def test_refreshes_moved_entries(self):
+        self.backfill()
+        persona = OnlinePersona.objects.create(name='moved')
+        TwitterAccount.objects.filter(pk=self.statuses[0].account_id).update(persona=persona)
+        self.backfill(all=True)
+        self.assertEqual(TimelineEntry.objects.filter(persona=persona).count(), 7)
+    
+    def test_idempotent(self):
+        self.backfill()
+        before = list(TimelineEntry.objects.order_by('pk').values())
+        self.backfill()
+        self.backfill(all=True)
+        self.assertEqual(list(TimelineEntry.objects.order_by('pk').values()), before)
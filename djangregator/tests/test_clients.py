@@ -0,0 +1,92 @@
+# Copyright (c) 2008, Idan Gazit
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#     * Neither the name of the author nor the names of other
+#       contributors may be used to endorse or promote products derived
+#       from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+from django.test import SimpleTestCase
+from djangregator.clients import ClientPool
+import threading
+
+
+class ClientPoolTests(SimpleTestCase):
+    def setUp(self):
+        self.built = []
+        self.pool = ClientPool(self.factory)
+    
+    def factory(self, key):
+        self.built.append(key)
+        return object()
+    
+    def test_one_client_per_key(self):
+        default = self.pool.get()
+        self.assertTrue(self.pool.get() is default)
+        first = self.pool.get(('key', 'secret'))
+        self.assertTrue(self.pool.get(('key', 'secret')) is first)
+        self.assertFalse(first is default)
+        self.assertFalse(self.pool.get(('key', None)) is first)
+        self.assertEqual(self.built, [None, ('key', 'secret'), ('key', None)])
+        self.assertEqual(len(self.pool), 3)
+    
+    def test_clear(self):
+        client = self.pool.get('key')
+        self.pool.clear()
+        self.assertEqual(len(self.pool), 0)
+        self.assertFalse(self.pool.get('key') is client)
+        self.assertEqual(self.built, ['key', 'key'])
+    
+    def test_threads_share_one_client(self):
+        # every thread asks for the same key at once, while building a
+        # client is slow
+        ready = threading.Event()
+        def slow_factory(key):
+            ready.wait()
+            return self.factory(key)
+        self.pool.factory = slow_factory
+        clients = []
+        def get():
+            clients.append(self.pool.get('key'))
+        threads = [threading.Thread(target=get) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        ready.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.built, ['key'])
+        self.assertEqual(len(clients), 8)
+        self.assertEqual(len(set([id(client) for client in clients])), 1)
+    
+    def test_failed_factory(self):
+        def broken(key):
+            raise ValueError(key)
+        self.pool.factory = broken
+        self.assertRaises(ValueError, self.pool.get, 'key')
+        # nothing was kept, and the lock was released
+        self.assertEqual(len(self.pool), 0)
+        self.pool.factory = self.factory
+        self.pool.get('key')
+        self.assertEqual(self.built, ['key'])
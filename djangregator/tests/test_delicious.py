@@ -0,0 +1,134 @@
+# Copyright (c) 2008, Idan Gazit
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#     * Neither the name of the author nor the names of other
+#       contributors may be used to endorse or promote products derived
+#       from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+from django.test import SimpleTestCase, TestCase
+from django.utils import simplejson as json
+from djangregator.models import OnlinePersona, DeliciousAccount, DeliciousLink, SyncState
+from djangregator.services import delicious
+from djangregator import httpclient, timestamps
+from datetime import datetime, timedelta
+from cStringIO import StringIO
+
+
+class DeliciousFetchTests(TestCase):
+    """
+    Tests fetching the Delicious feed, with the HTTP request stubbed out.
+    """
+    def setUp(self):
+        persona = OnlinePersona.objects.create(name='delicious')
+        self.account = DeliciousAccount.objects.create(persona=persona, username='delicious')
+        self.last_sync = datetime(2008, 8, 27, 14, 0, 0)
+        self.last_sync_local = timestamps.parse(self.iso8601(self.last_sync), 'iso8601')
+        self.status = 200
+        self.get = httpclient.get
+        httpclient.get = self.stub_get
+    
+    def tearDown(self):
+        httpclient.get = self.get
+    
+    def stub_get(self, url, state=None, **kwargs):
+        return httpclient.Response(url, self.status, 'OK', {}, self.body)
+    
+    def iso8601(self, utc):
+        return utc.strftime('%Y-%m-%dT%H:%M:%SZ')
+    
+    def feed(self, times):
+        self.body = json.dumps([{
+            'u': 'http://example.com/%d' % i,
+            'd': 'Link %d' % i,
+            'dt': self.iso8601(published),
+        } for i, published in enumerate(times)])
+    
+    def test_feed_longer_than_a_batch(self):
+        state = SyncState.objects.for_account(self.account)
+        state.last_published = self.last_sync_local
+        state.save()
+        # newest first, with five bookmarks from before the last sync
+        newer = delicious.DEFAULT_BATCH_SIZE * 2 + 50
+        self.feed([self.last_sync + timedelta(minutes=newer - i) for i in range(newer)] +
+            [self.last_sync - timedelta(minutes=i + 1) for i in range(5)])
+        
+        self.assertEqual(delicious.fetch(self.account), (newer, 5))
+        self.assertEqual(DeliciousLink.objects.count(), newer)
+        state = SyncState.objects.for_account(self.account)
+        self.assertEqual(state.last_published, self.last_sync_local + timedelta(minutes=newer))
+    
+    def test_not_modified(self):
+        state = SyncState.objects.for_account(self.account)
+        state.last_published = self.last_sync_local
+        state.save()
+        self.status = 304
+        self.body = ''
+        
+        self.assertEqual(delicious.fetch(self.account), (0, 0))
+        self.assertEqual(DeliciousLink.objects.count(), 0)
+        state = SyncState.objects.for_account(self.account)
+        self.assertNotEqual(state.last_success, None)
+        self.assertEqual(state.last_published, self.last_sync_local)
+
+
+class IterJSONTests(SimpleTestCase):
+    """
+    Tests reading a JSON array an item at a time.
+    """
+    items = [
+        {u'u': u'http://example.com/?a=[1,2]', u'd': u'Brackets ] and, commas'},
+        {u'u': u'http://example.com/caf\xe9', u'd': u'\u201cQuoted\u201d \\ "escaped"'},
+        [1, [2, [3]], {u'n': None}],
+        1234567890,
+        -1.5e10,
+        u'',
+        True,
+        {},
+    ]
+    
+    def document(self):
+        return json.dumps(self.items, indent=1, ensure_ascii=False).encode('utf-8')
+    
+    def test_every_chunk_boundary(self):
+        document = self.document()
+        for chunk_size in range(1, len(document) + 2):
+            self.assertEqual(list(delicious.iter_json(StringIO(document), chunk_size)),
+                self.items, chunk_size)
+    
+    def test_reads_as_it_goes(self):
+        document = '[' + ','.join(['{"n": %d}' % i for i in range(1000)]) + ']'
+        fileobj = StringIO(document)
+        items = delicious.iter_json(fileobj, chunk_size=100)
+        self.assertEqual(items.next(), {u'n': 0})
+        self.assertTrue(fileobj.tell() <= 200)
+        self.assertEqual(len(list(items)), 999)
+    
+    def test_empty(self):
+        self.assertEqual(list(delicious.iter_json(StringIO(' [ ] '), 1)), [])
+    
+    def test_malformed(self):
+        for document in ('', '{"a": 1}', '[{"a": 1}', '[{"a": 1}, {"b"', '[1, 2'):
+            self.assertRaises(ValueError, list, delicious.iter_json(StringIO(document), 3))
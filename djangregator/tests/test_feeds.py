@@ -0,0 +1,125 @@
+# Copyright (c) 2008, Idan Gazit
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#     * Neither the name of the author nor the names of other
+#       contributors may be used to endorse or promote products derived
+#       from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+from django.contrib.contenttypes.models import ContentType
+from django.test import TestCase
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+from django.utils import simplejson as json
+from django.utils import timezone
+from djangregator.models import OnlinePersona, TimelineEntry, TwitterStatus
+from djangregator import feeds, timeline
+from datetime import datetime, timedelta
+
+
+class FeedTests(TestCase):
+    """
+    Tests streaming the timeline out as a feed.
+    """
+    def setUp(self):
+        self.persona = OnlinePersona.objects.create(name='feeds')
+        self.content_type = ContentType.objects.get_for_model(TwitterStatus)
+    
+    def create_entries(self, count, start):
+        for i in range(count):
+            TimelineEntry.objects.create(content_type=self.content_type,
+                object_id=i + 1, persona=self.persona, service='twitter',
+                title=u'Entry %d' % i, published=start - timedelta(minutes=i))
+    
+    def test_iter_entries(self):
+        self.create_entries(12, datetime(2008, 8, 27, 14, 0, 0))
+        titles = [entry.title for entry in feeds.iter_entries(self.persona, batch_size=5)]
+        self.assertEqual(titles, [u'Entry %d' % i for i in range(12)])
+        self.assertEqual(len(list(feeds.iter_entries(limit=7, batch_size=5))), 7)
+    
+    def test_iter_entries_stops_on_a_stuck_cursor(self):
+        get_page = timeline.get_page
+        def stuck(*args, **kwargs):
+            return timeline.TimelinePage([], 'stuck')
+        timeline.get_page = stuck
+        try:
+            self.assertEqual(list(feeds.iter_entries()), [])
+        finally:
+            timeline.get_page = get_page
+    
+    @override_settings(USE_TZ=True, DJANGREGATOR_FEED_LIMIT=500)
+    def test_feed_view(self):
+        start = timezone.make_aware(datetime(2008, 8, 27, 14, 0, 0), timezone.utc)
+        self.create_entries(250, start)
+        
+        newest = feeds._newest
+        calls = []
+        def counting(*args, **kwargs):
+            calls.append(args)
+            return newest(*args, **kwargs)
+        feeds._newest = counting
+        try:
+            request = RequestFactory().get('/%d/feed/json/' % self.persona.pk)
+            response = feeds.feed(request, 'json', str(self.persona.pk))
+            body = ''.join(response)
+        finally:
+            feeds._newest = newest
+        
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['ETag'])
+        items = json.loads(body)['items']
+        self.assertEqual(len(items), 250)
+        self.assertEqual(len(set([item['title'] for item in items])), 250)
+    
+    def test_feed_cached_per_host(self):
+        self.create_entries(3, datetime(2008, 8, 27, 14, 0, 0))
+        factory = RequestFactory()
+        def links(**extra):
+            request = factory.get('/%d/feed/json/' % self.persona.pk, **extra)
+            body = ''.join(feeds.feed(request, 'json', str(self.persona.pk)))
+            return json.loads(body)['feed_url']
+        self.assertEqual(links(), 'http://testserver/%d/feed/json/' % self.persona.pk)
+        # the cached copy of one host's feed isn't served to another
+        self.assertEqual(links(HTTP_HOST='example.com'),
+            'http://example.com/%d/feed/json/' % self.persona.pk)
+        self.assertEqual(links(HTTP_HOST='example.com', **{'wsgi.url_scheme': 'https'}),
+            'https://example.com/%d/feed/json/' % self.persona.pk)
+        self.assertEqual(links(), 'http://testserver/%d/feed/json/' % self.persona.pk)
+    
+    def test_etag_changes_with_timeline(self):
+        self.create_entries(3, datetime(2008, 8, 27, 14, 0, 0))
+        def etag():
+            request = RequestFactory().get('/%d/feed/atom/' % self.persona.pk)
+            return feeds._etag(request, 'atom', self.persona.pk)
+        first = etag()
+        self.assertEqual(etag(), first)
+        # an older entry changing leaves the newest alone, but not the etag
+        TimelineEntry.objects.filter(title=u'Entry 2').update(title=u'Edited')
+        timeline.invalidate([self.persona.pk])
+        second = etag()
+        self.assertNotEqual(second, first)
+        with self.settings(DJANGREGATOR_FEED_LIMIT=1):
+            self.assertNotEqual(etag(), second)
@@ -0,0 +1,169 @@
+# Copyright (c) 2008, Idan Gazit
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#     * Neither the name of the author nor the names of other
+#       contributors may be used to endorse or promote products derived
+#       from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+from django.test import TestCase
+from django.utils.importlib import import_module
+from djangregator.models import OnlinePersona, TwitterAccount
+from djangregator.sharding import LeaseQueue
+from djangregator import httpclient, metrics, ratelimit
+import threading
+
+# djangregator.fetch is shadowed by the fetch() function on the package
+fetching = import_module('djangregator.fetch')
+
+
+class FetchAccountsTests(TestCase):
+    """
+    Tests fetch_accounts(), with the backends stubbed out.
+    """
+    def setUp(self):
+        self.persona = OnlinePersona.objects.create(name='fetch')
+        self.accounts = [TwitterAccount.objects.create(persona=self.persona,
+            username='fetch%d' % i, active=bool(i)) for i in range(3)]
+        self.fetched = []
+        self.fetch_account = fetching.fetch_account
+        fetching.fetch_account = self.stub_fetch_account
+    
+    def tearDown(self):
+        fetching.fetch_account = self.fetch_account
+    
+    def stub_fetch_account(self, account, persona=None, timeout=None):
+        self.fetched.append(account)
+        stats = metrics.AccountMetrics(account, persona)
+        stats.created = 2
+        stats.finish()
+        return stats
+    
+    def test_fetch_accounts(self):
+        sink = metrics.MemorySink()
+        result = fetching.fetch_accounts(self.accounts[:2], sinks=[sink])
+        # inactive accounts are fetched when asked for
+        self.assertEqual(self.fetched, self.accounts[:2])
+        self.assertEqual(result.created, 4)
+        self.assertEqual(result.personas, 1)
+        self.assertEqual(sink.results, [result])
+    
+    def test_leased_accounts_are_skipped(self):
+        LeaseQueue(60, owner='elsewhere').claim(self.accounts[1])
+        result = fetching.fetch_accounts(self.accounts, sinks=[], lease=60)
+        self.assertEqual(self.fetched, [self.accounts[0], self.accounts[2]])
+        self.assertEqual(len(result.accounts), 2)
+    
+    def test_fetch(self):
+        fetching.fetch(sinks=[])
+        self.assertEqual(self.fetched, self.accounts[1:])
+
+
+class RunBackendTests(TestCase):
+    """
+    Tests running a backend with a timeout.
+    """
+    def setUp(self):
+        persona = OnlinePersona.objects.create(name='timeout')
+        self.account = TwitterAccount.objects.create(persona=persona, username='timeout')
+        self.stats = metrics.AccountMetrics(self.account)
+    
+    def test_in_time(self):
+        def backend(account):
+            metrics.record_http(100)
+            return (1, 0)
+        self.assertEqual(fetching._run_backend(backend, self.account, self.stats, 5), (1, 0))
+        self.assertEqual(self.stats.http_requests, 1)
+        self.assertEqual(self.stats.http_bytes, 100)
+    
+    def test_abandoned_thread_leaves_stats_alone(self):
+        release = threading.Event()
+        done = threading.Event()
+        def backend(account):
+            release.wait(5)
+            metrics.record_http(100)
+            done.set()
+            return (1, 0)
+        self.assertRaises(fetching.FetchTimeout, fetching._run_backend,
+            backend, self.account, self.stats, 0.05)
+        release.set()
+        self.assertTrue(done.wait(5))
+        self.assertEqual(self.stats.http_requests, 0)
+        self.assertEqual(self.stats.http_bytes, 0)
+    
+    def test_errors_are_raised(self):
+        def backend(account):
+            raise ValueError("broken")
+        self.assertRaises(ValueError, fetching._run_backend, backend, self.account, self.stats, 5)
+
+
+class FetchAccountTests(TestCase):
+    """
+    Tests that fetch_account() keeps its service's circuit breaker.
+    """
+    def setUp(self):
+        persona = OnlinePersona.objects.create(name='breaker')
+        self.account = TwitterAccount.objects.create(persona=persona, username='breaker')
+        self.errors = []
+        self.run_backend = fetching._run_backend
+        fetching._run_backend = self.stub_run_backend
+        # the twitter backend needs twitterapi, which the stub doesn't
+        self.get = fetching.registry.get
+        fetching.registry.get = lambda name: self
+        ratelimit.reset()
+        self.breaker = ratelimit.breaker('twitter')
+    
+    def tearDown(self):
+        fetching._run_backend = self.run_backend
+        fetching.registry.get = self.get
+        ratelimit.reset()
+    
+    def fetch(self, account):
+        pass
+    
+    def stub_run_backend(self, backend, account, stats, timeout):
+        if self.errors:
+            raise self.errors.pop(0)
+        return (1, 0)
+    
+    def test_service_failures_count(self):
+        self.errors = [httpclient.HTTPError('http://example.com/', 502, 'Bad Gateway'),
+            fetching.FetchTimeout("too slow")]
+        self.assertTrue(fetching.fetch_account(self.account).failed)
+        self.assertTrue(fetching.fetch_account(self.account).failed)
+        self.assertEqual(self.breaker.failures, 2)
+    
+    def test_account_failures_reset(self):
+        self.breaker.failure()
+        self.errors = [httpclient.HTTPError('http://example.com/', 404, 'Not Found')]
+        self.assertTrue(fetching.fetch_account(self.account).failed)
+        self.assertEqual(self.breaker.failures, 0)
+    
+    def test_success_resets(self):
+        self.breaker.failure()
+        self.breaker.failure()
+        stats = fetching.fetch_account(self.account)
+        self.assertEqual(stats.created, 1)
+        self.assertEqual(self.breaker.failures, 0)
@@ -0,0 +1,156 @@
+# Copyright (c) 2008, Idan Gazit
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#     * Neither the name of the author nor the names of other
+#       contributors may be used to endorse or promote products derived
+#       from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils import unittest
+from djangregator.models import OnlinePersona, FlickrAccount, FlickrPhoto, SyncState
+from djangregator import ratelimit
+from xml.etree import ElementTree
+
+try:
+    from djangregator.services import flickr
+except ImportError:
+    flickr = None
+
+
+class StubApi(object):
+    """
+    Serves a photostream of ``count`` photos with ids counting up from 101,
+    newest first, as etree responses the way flickrapi returns them. Raises
+    ``error`` when asked for page ``fail_on``.
+    """
+    api_key = 'key'
+    
+    def __init__(self, count, start):
+        self.photos = [(100 + count - i, start - 60 * i) for i in range(count)]
+        self.requests = []
+        self.fail_on = None
+        self.error = ValueError('Flickr is having a moment')
+    
+    def response(self, photos, page, per_page):
+        if page == self.fail_on:
+            raise self.error
+        pages = (len(photos) + per_page - 1) // per_page
+        rsp = ElementTree.Element('rsp', stat='ok')
+        element = ElementTree.SubElement(rsp, 'photos', page=str(page), pages=str(pages))
+        for photo_id, uploaded in photos[(page - 1) * per_page:page * per_page]:
+            ElementTree.SubElement(element, 'photo', id=str(photo_id), secret='secret',
+                server='1', farm='1', title='Photo %d' % photo_id,
+                dateupload=str(uploaded), datetaken='2008-05-11 14:31:20')
+        return rsp
+    
+    def people_getPublicPhotos(self, user_id, per_page, extras, page):
+        self.requests.append(('people_getPublicPhotos', page))
+        return self.response(self.photos, page, per_page)
+    
+    def photos_search(self, user_id, per_page, min_upload_date, extras, page):
+        self.requests.append(('photos_search', page))
+        photos = [photo for photo in self.photos if photo[1] >= min_upload_date]
+        return self.response(photos, page, per_page)
+
+
+@unittest.skipIf(flickr is None, 'flickrapi is not installed')
+@override_settings(DJANGREGATOR_PAGING={'flickr': {'page_size': 2, 'max_pages': 2}},
+    DJANGREGATOR_RATE_LIMITS={'flickr': {'requests_per_hour': 3600000, 'burst': 1000}})
+class FlickrFetchTests(TestCase):
+    """
+    Tests fetching and backfilling a Flickr photostream, with the API client
+    stubbed out.
+    """
+    def setUp(self):
+        persona = OnlinePersona.objects.create(name='flickr')
+        self.account = FlickrAccount.objects.create(persona=persona, username='flickr',
+            userid='12345678@N00', api_key='key')
+        self.api = StubApi(7, 1219845600)
+        self.clients = flickr.clients
+        flickr.clients = flickr.ClientPool(lambda key: self.api)
+        ratelimit.reset()
+    
+    def tearDown(self):
+        flickr.clients = self.clients
+        ratelimit.reset()
+    
+    def state(self):
+        return SyncState.objects.for_account(self.account)
+    
+    def stored(self):
+        return sorted(FlickrPhoto.objects.values_list('photo_id', flat=True))
+    
+    def test_backfill_resumes(self):
+        self.assertEqual(flickr.fetch(self.account), (4, 0))
+        self.assertEqual(self.stored(), [104, 105, 106, 107])
+        self.assertEqual(self.state().backfill_cursor, 3)
+        
+        # the catch-up page only finds the newest photo again, and the
+        # backfill carries on from where it stopped
+        self.api.requests = []
+        self.assertEqual(flickr.fetch(self.account), (2, 1))
+        self.assertEqual(self.api.requests, [('photos_search', 1),
+            ('people_getPublicPhotos', 3)])
+        self.assertEqual(self.stored(), range(102, 108))
+        self.assertEqual(self.state().backfill_cursor, 4)
+    
+    def test_end_of_history(self):
+        with self.settings(DJANGREGATOR_PAGING={'flickr': {'page_size': 2, 'max_pages': None}}):
+            self.assertEqual(flickr.fetch(self.account), (7, 0))
+        self.assertEqual(self.stored(), range(101, 108))
+        state = self.state()
+        self.assertEqual(state.backfill_cursor, None)
+        self.assertNotEqual(state.last_success, None)
+        
+        # once the backfill is done only new photos are asked for
+        self.api.requests = []
+        flickr.fetch(self.account)
+        self.assertEqual(self.api.requests, [('photos_search', 1)])
+    
+    def test_failure_midway(self):
+        self.api.fail_on = 2
+        self.assertRaises(ValueError, flickr.fetch, self.account)
+        # the first page was checkpointed, but the fetch didn't succeed
+        self.assertEqual(self.stored(), [106, 107])
+        state = self.state()
+        self.assertEqual(state.backfill_cursor, 2)
+        self.assertEqual(state.last_success, None)
+        
+        self.api.fail_on = None
+        self.api.requests = []
+        self.assertEqual(flickr.fetch(self.account), (2, 1))
+        self.assertEqual(self.api.requests, [('photos_search', 1),
+            ('people_getPublicPhotos', 2)])
+        self.assertEqual(self.stored(), range(104, 108))
+    
+    @override_settings(DJANGREGATOR_RETENTION={'flickr': {'days': 30}})
+    def test_backfill_stops_at_the_retention_policy(self):
+        # every photo is older than 30 days, so the first page is the last
+        self.assertEqual(flickr.fetch(self.account), (0, 0))
+        self.assertEqual(self.api.requests, [('people_getPublicPhotos', 1)])
+        self.assertEqual(self.stored(), [])
+        self.assertEqual(self.state().backfill_cursor, None)
@@ -0,0 +1,186 @@
+# Copyright (c) 2008, Idan Gazit
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#     * Neither the name of the author nor the names of other
+#       contributors may be used to endorse or promote products derived
+#       from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+from django.test import SimpleTestCase
+from djangregator import httpclient
+from cStringIO import StringIO
+import BaseHTTPServer
+import SocketServer
+import gzip
+import threading
+import zlib
+
+BODY = 'Hello, world!\n' * 10
+ETAG = '"v1"'
+LAST_MODIFIED = 'Wed, 27 Aug 2008 14:00:00 GMT'
+
+
+def _gzipped(data):
+    buf = StringIO()
+    f = gzip.GzipFile(fileobj=buf, mode='wb')
+    f.write(data)
+    f.close()
+    return buf.getvalue()
+
+
+class StubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    
+    def do_GET(self):
+        self.server.requests.append((self.path, self.client_address, dict(self.headers)))
+        headers = {'ETag': ETAG, 'Last-Modified': LAST_MODIFIED}
+        body = BODY
+        status = 200
+        if self.path == '/conditional' and self.headers.get('If-None-Match') == ETAG:
+            status, body = 304, ''
+        elif self.path == '/throttled':
+            status, body = 429, 'slow down'
+            headers = {'Retry-After': '120'}
+        elif self.path == '/gzip':
+            body = _gzipped(BODY)
+            headers['Content-Encoding'] = 'gzip'
+        elif self.path == '/missing':
+            status, body = 404, 'not here'
+        
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        if status != 304:
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, *args):
+        pass
+
+
+class StubServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class HTTPClientTests(SimpleTestCase):
+    """
+    Tests the HTTP client against a stub server on localhost.
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls.server = StubServer(('127.0.0.1', 0), StubHandler)
+        cls.server.requests = []
+        cls.base = 'http://127.0.0.1:%d' % cls.server.server_address[1]
+        cls.thread = threading.Thread(target=cls.server.serve_forever)
+        cls.thread.setDaemon(True)
+        cls.thread.start()
+    
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+    
+    def setUp(self):
+        self.server.requests[:] = []
+        self.client = httpclient.HTTPClient(timeout=5)
+    
+    def tearDown(self):
+        self.client.close()
+    
+    def test_ok(self):
+        response = self.client.get(self.base + '/ok')
+        self.assertEqual(response.status, 200)
+        self.assertFalse(response.not_modified)
+        self.assertEqual(response.body, BODY)
+        self.assertEqual(response.etag, ETAG)
+        self.assertEqual(response.last_modified, LAST_MODIFIED)
+        headers = self.server.requests[0][2]
+        self.assertEqual(headers['user-agent'], httpclient.USER_AGENT)
+        self.assertTrue('gzip' in headers['accept-encoding'])
+        self.assertFalse('if-none-match' in headers)
+    
+    def test_connections_are_reused(self):
+        self.client.get(self.base + '/ok')
+        self.client.get(self.base + '/ok')
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(self.server.requests[0][1], self.server.requests[1][1])
+    
+    def test_not_modified(self):
+        response = self.client.get(self.base + '/conditional', etag=ETAG,
+            last_modified=LAST_MODIFIED)
+        self.assertEqual(response.status, 304)
+        self.assertTrue(response.not_modified)
+        self.assertEqual(response.body, '')
+        headers = self.server.requests[0][2]
+        self.assertEqual(headers['if-none-match'], ETAG)
+        self.assertEqual(headers['if-modified-since'], LAST_MODIFIED)
+        # the connection is still usable after a bodiless response
+        self.assertEqual(self.client.get(self.base + '/ok').body, BODY)
+        self.assertEqual(self.server.requests[0][1], self.server.requests[1][1])
+    
+    def test_conditional_get_with_state(self):
+        class State(object):
+            etag = ''
+            last_modified = ''
+        state = State()
+        original = httpclient.client
+        httpclient.client = self.client
+        try:
+            response = httpclient.get(self.base + '/conditional', state)
+            self.assertEqual(response.status, 200)
+            self.assertEqual(state.etag, ETAG)
+            self.assertEqual(state.last_modified, LAST_MODIFIED)
+            response = httpclient.get(self.base + '/conditional', state)
+            self.assertTrue(response.not_modified)
+            self.assertEqual(state.etag, ETAG)
+        finally:
+            httpclient.client = original
+    
+    def test_rate_limited(self):
+        try:
+            self.client.get(self.base + '/throttled')
+        except httpclient.HTTPError, e:
+            self.assertEqual(e.status, 429)
+            self.assertEqual(e.headers['retry-after'], '120')
+            self.assertEqual(e.url, self.base + '/throttled')
+        else:
+            self.fail("HTTPError not raised")
+        # the error response was read in full, so the connection is reused
+        self.client.get(self.base + '/ok')
+        self.assertEqual(self.server.requests[0][1], self.server.requests[1][1])
+    
+    def test_error(self):
+        self.assertRaises(httpclient.HTTPError, self.client.get, self.base + '/missing')
+    
+    def test_gzip(self):
+        response = self.client.get(self.base + '/gzip')
+        self.assertEqual(response.body, BODY)
+        self.assertEqual(response.headers['content-encoding'], 'gzip')
+    
+    def test_deflate(self):
+        self.assertEqual(httpclient._decode(zlib.compress(BODY), 'deflate'), BODY)
+        self.assertEqual(httpclient._decode(zlib.compress(BODY)[2:-4], 'deflate'), BODY)
+        self.assertEqual(httpclient._decode(BODY, None), BODY)
@@ -0,0 +1,108 @@
+# Copyright (c) 2008, Idan Gazit
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#     * Neither the name of the author nor the names of other
+#       contributors may be used to endorse or promote products derived
+#       from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+from django.test import TestCase
+from djangregator.models import OnlinePersona, TimelineEntry, DeliciousAccount, DeliciousLink, \
+    TwitterAccount, TwitterStatus
+from djangregator.signals import timeline_updated
+from djangregator.ingest import ingest
+from datetime import datetime, timedelta
+
+NOW = datetime(2008, 8, 27, 14, 0, 0)
+
+
+class IngestTests(TestCase):
+    """
+    Tests bulk ingestion of new activity.
+    """
+    def setUp(self):
+        self.persona = OnlinePersona.objects.create(name='ingest')
+        self.twitter = TwitterAccount.objects.create(persona=self.persona, username='ingest')
+        self.delicious = DeliciousAccount.objects.create(persona=self.persona, username='ingest')
+        self.signals = []
+        timeline_updated.connect(self.receiver)
+    
+    def tearDown(self):
+        timeline_updated.disconnect(self.receiver)
+    
+    def receiver(self, sender, personas, **kwargs):
+        self.signals.append((sender, personas))
+    
+    def tweets(self, ids):
+        return [{'twitter_id': i, 'title': u'Tweet %d' % i,
+                 'link': u'http://twitter.com/ingest/statuses/%d' % i,
+                 'published': NOW - timedelta(minutes=i)} for i in ids]
+    
+    def test_creates_activity_and_timeline_entries(self):
+        self.assertEqual(ingest(TwitterStatus, self.twitter, self.tweets(range(1, 6)),
+            key=('twitter_id',), batch_size=2), (5, 0))
+        self.assertEqual(TwitterStatus.objects.count(), 5)
+        # every entry points at the pk read back after the bulk insert
+        for status in TwitterStatus.objects.all():
+            entry = TimelineEntry.objects.get(object_id=status.pk)
+            self.assertEqual(entry.content_object, status)
+            self.assertEqual(entry.published, status.published)
+            self.assertEqual(entry.title, status.title)
+            self.assertEqual(entry.persona_id, self.persona.pk)
+            self.assertEqual(entry.service, u'twitter')
+        self.assertEqual(self.signals, [(TwitterStatus, [self.persona.pk])])
+    
+    def test_skips_existing_and_repeated_rows(self):
+        ingest(TwitterStatus, self.twitter, self.tweets([1, 2]), key=('twitter_id',))
+        self.signals = []
+        with self.assertNumQueries(4):
+            # one lookup, then an insert, a read-back and the timeline insert
+            result = ingest(TwitterStatus, self.twitter, self.tweets([1, 2, 3, 3]),
+                key=('twitter_id',))
+        self.assertEqual(result, (1, 3))
+        self.assertEqual(TwitterStatus.objects.count(), 3)
+        self.assertEqual(TimelineEntry.objects.count(), 3)
+        self.assertEqual(len(self.signals), 1)
+    
+    def test_nothing_new(self):
+        ingest(TwitterStatus, self.twitter, self.tweets([1, 2]), key=('twitter_id',))
+        self.signals = []
+        with self.assertNumQueries(1):
+            self.assertEqual(ingest(TwitterStatus, self.twitter, self.tweets([1, 2]),
+                key=('twitter_id',)), (0, 2))
+        self.assertEqual(self.signals, [])
+        self.assertEqual(ingest(TwitterStatus, self.twitter, [], key=('twitter_id',)), (0, 0))
+    
+    def test_composite_key_is_scoped_to_the_account(self):
+        other = DeliciousAccount.objects.create(persona=self.persona, username='other')
+        row = {'link': u'http://example.com/', 'published': NOW, 'title': u'Example',
+               'description': u''}
+        self.assertEqual(ingest(DeliciousLink, other, [dict(row)], key=('link', 'published')), (1, 0))
+        self.assertEqual(ingest(DeliciousLink, self.delicious, [dict(row)], key=('link', 'published')), (1, 0))
+        self.assertEqual(ingest(DeliciousLink, self.delicious, [dict(row)], key=('link', 'published')), (0, 1))
+        # the same link bookmarked again later is a new bookmark
+        row['published'] = NOW + timedelta(days=1)
+        self.assertEqual(ingest(DeliciousLink, self.delicious, [row], key=('link', 'published')), (1, 0))
+        self.assertEqual(DeliciousLink.objects.filter(account=self.delicious).count(), 2)
@@ -0,0 +1,124 @@
+# Copyright (c) 2008, Idan Gazit
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#     * Neither the name of the author nor the names of other
+#       contributors may be used to endorse or promote products derived
+#       from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+from django.test import TestCase
+from djangregator.models import OnlinePersona, TimelineEntry, TwitterAccount, TwitterStatus
+from djangregator import maintenance, timeline
+from datetime import datetime, timedelta
+
+
+class MaintenanceTests(TestCase):
+    """
+    Tests keeping the timeline in step with saves of activity entries.
+    """
+    def setUp(self):
+        self.persona = OnlinePersona.objects.create(name='maintenance')
+        self.account = TwitterAccount.objects.create(persona=self.persona, username='maintenance')
+        self.start = datetime(2008, 8, 27, 14, 0, 0)
+        self.flushes = []
+        self.invalidated = []
+        self.flush = maintenance.TimelineBatch.flush
+        self.invalidate = timeline.invalidate
+        flush = self.flush
+        flushes = self.flushes
+        def counting_flush(batch):
+            result = flush(batch)
+            flushes.append(result)
+            return result
+        maintenance.TimelineBatch.flush = counting_flush
+        timeline.invalidate = self.invalidated.append
+    
+    def tearDown(self):
+        maintenance.TimelineBatch.flush = self.flush
+        timeline.invalidate = self.invalidate
+    
+    def create(self, i, **kwargs):
+        return TwitterStatus.objects.create(account=self.account, twitter_id=i + 1,
+            title=u'Tweet %d' % i, published=self.start - timedelta(minutes=i), **kwargs)
+    
+    def test_immediate(self):
+        self.create(0)
+        self.create(1)
+        # without a batch every save is written, and expires the cache, by itself
+        self.assertEqual(self.flushes, [(1, 0, 0), (1, 0, 0)])
+        self.assertEqual(self.invalidated, [[self.persona.pk], [self.persona.pk]])
+        self.assertEqual(TimelineEntry.objects.count(), 2)
+    
+    def test_deferred_batch(self):
+        with maintenance.deferred() as batch:
+            statuses = [self.create(i) for i in range(5)]
+            # saving the same instance again only queues it once
+            statuses[0].title = u'Edited'
+            statuses[0].save()
+            with maintenance.deferred() as inner:
+                self.assertTrue(inner is batch)
+                self.create(5)
+            self.assertEqual(len(batch), 6)
+            self.assertEqual(TimelineEntry.objects.count(), 0)
+            self.assertEqual(self.flushes, [])
+        
+        self.assertEqual(self.flushes, [(6, 0, 0)])
+        self.assertEqual(self.invalidated, [[self.persona.pk]])
+        self.assertEqual(TimelineEntry.objects.get(object_id=statuses[0].pk).title, u'Edited')
+        self.assertEqual(maintenance.current_batch(), None)
+    
+    def test_deferred_updates(self):
+        statuses = [self.create(i) for i in range(3)]
+        self.flushes[:] = []
+        self.invalidated[:] = []
+        with maintenance.deferred():
+            for status in statuses:
+                status.save()
+            statuses[1].title = u'Edited'
+            statuses[1].save()
+        # unchanged entries are left alone
+        self.assertEqual(self.flushes, [(0, 1, 2)])
+        self.assertEqual(self.invalidated, [[self.persona.pk]])
+    
+    def test_empty_batch(self):
+        with maintenance.deferred():
+            pass
+        self.assertEqual(self.flushes, [(0, 0, 0)])
+        self.assertEqual(self.invalidated, [])
+    
+    def test_suspended(self):
+        with maintenance.suspended():
+            self.assertTrue(maintenance.is_suspended())
+            with maintenance.deferred() as batch:
+                self.create(0)
+                self.assertEqual(len(batch), 0)
+            self.create(1)
+        self.assertFalse(maintenance.is_suspended())
+        self.assertEqual(TimelineEntry.objects.count(), 0)
+        self.assertEqual(self.invalidated, [])
+        
+        # maintenance resumes once the block exits
+        self.create(2)
+        self.assertEqual(TimelineEntry.objects.count(), 1)
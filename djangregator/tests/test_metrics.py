@@ -0,0 +1,150 @@
+# Copyright (c) 2008, Idan Gazit
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#     * Neither the name of the author nor the names of other
+#       contributors may be used to endorse or promote products derived
+#       from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+from django.test import SimpleTestCase
+from django.utils import simplejson as json
+from djangregator import metrics
+import os
+import shutil
+import tempfile
+
+
+class Account(object):
+    service = u'twitter'
+    pk = 1
+    
+    def __unicode__(self):
+        return u'say "hi"\\now'
+
+
+def fetch_result():
+    result = metrics.FetchResult()
+    result.started = 1219845600.0
+    result.wall_time = 2.5
+    result.personas = 1
+    stats = metrics.AccountMetrics(Account())
+    stats.started = 1219845600.0
+    stats.wall_time = 2.0
+    stats.phases = {'network': 1.5, 'db': 0.25}
+    stats.http_requests = 3
+    stats.http_bytes = 1024
+    stats.queries = 7
+    stats.created = 5
+    stats.existing = 2
+    result.add(stats)
+    failed = metrics.AccountMetrics(Account())
+    failed.fail('boom')
+    result.add(failed)
+    return result
+
+
+class SinkTestCase(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'metrics')
+    
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+
+class JSONLinesSinkTests(SinkTestCase):
+    def test_appends_a_line_per_result(self):
+        sink = metrics.JSONLinesSink(self.path)
+        result = fetch_result()
+        sink.emit(result)
+        sink.emit(result)
+        lines = open(self.path).read().split('\n')
+        self.assertEqual(lines[2], '')
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(lines[0], lines[1])
+        
+        record = json.loads(lines[0])
+        self.assertEqual(record, result.as_dict())
+        self.assertEqual((record['succeeded'], record['failed'], record['created']), (1, 1, 5))
+        self.assertEqual(record['accounts'][0]['phases'], {'network': 1.5, 'db': 0.25})
+        self.assertEqual(record['accounts'][1]['error'], 'boom')
+
+
+class PrometheusTextfileSinkTests(SinkTestCase):
+    def test_format(self):
+        metrics.PrometheusTextfileSink(self.path).emit(fetch_result())
+        text = open(self.path).read().decode('utf-8')
+        lines = text.split('\n')
+        self.assertEqual(lines[-1], '')
+        self.assertEqual(lines[:3], [
+            '# HELP djangregator_fetch_last_run_timestamp_seconds Time the last fetch run started.',
+            '# TYPE djangregator_fetch_last_run_timestamp_seconds gauge',
+            'djangregator_fetch_last_run_timestamp_seconds 1219845600.0',
+        ])
+        # label values have their quotes, backslashes and newlines escaped
+        labels = 'service="twitter",account="say \\"hi\\"\\\\now"'
+        for line in ('djangregator_fetch_accounts{status="ok"} 1.0',
+                     'djangregator_fetch_accounts{status="failed"} 1.0',
+                     'djangregator_fetch_accounts{status="deferred"} 0.0',
+                     'djangregator_account_phase_seconds{%s,phase="db"} 0.25' % labels,
+                     'djangregator_account_phase_seconds{%s,phase="network"} 1.5' % labels,
+                     'djangregator_account_items{%s,status="created"} 5.0' % labels,
+                     'djangregator_account_http_requests{%s} 3.0' % labels,
+                     'djangregator_account_failed{%s} 1.0' % labels):
+            self.assertTrue(line in lines, line)
+        # every sample belongs to a declared metric
+        declared = set([line.split()[2] for line in lines if line.startswith('# TYPE')])
+        for line in lines:
+            if line and not line.startswith('#'):
+                self.assertTrue(line.split('{')[0].split()[0] in declared, line)
+    
+    def test_replaces_file_atomically(self):
+        sink = metrics.PrometheusTextfileSink(self.path)
+        sink.emit(fetch_result())
+        self.assertEqual(os.listdir(self.directory), ['metrics'])
+        self.assertEqual(os.stat(self.path).st_mode & 0777, 0644)
+        previous = open(self.path).read()
+        
+        # a result which can't be written leaves the previous file alone,
+        # and no temporary file behind
+        render = sink.render
+        def broken_render(result):
+            raise ValueError('cannot render')
+        sink.render = broken_render
+        self.assertRaises(ValueError, sink.emit, fetch_result())
+        self.assertEqual(os.listdir(self.directory), ['metrics'])
+        self.assertEqual(open(self.path).read(), previous)
+        
+        rename = os.rename
+        def broken_rename(src, dst):
+            raise OSError('cannot rename')
+        sink.render = render
+        os.rename = broken_rename
+        try:
+            self.assertRaises(OSError, sink.emit, fetch_result())
+        finally:
+            os.rename = rename
+        self.assertEqual(os.listdir(self.directory), ['metrics'])
+        self.assertEqual(open(self.path).read(), previous)
@@ -0,0 +1,92 @@
+# Copyright (c) 2008, Idan Gazit
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#     * Neither the name of the author nor the names of other
+#       contributors may be used to endorse or promote products derived
+#       from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+from django.contrib.contenttypes.models import ContentType
+from django.test import TestCase
+from djangregator.models import OnlinePersona, TimelineEntry, resolve_content_objects, \
+    DeliciousAccount, DeliciousLink, TwitterAccount, TwitterStatus
+from datetime import datetime, timedelta
+
+
+class ResolveContentObjectsTests(TestCase):
+    """
+    Tests resolving the content objects of timeline entries in bulk.
+    """
+    def setUp(self):
+        persona = OnlinePersona.objects.create(name='resolve')
+        twitter = TwitterAccount.objects.create(persona=persona, username='resolve')
+        delicious = DeliciousAccount.objects.create(persona=persona, username='resolve')
+        start = datetime(2008, 8, 27, 14, 0, 0)
+        self.objects = []
+        for i in range(3):
+            self.objects.append(TwitterStatus.objects.create(account=twitter,
+                twitter_id=i + 1, title=u'Tweet %d' % i,
+                published=start - timedelta(minutes=2 * i)))
+            self.objects.append(DeliciousLink.objects.create(account=delicious,
+                link=u'http://example.com/%d' % i, title=u'Link %d' % i,
+                published=start - timedelta(minutes=2 * i + 1)))
+        # an entry whose activity has gone away
+        self.orphan = TimelineEntry.objects.create(persona=persona, service='twitter',
+            content_type=ContentType.objects.get_for_model(TwitterStatus),
+            object_id=9999, published=start - timedelta(days=1))
+        # warm the content type cache, as a running site would have
+        for model in (TwitterStatus, DeliciousLink):
+            ContentType.objects.get_for_model(model)
+    
+    def test_mixed_content_types(self):
+        entries = resolve_content_objects(TimelineEntry.objects.exclude(pk=self.orphan.pk))
+        self.assertEqual(len(entries), 6)
+        self.assertEqual(sorted((type(entry.content_object), entry.content_object.pk) for entry in entries),
+            sorted((type(obj), obj.pk) for obj in self.objects))
+        for entry in entries:
+            self.assertEqual(entry.content_object.title, entry.title)
+    
+    def test_missing_target(self):
+        entries = dict((entry.pk, entry) for entry in TimelineEntry.objects.resolve())
+        self.assertEqual(len(entries), 7)
+        with self.assertNumQueries(0):
+            self.assertEqual(entries[self.orphan.pk].content_object, None)
+    
+    def test_query_count(self):
+        # one query for the entries and one per service
+        with self.assertNumQueries(3):
+            entries = TimelineEntry.objects.order_by('-published').resolve()
+            for entry in entries:
+                entry.content_object
+    
+    def test_queryset_resolve(self):
+        with self.assertNumQueries(2):
+            entries = TimelineEntry.objects.filter(service='delicious').resolve()
+            self.assertEqual([entry.content_object.title for entry in entries],
+                [u'Link 0', u'Link 1', u'Link 2'])
+    
+    def test_empty(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(TimelineEntry.objects.filter(service='flickr').resolve(), [])
@@ -0,0 +1,224 @@
+# Copyright (c) 2008, Idan Gazit
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#     * Neither the name of the author nor the names of other
+#       contributors may be used to endorse or promote products derived
+#       from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+from django.test import SimpleTestCase
+from django.test.utils import override_settings
+from djangregator import httpclient, ratelimit
+
+
+class FakeClock(object):
+    """
+    Stands in for the time module, with a clock which only moves when told
+    to or when slept on.
+    """
+    def __init__(self, now=1000000.0):
+        self.now = now
+        self.slept = []
+    
+    def time(self):
+        return self.now
+    
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+class ClockTestCase(SimpleTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.time = ratelimit.time
+        ratelimit.time = self.clock
+        ratelimit.reset()
+    
+    def tearDown(self):
+        ratelimit.time = self.time
+        ratelimit.reset()
+
+
+class TokenBucketTests(ClockTestCase):
+    def test_burst(self):
+        bucket = ratelimit.TokenBucket(rate=2, burst=3)
+        self.assertEqual([bucket.reserve() for i in range(3)], [0, 0, 0])
+        # the bucket is empty; tokens come back at two a second
+        self.assertEqual(bucket.reserve(), 0.5)
+        self.assertEqual(bucket.reserve(), 1.0)
+    
+    def test_refill(self):
+        bucket = ratelimit.TokenBucket(rate=1, burst=2)
+        bucket.reserve()
+        bucket.reserve()
+        self.clock.now += 1
+        self.assertEqual(bucket.reserve(), 0)
+        self.assertEqual(bucket.reserve(), 1.0)
+        # a long pause refills no more than the burst
+        self.clock.now += 60
+        self.assertEqual([bucket.reserve() for i in range(2)], [0, 0])
+        self.assertEqual(bucket.reserve(), 1.0)
+    
+    def test_acquire_sleeps(self):
+        bucket = ratelimit.TokenBucket(rate=1, burst=1)
+        self.assertEqual(bucket.acquire(), 0)
+        self.assertEqual(bucket.acquire(), 1.0)
+        self.assertEqual(self.clock.slept, [1.0])
+    
+    def test_hold(self):
+        bucket = ratelimit.TokenBucket(rate=10, burst=5)
+        bucket.hold(30)
+        self.assertEqual(bucket.reserve(), 30)
+        self.clock.now += 10
+        # a shorter hold doesn't cut the longer one short
+        bucket.hold(5)
+        self.assertEqual(bucket.reserve(), 20)
+        self.clock.now += 20
+        self.assertEqual(bucket.reserve(), 0)
+
+
+class CircuitBreakerTests(ClockTestCase):
+    def test_opens_after_consecutive_failures(self):
+        breaker = ratelimit.CircuitBreaker(threshold=3, cooldown=60)
+        breaker.failure()
+        breaker.failure()
+        self.assertTrue(breaker.allow())
+        breaker.success()
+        breaker.failure()
+        breaker.failure()
+        self.assertTrue(breaker.allow())
+        breaker.failure()
+        self.assertFalse(breaker.allow())
+        self.assertEqual(breaker.retry_after(), 60)
+        self.clock.now += 45
+        self.assertFalse(breaker.allow())
+        self.assertEqual(breaker.retry_after(), 15)
+    
+    def test_trial_after_cooldown(self):
+        breaker = ratelimit.CircuitBreaker(threshold=1, cooldown=60)
+        breaker.failure()
+        self.clock.now += 60
+        # one trial, and nothing else until it reports back
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.failure()
+        self.assertFalse(breaker.allow())
+        self.assertEqual(breaker.retry_after(), 60)
+        
+        self.clock.now += 60
+        self.assertTrue(breaker.allow())
+        breaker.success()
+        self.assertTrue(breaker.allow())
+        self.assertTrue(breaker.allow())
+        self.assertEqual(breaker.retry_after(), 0)
+
+
+class CallTests(ClockTestCase):
+    def throttled(self, headers=None):
+        return httpclient.HTTPError('http://example.com/', 429, 'Too Many Requests', headers)
+    
+    @override_settings(DJANGREGATOR_RATE_LIMITS={'test': {'retries': 2}})
+    def test_retries_after_the_delay_asked_for(self):
+        responses = [self.throttled({'retry-after': '20'}), 'ok']
+        def request():
+            response = responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return response
+        self.assertEqual(ratelimit.call('test', None, request), 'ok')
+        self.assertEqual(self.clock.slept, [20])
+    
+    def test_long_delays_are_not_slept(self):
+        calls = []
+        def request():
+            calls.append(self.clock.now)
+            raise self.throttled({'retry-after': '120'})
+        try:
+            ratelimit.call('test', None, request)
+        except ratelimit.RateLimited, e:
+            self.assertEqual(e.retry_after, 120)
+        else:
+            self.fail("RateLimited not raised")
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(self.clock.slept, [])
+        
+        # later requests with the same key give up without being made
+        self.assertRaises(ratelimit.RateLimited, ratelimit.call, 'test', None, request)
+        self.assertEqual(len(calls), 1)
+        # ...until the service's break is over
+        self.clock.now += 120
+        self.assertEqual(ratelimit.call('test', None, lambda: 'ok'), 'ok')
+        self.assertEqual(self.clock.slept, [])
+    
+    @override_settings(DJANGREGATOR_RATE_LIMITS={'test': {'retries': 2, 'max_backoff': 10}})
+    def test_gives_up(self):
+        calls = []
+        def request():
+            calls.append(self.clock.now)
+            raise self.throttled()
+        try:
+            ratelimit.call('test', None, request)
+        except ratelimit.RateLimited, e:
+            self.assertTrue(0 <= e.retry_after <= 10)
+        else:
+            self.fail("RateLimited not raised")
+        self.assertEqual(len(calls), 3)
+    
+    @override_settings(DJANGREGATOR_RATE_LIMITS={'test': {'retries': 0, 'max_backoff': 100, 'max_wait': 1000}})
+    def test_backoff_grows_across_calls(self):
+        ceilings = []
+        self.uniform = ratelimit.random.uniform
+        ratelimit.random.uniform = lambda low, high: high
+        try:
+            def request():
+                raise self.throttled()
+            for i in range(9):
+                try:
+                    ratelimit.call('test', None, request)
+                except ratelimit.RateLimited, e:
+                    ceilings.append(e.retry_after)
+                    self.clock.now += e.retry_after
+            self.assertEqual(ceilings, [1, 2, 4, 8, 16, 32, 64, 100, 100])
+            
+            # a request which gets through starts the backoff over
+            ratelimit.call('test', None, lambda: 'ok')
+            self.assertRaises(ratelimit.RateLimited, ratelimit.call, 'test', None, request)
+            self.assertEqual(ratelimit.bucket('test').held_for(), 1)
+        finally:
+            ratelimit.random.uniform = self.uniform
+    
+    def test_other_errors_are_raised(self):
+        def request():
+            raise httpclient.HTTPError('http://example.com/', 404, 'Not Found')
+        self.assertRaises(httpclient.HTTPError, ratelimit.call, 'test', None, request)
+    
+    def test_rate_limit_delay(self):
+        self.assertEqual(ratelimit.rate_limit_delay({'retry-after': '30'}), 30)
+        self.assertEqual(ratelimit.rate_limit_delay({
+            'x-ratelimit-remaining': '0',
+            'x-ratelimit-reset': str(int(self.clock.now) + 90)}), 90)
+        self.assertEqual(ratelimit.rate_limit_delay({'x-ratelimit-remaining': '5'}), None)
+        self.assertEqual(ratelimit.rate_limit_delay({}), None)
@@ -0,0 +1,104 @@
+# Copyright (c) 2008, Idan Gazit
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#     * Neither the name of the author nor the names of other
+#       contributors may be used to endorse or promote products derived
+#       from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from djangregator.models import OnlinePersona, TimelineEntry, TwitterAccount, TwitterStatus
+from datetime import datetime, timedelta
+from cStringIO import StringIO
+
+
+class RebuildTimelineTests(TestCase):
+    """
+    Tests the rebuild_timeline command's check and repair of the timeline.
+    """
+    def setUp(self):
+        persona = OnlinePersona.objects.create(name='rebuild')
+        self.account = TwitterAccount.objects.create(persona=persona, username='rebuild')
+        start = datetime(2008, 8, 27, 14, 0, 0)
+        self.statuses = [TwitterStatus.objects.create(account=self.account,
+            twitter_id=i + 1, title=u'Tweet %d' % i, published=start - timedelta(minutes=i))
+            for i in range(10)]
+    
+    def rebuild(self, **options):
+        options.setdefault('services', ['twitter'])
+        options.setdefault('chunk_size', 3)
+        call_command('rebuild_timeline', stdout=StringIO(), verbosity=0, **options)
+    
+    def assertTimelineMatches(self):
+        statuses = TwitterStatus.objects.values_list('pk', flat=True)
+        entries = TimelineEntry.objects.values_list('object_id', flat=True)
+        self.assertEqual(sorted(entries), sorted(statuses))
+    
+    def delete_raw(self, statuses):
+        # bypasses the signals which would delete their timeline entries
+        cursor = connection.cursor()
+        for status in statuses:
+            cursor.execute('DELETE FROM %s WHERE id = %%s' % TwitterStatus._meta.db_table,
+                [status.pk])
+    
+    def test_consistent(self):
+        self.rebuild()
+        self.assertEqual(TimelineEntry.objects.count(), 10)
+        self.assertTimelineMatches()
+    
+    def test_orphans(self):
+        # the first two, one inside the walk, and the last
+        self.delete_raw([self.statuses[i] for i in (0, 1, 5, 9)])
+        self.assertEqual(TimelineEntry.objects.count(), 10)
+        self.rebuild()
+        self.assertEqual(TimelineEntry.objects.count(), 6)
+        self.assertTimelineMatches()
+    
+    def test_orphans_between_chunks(self):
+        # with chunks of 3 the survivors are walked as (3, 4, 5), (7, 8, 9),
+        # leaving 6 in the gap between them
+        self.delete_raw([self.statuses[i] for i in (0, 1, 5)])
+        self.rebuild()
+        self.assertTimelineMatches()
+    
+    def test_missing_and_stale(self):
+        TimelineEntry.objects.filter(object_id=self.statuses[2].pk).delete()
+        TimelineEntry.objects.filter(object_id=self.statuses[4].pk).update(title=u'Stale')
+        self.rebuild()
+        self.assertTimelineMatches()
+        self.assertEqual(TimelineEntry.objects.get(object_id=self.statuses[4].pk).title, u'Tweet 4')
+    
+    def test_moved_to_another_persona(self):
+        persona = OnlinePersona.objects.create(name='moved')
+        TwitterAccount.objects.filter(pk=self.account.pk).update(persona=persona)
+        self.rebuild()
+        self.assertEqual(TimelineEntry.objects.filter(persona=persona).count(), 10)
+    
+    def test_dry_run(self):
+        self.delete_raw(self.statuses[:2])
+        self.rebuild(dry_run=True)
+        self.assertEqual(TimelineEntry.objects.count(), 10)
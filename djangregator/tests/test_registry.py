@@ -0,0 +1,85 @@
+# Copyright (c) 2008, Idan Gazit
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#     * Neither the name of the author nor the names of other
+#       contributors may be used to endorse or promote products derived
+#       from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+from django.test import SimpleTestCase
+from django.test.utils import override_settings
+from djangregator.models import TwitterAccount, TwitterStatus
+from djangregator import registry
+
+
+def fetch_example(account):
+    return (0, 0)
+
+
+class RegistryTests(SimpleTestCase):
+    def setUp(self):
+        self.saved = (registry._loaded, list(registry._services), dict(registry._by_name))
+    
+    def tearDown(self):
+        registry._loaded, registry._services[:], by_name = self.saved
+        registry._by_name.clear()
+        registry._by_name.update(by_name)
+    
+    def test_builtin_services(self):
+        self.assertEqual([service.name for service in registry.services()][:3],
+            ['twitter', 'delicious', 'flickr'])
+        service = registry.get('twitter')
+        self.assertEqual(service.account_model, TwitterAccount)
+        self.assertEqual(service.activity_model, TwitterStatus)
+        self.assertEqual(service.account_relation, 'twitter_accounts')
+        self.assertRaises(KeyError, registry.get, 'myspace')
+    
+    def test_register(self):
+        registry.register('example', TwitterAccount, TwitterStatus,
+            'djangregator.tests.test_registry.fetch_example')
+        service = registry.get('example')
+        self.assertEqual(registry.services()[-1], service)
+        # dotted paths are only imported when the fetch is asked for
+        self.assertEqual(service._fetch, 'djangregator.tests.test_registry.fetch_example')
+        self.assertEqual(service.fetch, fetch_example)
+    
+    def test_register_again_replaces(self):
+        registry.register('example', TwitterAccount, TwitterStatus, fetch_example)
+        registry.register('example', TwitterAccount, TwitterStatus, len)
+        names = [service.name for service in registry.services()]
+        self.assertEqual(names.count('example'), 1)
+        self.assertEqual(registry.get('example').fetch, len)
+    
+    @override_settings(DJANGREGATOR_SERVICES=('djangregator.tests.no_such_module',))
+    def test_failed_load_is_retried(self):
+        registry._loaded = False
+        self.assertRaises(ImportError, registry.services)
+        # the registry isn't left marked as loaded
+        self.assertFalse(registry._loaded)
+        self.assertRaises(ImportError, registry.get, 'twitter')
+        
+        with self.settings(DJANGREGATOR_SERVICES=()):
+            self.assertEqual(registry.get('twitter').name, 'twitter')
+        self.assertTrue(registry._loaded)
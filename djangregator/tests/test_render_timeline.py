@@ -0,0 +1,119 @@
+# Copyright (c) 2008, Idan Gazit
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#     * Neither the name of the author nor the names of other
+#       contributors may be used to endorse or promote products derived
+#       from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+from django import template
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.test import TestCase
+from djangregator.models import OnlinePersona, TimelineEntry, \
+    DeliciousAccount, DeliciousLink, TwitterAccount, TwitterStatus
+from djangregator.templatetags import djangregator_filters
+from datetime import datetime, timedelta
+
+
+class EntryTemplateTests(TestCase):
+    def test_service_template(self):
+        for service in ('twitter', 'delicious', 'flickr'):
+            self.assertEqual(djangregator_filters.entry_template(service).name,
+                'djangregator/timeline/%s.html' % service)
+    
+    def test_fallback(self):
+        self.assertEqual(djangregator_filters.entry_template('myspace').name,
+            'djangregator/timeline/entry.html')
+    
+    def test_compiled_once(self):
+        self.assertTrue(djangregator_filters.entry_template('twitter') is
+            djangregator_filters.entry_template('twitter'))
+
+
+class RenderTimelineTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.persona = OnlinePersona.objects.create(name='render')
+        twitter = TwitterAccount.objects.create(persona=self.persona, username='render')
+        delicious = DeliciousAccount.objects.create(persona=self.persona, username='render')
+        start = datetime(2008, 8, 27, 14, 0, 0)
+        for i in range(3):
+            TwitterStatus.objects.create(account=twitter, twitter_id=i + 1,
+                title=u'@friend %d' % i, link=u'http://twitter.com/render/%d' % (i + 1),
+                published=start - timedelta(minutes=2 * i))
+            DeliciousLink.objects.create(account=delicious, link=u'http://example.com/%d' % i,
+                title=u'Link %d' % i, description=u'About <%d>' % i,
+                published=start - timedelta(minutes=2 * i + 1))
+        # an entry from a service without a template of its own
+        TimelineEntry.objects.create(persona=self.persona, service='myspace',
+            content_type=ContentType.objects.get_for_model(TwitterStatus), object_id=9999,
+            title=u'Elsewhere', link=u'http://example.com/elsewhere',
+            published=start - timedelta(days=1))
+        # warm the content type cache, as a running site would have
+        for model in (TwitterStatus, DeliciousLink):
+            ContentType.objects.get_for_model(model)
+    
+    def render(self, source=u'{% render_timeline persona %}', **context):
+        context.setdefault('persona', self.persona)
+        return template.Template(u'{% load djangregator_filters %}' + source).render(
+            template.Context(context))
+    
+    def test_entry_templates(self):
+        html = self.render()
+        self.assertTrue(html.startswith(u'<ol class="timeline"><li class="timeline-entry twitter">'))
+        self.assertEqual(html.count(u'<li class="timeline-entry twitter">'), 3)
+        self.assertEqual(html.count(u'<li class="timeline-entry delicious">'), 3)
+        self.assertEqual(html.count(u'<li class="timeline-entry myspace">'), 1)
+        # each with its service object
+        self.assertTrue(u'@<a class="tweetreply" href="http://twitter.com/friend">friend</a> 0' in html)
+        self.assertTrue(u'<span class="description">About &lt;1&gt;</span>' in html)
+        self.assertTrue(u'<a href="http://example.com/elsewhere">Elsewhere</a>' in html)
+    
+    def test_limit_and_services(self):
+        html = self.render(u'{% render_timeline persona limit=2 services="delicious, myspace" %}')
+        self.assertEqual(html.count(u'<li'), 2)
+        self.assertEqual(html.count(u'<li class="timeline-entry delicious">'), 2)
+    
+    def test_queries(self):
+        # the entries, then one query per service
+        with self.assertNumQueries(3):
+            html = self.render()
+        # and from then on the cached list
+        with self.assertNumQueries(0):
+            self.assertEqual(self.render(), html)
+        TwitterStatus.objects.filter(twitter_id=1).update(title=u'Changed')
+        TimelineEntry.objects.filter(title=u'@friend 0').update(title=u'Changed')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.render(), html)
+    
+    def test_expires_when_timeline_changes(self):
+        html = self.render()
+        TwitterStatus.objects.create(account=TwitterAccount.objects.get(), twitter_id=100,
+            title=u'Newest', published=datetime(2008, 8, 28, 14, 0, 0))
+        changed = self.render()
+        self.assertNotEqual(changed, html)
+        self.assertTrue(changed.startswith(u'<ol class="timeline"><li class="timeline-entry twitter">'
+            u'<span class="tweet">Newest</span>'))
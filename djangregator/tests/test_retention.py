@@ -0,0 +1,126 @@
+# Copyright (c) 2008, Idan Gazit
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#     * Neither the name of the author nor the names of other
+#       contributors may be used to endorse or promote products derived
+#       from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils import simplejson as json
+from djangregator.models import OnlinePersona, TimelineEntry, TwitterAccount, TwitterStatus
+from djangregator import retention
+from datetime import datetime, timedelta
+import gzip
+import itertools
+import os
+import shutil
+import tempfile
+
+NOW = datetime(2008, 8, 27, 14, 0, 0)
+
+
+class RetentionTests(TestCase):
+    """
+    Tests retention cutoffs and the removal and archiving of old activity.
+    """
+    def setUp(self):
+        persona = OnlinePersona.objects.create(name='retention')
+        self.account = TwitterAccount.objects.create(persona=persona, username='retention')
+        self.other = TwitterAccount.objects.create(persona=persona, username='other')
+        self.twitter_ids = itertools.count(1)
+    
+    def tweet(self, account, days_ago):
+        twitter_id = self.twitter_ids.next()
+        return TwitterStatus.objects.create(account=account, twitter_id=twitter_id,
+            title=u'Tweet %d' % twitter_id, published=NOW - timedelta(days=days_ago))
+    
+    def cutoff(self, **policy):
+        return retention.cutoff(TwitterStatus, self.account, policy, NOW)
+    
+    def test_no_policy(self):
+        self.tweet(self.account, 1)
+        self.assertEqual(self.cutoff(), None)
+    
+    def test_days(self):
+        self.assertEqual(self.cutoff(days=30), NOW - timedelta(days=30))
+    
+    def test_items(self):
+        for days_ago in range(5):
+            self.tweet(self.account, days_ago)
+        # other accounts' activity doesn't count
+        for days_ago in range(5):
+            self.tweet(self.other, days_ago + 10)
+        self.assertEqual(self.cutoff(items=3), NOW - timedelta(days=2))
+        self.assertEqual(self.cutoff(items=4), NOW - timedelta(days=3))
+        self.assertEqual(self.cutoff(items=5), None)
+        self.assertEqual(self.cutoff(items=10), None)
+    
+    def test_items_tied_at_the_boundary(self):
+        for days_ago in (0, 1, 2, 2, 3):
+            self.tweet(self.account, days_ago)
+        # the fourth item was published at the same time as the third
+        before = self.cutoff(items=3)
+        self.assertEqual(before, NOW - timedelta(days=2))
+        kept = TwitterStatus.objects.filter(account=self.account, published__gte=before)
+        self.assertEqual(kept.count(), 4)
+    
+    def test_days_and_items(self):
+        for days_ago in range(10):
+            self.tweet(self.account, days_ago)
+        # whichever keeps less wins
+        self.assertEqual(self.cutoff(days=7, items=3), NOW - timedelta(days=2))
+        self.assertEqual(self.cutoff(days=2, items=5), NOW - timedelta(days=2))
+    
+    @override_settings(DJANGREGATOR_RETENTION={'twitter': {'items': 2}})
+    def test_apply_policy(self):
+        tweets = [self.tweet(self.account, days_ago) for days_ago in range(5)]
+        self.tweet(self.other, 0)
+        
+        self.assertEqual(retention.apply_policy(dry_run=True), {'twitter': 3})
+        self.assertEqual(TwitterStatus.objects.count(), 6)
+        
+        archive_dir = tempfile.mkdtemp()
+        try:
+            removed = retention.apply_policy(archive_dir=archive_dir, chunk_size=2)
+            self.assertEqual(removed, {'twitter': 3})
+            names = os.listdir(archive_dir)
+            self.assertEqual(len(names), 1)
+            f = gzip.open(os.path.join(archive_dir, names[0]))
+            try:
+                archived = [json.loads(line) for line in f]
+            finally:
+                f.close()
+        finally:
+            shutil.rmtree(archive_dir)
+        
+        self.assertEqual(sorted([record['pk'] for record in archived]),
+            sorted([tweet.pk for tweet in tweets[2:]]))
+        self.assertEqual(archived[0]['model'], 'djangregator.twitterstatus')
+        remaining = TwitterStatus.objects.filter(account=self.account)
+        self.assertEqual(sorted(remaining.values_list('pk', flat=True)),
+            sorted([tweet.pk for tweet in tweets[:2]]))
+        self.assertEqual(TimelineEntry.objects.count(), 3)
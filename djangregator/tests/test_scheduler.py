@@ -0,0 +1,192 @@
+# Copyright (c) 2008, Idan Gazit
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#     * Neither the name of the author nor the names of other
+#       contributors may be used to endorse or promote products derived
+#       from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+from django.test import SimpleTestCase
+from django.test.utils import override_settings
+from djangregator.tests.test_ratelimit import FakeClock
+from djangregator import metrics, scheduler
+
+
+class Account(object):
+    def __init__(self, service, pk):
+        self.service = service
+        self.pk = pk
+    
+    def __unicode__(self):
+        return u'%s%d' % (self.service, self.pk)
+
+
+class SchedulerTestCase(SimpleTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.time = scheduler.time
+        scheduler.time = self.clock
+        self.scheduler = scheduler.Scheduler()
+    
+    def tearDown(self):
+        scheduler.time = self.time
+    
+    def add(self, account, when=None):
+        key = (account.service, account.pk)
+        self.scheduler._jobs[key] = (None, account)
+        self.scheduler._scheduled.add(key)
+        self.scheduler._queue.append((self.clock.now if when is None else when, key))
+        scheduler.heapq.heapify(self.scheduler._queue)
+    
+    def stats(self, account, created=0, requests=1, failed=False, deferred=False):
+        stats = metrics.AccountMetrics(account)
+        stats.created = created
+        stats.http_requests = requests
+        stats.failed = failed
+        stats.deferred = deferred
+        return stats
+
+
+class ScheduleOptionsTests(SimpleTestCase):
+    def test_budget_from_rate_limit(self):
+        self.assertEqual(scheduler.schedule_options('twitter')['requests_per_hour'], 70)
+        with self.settings(DJANGREGATOR_RATE_LIMITS={'twitter': {'requests_per_hour': 150}}):
+            self.assertEqual(scheduler.schedule_options('twitter')['requests_per_hour'], 150)
+        with self.settings(DJANGREGATOR_SCHEDULE={'twitter': {'requests_per_hour': 30}}):
+            self.assertEqual(scheduler.schedule_options('twitter')['requests_per_hour'], 30)
+
+
+@override_settings(DJANGREGATOR_SCHEDULE={'twitter': {'interval': 800, 'min_interval': 300, 'max_interval': 2000}})
+class RescheduleTests(SchedulerTestCase):
+    def next_fetch(self, account, **kwargs):
+        self.scheduler.reschedule(account, self.stats(account, **kwargs))
+        when, key = scheduler.heapq.heappop(self.scheduler._queue)
+        self.assertEqual(key, ('twitter', account.pk))
+        return when - self.clock.now
+    
+    def test_new_activity_halves_interval(self):
+        account = Account('twitter', 1)
+        self.assertEqual(self.next_fetch(account, created=3), 400)
+        # but never below min_interval
+        self.assertEqual(self.next_fetch(account, created=1), 300)
+    
+    def test_no_activity_doubles_interval(self):
+        account = Account('twitter', 1)
+        self.assertEqual(self.next_fetch(account), 1600)
+        # but never above max_interval
+        self.assertEqual(self.next_fetch(account), 2000)
+        self.assertEqual(self.next_fetch(account, created=1, failed=True), 2000)
+    
+    def test_deferred_keeps_interval(self):
+        account = Account('twitter', 1)
+        self.assertEqual(self.next_fetch(account, deferred=True), 300)
+        self.assertEqual(self.next_fetch(account, created=1), 400)
+
+
+class DueTests(SchedulerTestCase):
+    def test_due_in_order(self):
+        now = self.clock.now
+        for pk, offset in ((1, 30), (2, -10), (3, 0), (4, -20), (5, 10)):
+            self.add(Account('delicious', pk), now + offset)
+        # delicious allows a request a second
+        due = []
+        for second in range(4):
+            due.extend([account.pk for persona, account in self.scheduler.due(now + second)])
+        self.assertEqual(due, [4, 2, 3])
+        self.assertEqual([key[1] for when, key in sorted(self.scheduler._queue)], [5, 1])
+    
+    def test_removed_accounts_are_dropped(self):
+        self.add(Account('delicious', 1))
+        del self.scheduler._jobs[('delicious', 1)]
+        self.assertEqual(self.scheduler.due(self.clock.now), [])
+        self.assertEqual(self.scheduler._queue, [])
+    
+    def test_budget_is_charged_per_request(self):
+        # twitter allows 70 requests an hour
+        spacing = 3600.0 / 70
+        first, second = Account('twitter', 1), Account('twitter', 2)
+        self.add(first)
+        self.add(second)
+        now = self.clock.now
+        self.assertEqual(self.scheduler.due(now), [(None, first)])
+        # the second account waits for the budget of the first one's request
+        self.assertEqual(self.scheduler._queue, [(now + spacing, ('twitter', 2))])
+        
+        # the first fetch turns out to have made five requests
+        self.scheduler.reschedule(first, self.stats(first, requests=5))
+        self.assertEqual(self.scheduler._next_request['twitter'], now + 5 * spacing)
+        self.assertEqual(self.scheduler.due(now + spacing), [])
+        self.assertEqual(self.scheduler.due(now + 5 * spacing), [(None, second)])
+
+
+class RunTests(SchedulerTestCase):
+    def setUp(self):
+        SchedulerTestCase.setUp(self)
+        self.saved = dict((name, getattr(scheduler, name)) for name in
+            ('execute', 'load_backends', 'apply_retention', 'emit', 'close_connection', 'signal'))
+        self.closed = 0
+        self.rounds = 0
+        scheduler.load_backends = lambda: None
+        scheduler.apply_retention = lambda accounts: None
+        scheduler.emit = lambda result, sinks: None
+        scheduler.close_connection = self.close_connection
+        scheduler.execute = self.execute
+        scheduler.signal = self
+        self.scheduler.refresh = self.refresh
+    
+    def tearDown(self):
+        for name, value in self.saved.items():
+            setattr(scheduler, name, value)
+        SchedulerTestCase.tearDown(self)
+    
+    # stands in for the signal module
+    SIGINT = SIGTERM = None
+    def signal(self, signum, handler):
+        pass
+    
+    def close_connection(self):
+        self.closed += 1
+    
+    def refresh(self):
+        self.scheduler._next_refresh = self.clock.now + 3600
+        if not self.scheduler._jobs:
+            self.add(Account('delicious', 1))
+    
+    def execute(self, jobs, workers, timeout):
+        self.rounds += 1
+        if self.rounds == 1:
+            raise ValueError('the database went away')
+        self.scheduler.stop()
+        for persona, account in jobs:
+            yield persona, account, self.stats(account, created=1)
+    
+    def test_failed_round_is_retried(self):
+        self.scheduler.run()
+        self.assertEqual(self.rounds, 2)
+        self.assertEqual(self.closed, 2)
+        # the account was put back after the failed round, fetched again
+        # ERROR_DELAY later, and then rescheduled as usual
+        self.assertEqual(self.clock.now, 1000000.0 + scheduler.ERROR_DELAY)
+        self.assertEqual(self.scheduler._queue, [(self.clock.now + 450, ('delicious', 1))])
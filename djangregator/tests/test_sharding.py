@@ -0,0 +1,170 @@
+# Copyright (c) 2008, Idan Gazit
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#     * Neither the name of the author nor the names of other
+#       contributors may be used to endorse or promote products derived
+#       from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import IntegrityError
+from django.test import TestCase
+from django.utils import timezone
+from django.utils.importlib import import_module
+from djangregator.models import OnlinePersona, SyncState, TwitterAccount
+from djangregator.sharding import LeaseQueue, in_shard, parse_shard
+from datetime import timedelta
+import threading
+
+# djangregator.fetch is shadowed by the fetch() function on the package
+fetching = import_module('djangregator.fetch')
+
+
+class ShardTests(TestCase):
+    def test_parse_shard(self):
+        self.assertEqual(parse_shard('1/4'), (1, 4))
+        self.assertRaises(ValueError, parse_shard, '4/4')
+        self.assertRaises(ValueError, parse_shard, 'one/4')
+    
+    def test_every_account_in_one_shard(self):
+        persona = OnlinePersona.objects.create(name='shards')
+        for i in range(20):
+            account = TwitterAccount.objects.create(persona=persona, username='shard%d' % i)
+            shards = [index for index in range(3) if in_shard(account, index, 3)]
+            self.assertEqual(len(shards), 1)
+
+
+class LeaseQueueTests(TestCase):
+    def setUp(self):
+        persona = OnlinePersona.objects.create(name='leases')
+        self.accounts = [TwitterAccount.objects.create(persona=persona, username='lease%d' % i)
+            for i in range(3)]
+        self.content_type = ContentType.objects.get_for_model(TwitterAccount)
+    
+    def state(self, account):
+        return SyncState.objects.get(content_type=self.content_type, object_id=account.pk)
+    
+    def test_claim(self):
+        queue = LeaseQueue(60, owner='one')
+        queue.prepare(self.accounts)
+        self.assertEqual(SyncState.objects.count(), 3)
+        self.assertTrue(queue.claim(self.accounts[0]))
+        state = self.state(self.accounts[0])
+        self.assertEqual(state.leased_by, 'one')
+        self.assertTrue(state.leased_until > timezone.now())
+    
+    def test_held_lease(self):
+        one = LeaseQueue(60, owner='one')
+        two = LeaseQueue(60, owner='two')
+        self.assertTrue(one.claim(self.accounts[0]))
+        self.assertFalse(two.claim(self.accounts[0]))
+        # not even the holder can claim it twice
+        self.assertFalse(one.claim(self.accounts[0]))
+        self.assertTrue(two.claim(self.accounts[1]))
+        self.assertEqual(self.state(self.accounts[0]).leased_by, 'one')
+    
+    def test_expired_lease(self):
+        one = LeaseQueue(60, owner='one')
+        two = LeaseQueue(60, owner='two')
+        self.assertTrue(one.claim(self.accounts[0]))
+        SyncState.objects.filter(leased_by='one').update(
+            leased_until=timezone.now() - timedelta(seconds=1))
+        self.assertTrue(two.claim(self.accounts[0]))
+        self.assertEqual(self.state(self.accounts[0]).leased_by, 'two')
+    
+    def test_release(self):
+        one = LeaseQueue(60, owner='one')
+        two = LeaseQueue(60, owner='two')
+        self.assertTrue(one.claim(self.accounts[0]))
+        # only the holder can release a lease
+        two.release(self.accounts[0])
+        self.assertFalse(two.claim(self.accounts[0]))
+        one.release(self.accounts[0])
+        self.assertTrue(two.claim(self.accounts[0]))
+    
+    def test_prepare_after_a_partial_race(self):
+        # another process creates the state of the second account while
+        # this one is inserting all three
+        bulk_create = SyncState.objects.bulk_create
+        def racing(objs, *args, **kwargs):
+            SyncState.objects.create(content_type=self.content_type,
+                object_id=self.accounts[1].pk)
+            raise IntegrityError("columns content_type_id, object_id are not unique")
+        SyncState.objects.bulk_create = racing
+        try:
+            queue = LeaseQueue(60, owner='one')
+            queue.prepare(self.accounts)
+        finally:
+            SyncState.objects.bulk_create = bulk_create
+        self.assertEqual(SyncState.objects.count(), 3)
+        for account in self.accounts:
+            self.assertTrue(queue.claim(account))
+
+
+class ExecuteTests(TestCase):
+    def setUp(self):
+        self.persona = OnlinePersona.objects.create(name='execute')
+        self.accounts = [TwitterAccount.objects.create(persona=self.persona, username='execute%d' % i)
+            for i in range(4)]
+        self.fetch_account = fetching.fetch_account
+        fetching.fetch_account = self.stub_fetch_account
+    
+    def tearDown(self):
+        fetching.fetch_account = self.fetch_account
+    
+    def stub_fetch_account(self, account, persona=None, timeout=None):
+        if account == self.accounts[3]:
+            raise RuntimeError("broken")
+        return 'fetched'
+    
+    def claim(self, account):
+        if account == self.accounts[0]:
+            raise RuntimeError("database is locked")
+        return account != self.accounts[1]
+    
+    def execute(self, workers):
+        jobs = [(self.persona, account) for account in self.accounts]
+        results = []
+        thread = threading.Thread(target=lambda: results.extend(
+            fetching.execute(jobs, workers, claim=self.claim)))
+        thread.setDaemon(True)
+        thread.start()
+        thread.join(10)
+        self.assertFalse(thread.isAlive(), "execute() did not yield a result for every job")
+        return dict([(account.username, stats) for persona, account, stats in results])
+    
+    def check(self, results):
+        self.assertEqual(len(results), 4)
+        self.assertEqual(results['execute0'], None)
+        self.assertEqual(results['execute1'], None)
+        self.assertEqual(results['execute2'], 'fetched')
+        self.assertTrue(results['execute3'].failed)
+        self.assertTrue('broken' in results['execute3'].error)
+    
+    def test_serial(self):
+        self.check(self.execute(1))
+    
+    def test_workers(self):
+        self.check(self.execute(3))
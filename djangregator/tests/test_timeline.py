@@ -0,0 +1,108 @@
+# Copyright (c) 2008, Idan Gazit
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#     * Neither the name of the author nor the names of other
+#       contributors may be used to endorse or promote products derived
+#       from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+from django.contrib.contenttypes.models import ContentType
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils import timezone
+from djangregator.models import OnlinePersona, TimelineEntry, TwitterStatus
+from djangregator import timeline
+from datetime import datetime, timedelta
+
+
+class TimelinePagingTests(TestCase):
+    """
+    Tests keyset paging through timeline.get_page().
+    """
+    def create_entries(self, count, start):
+        persona = OnlinePersona.objects.create(name='paging')
+        content_type = ContentType.objects.get_for_model(TwitterStatus)
+        ids = []
+        for i in range(count):
+            # pairs of entries share a publication time, so that paging
+            # has to break ties on the id
+            entry = TimelineEntry.objects.create(content_type=content_type,
+                object_id=i + 1, persona=persona, service='twitter',
+                published=start - timedelta(minutes=i // 2))
+            ids.append(entry.pk)
+        return persona, ids
+    
+    def walk(self, persona, limit, **kwargs):
+        """
+        Returns the ids of the entries on every page, in order. Fails if
+        the pages don't come to an end.
+        """
+        seen = []
+        cursor = None
+        for i in range(100):
+            page = timeline.get_page(persona, cursor=cursor, limit=limit, **kwargs)
+            seen.extend([entry.pk for entry in page])
+            if not page.has_next:
+                return seen
+            cursor = page.next_cursor
+        self.fail("Paging did not end after 100 pages")
+    
+    def expected(self, ids):
+        entries = TimelineEntry.objects.filter(pk__in=ids).order_by('-published', '-id')
+        return list(entries.values_list('pk', flat=True))
+    
+    def test_pages(self):
+        persona, ids = self.create_entries(20, datetime(2008, 8, 27, 14, 0, 0))
+        seen = self.walk(persona, 5, use_cache=False)
+        self.assertEqual(len(seen), 20)
+        self.assertEqual(seen, self.expected(ids))
+        self.assertEqual(self.walk(None, 7, use_cache=False), seen)
+    
+    def test_cached_pages(self):
+        persona, ids = self.create_entries(12, datetime(2008, 8, 27, 14, 0, 0))
+        first = self.walk(persona, 5)
+        self.assertEqual(self.walk(persona, 5), first)
+        self.assertEqual(first, self.expected(ids))
+    
+    def test_empty(self):
+        page = timeline.get_page(use_cache=False)
+        self.assertEqual(len(page), 0)
+        self.assertFalse(page.has_next)
+    
+    @override_settings(USE_TZ=True)
+    def test_pages_with_time_zones(self):
+        # TIME_ZONE is not UTC in the test settings
+        start = timezone.make_aware(datetime(2008, 8, 27, 14, 0, 0), timezone.utc)
+        persona, ids = self.create_entries(20, start)
+        seen = self.walk(persona, 5, use_cache=False)
+        self.assertEqual(len(seen), 20)
+        self.assertEqual(len(set(seen)), 20)
+        self.assertEqual(seen, self.expected(ids))
+    
+    def test_cursor_round_trip(self):
+        entry = TimelineEntry(pk=42, published=datetime(2008, 8, 27, 14, 0, 0, 123456))
+        self.assertEqual(timeline.decode_cursor(timeline.encode_cursor(entry)),
+            (entry.published, 42))
+        self.assertRaises(ValueError, timeline.decode_cursor, 'garbage')
@@ -0,0 +1,102 @@
+# Copyright (c) 2008, Idan Gazit
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#     * Neither the name of the author nor the names of other
+#       contributors may be used to endorse or promote products derived
+#       from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+from django.test import SimpleTestCase
+from django.test.utils import override_settings
+from django.utils import timezone
+from djangregator import metrics, timestamps
+from datetime import datetime
+
+
+class ParseTests(SimpleTestCase):
+    """
+    Tests parsing timestamps; the test settings put the default time zone
+    in Chicago, five hours behind UTC in the summer.
+    """
+    def tearDown(self):
+        # Django keeps the default time zone around, even when TIME_ZONE
+        # changes
+        timezone._localtime = None
+    
+    def time_zone(self, name):
+        timezone._localtime = None
+        return self.settings(TIME_ZONE=name)
+    
+    def utc(self, *args):
+        return timezone.make_aware(datetime(*args), timezone.utc)
+    
+    def test_formats(self):
+        self.assertEqual(timestamps.parse('Wed Aug 27 13:08:45 +0000 2008', 'twitter'),
+            datetime(2008, 8, 27, 8, 8, 45))
+        self.assertEqual(timestamps.parse('2009-03-31T18:42:38Z', 'iso8601'),
+            datetime(2009, 3, 31, 13, 42, 38))
+        self.assertEqual(timestamps.parse('2009-03-31T20:42:38+02:00', 'iso8601'),
+            datetime(2009, 3, 31, 13, 42, 38))
+        self.assertEqual(timestamps.parse('1219842525', 'unix'), datetime(2008, 8, 27, 8, 8, 45))
+        self.assertEqual(timestamps.parse('2008-05-11 14:31:20', 'local'),
+            datetime(2008, 5, 11, 14, 31, 20))
+    
+    @override_settings(USE_TZ=True)
+    def test_formats_with_time_zones(self):
+        self.assertEqual(timestamps.parse('Wed Aug 27 13:08:45 +0000 2008', 'twitter'),
+            self.utc(2008, 8, 27, 13, 8, 45))
+        self.assertEqual(timestamps.parse('1219842525', 'unix'), self.utc(2008, 8, 27, 13, 8, 45))
+        self.assertEqual(timestamps.parse('2008-05-11 14:31:20', 'local'),
+            self.utc(2008, 5, 11, 19, 31, 20))
+    
+    def test_memoized_per_time_zone_settings(self):
+        value = '2009-03-31T18:42:38Z'
+        self.assertEqual(timestamps.parse(value, 'iso8601'), datetime(2009, 3, 31, 13, 42, 38))
+        with self.settings(USE_TZ=True):
+            self.assertEqual(timestamps.parse(value, 'iso8601'), self.utc(2009, 3, 31, 18, 42, 38))
+        with self.time_zone('Europe/London'):
+            self.assertEqual(timestamps.parse(value, 'iso8601'), datetime(2009, 3, 31, 19, 42, 38))
+            self.assertEqual(timestamps.parse('2008-05-11 14:31:20', 'local'),
+                datetime(2008, 5, 11, 14, 31, 20))
+            with self.settings(USE_TZ=True):
+                self.assertEqual(timestamps.parse('2008-05-11 14:31:20', 'local'),
+                    self.utc(2008, 5, 11, 13, 31, 20))
+        timezone._localtime = None
+        self.assertEqual(timestamps.parse(value, 'iso8601'), datetime(2009, 3, 31, 13, 42, 38))
+    
+    def test_failure(self):
+        stats = metrics.AccountMetrics(type('Account', (object,), {'service': 'twitter', 'pk': 1})())
+        metrics.activate(stats)
+        try:
+            self.assertRaises(timestamps.TimestampError, timestamps.parse, 'yesterday', 'twitter')
+            self.assertRaises(timestamps.TimestampError, timestamps.parse, 'yesterday', 'twitter')
+        finally:
+            metrics.deactivate()
+        # failures aren't memoized, so each is counted
+        self.assertEqual(stats.parse_failures, 2)
+    
+    def test_to_unix(self):
+        self.assertEqual(timestamps.to_unix(datetime(2008, 8, 27, 8, 8, 45)), 1219842525)
+        self.assertEqual(timestamps.to_unix(self.utc(2008, 8, 27, 13, 8, 45)), 1219842525)
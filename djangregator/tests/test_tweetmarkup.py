@@ -0,0 +1,119 @@
+# Copyright (c) 2008, Idan Gazit
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#     * Neither the name of the author nor the names of other
+#       contributors may be used to endorse or promote products derived
+#       from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+from django import template
+from django.test import SimpleTestCase
+from django.utils.safestring import mark_safe, SafeData
+from djangregator.models import TwitterStatus
+from djangregator import tweetmarkup
+
+
+def mention(user):
+    return u'@<a class="tweetreply" href="http://twitter.com/%s">%s</a>' % (user, user)
+
+
+def hashtag(tag):
+    return u'<a class="tweethashtag" href="http://twitter.com/search?q=%%23%s">#%s</a>' % (tag, tag)
+
+
+def url(href, text=None):
+    return u'<a class="tweetlink" href="%s" rel="nofollow">%s</a>' % (href, text or href)
+
+
+class RenderTests(SimpleTestCase):
+    def test_mentions(self):
+        self.assertEqual(tweetmarkup.render(u'@yes XXX @yes:yyy XXX @yes: yyy thank you @yes.'),
+            u'%s XXX %s:yyy XXX %s: yyy thank you %s.' % ((mention('yes'),) * 4))
+        self.assertEqual(tweetmarkup.render(u'foo:@yes @yes,@yes; (@yes)'),
+            u'foo:%s %s,%s; (%s)' % ((mention('yes'),) * 4))
+        self.assertEqual(tweetmarkup.render(u'@yes15characters'), mention('yes15characters'))
+        # too long, email addresses and domains
+        for text in (u'@notoomanycharacters', u'foo@no.net', u'asdas@no.com', u'@no.com', u'@no.c'):
+            self.assertEqual(tweetmarkup.render(text), text)
+    
+    def test_hashtags(self):
+        self.assertEqual(tweetmarkup.render(u'#tag, (#paren) #a1'),
+            u'%s, (%s) %s' % (hashtag('tag'), hashtag('paren'), hashtag('a1')))
+        # all digits, or inside a word
+        for text in (u'#123', u'issue#tag'):
+            self.assertEqual(tweetmarkup.render(text), text)
+        self.assertEqual(tweetmarkup.render(u'#caf\xe9'),
+            u'<a class="tweethashtag" href="http://twitter.com/search?q=%23caf%C3%A9">#caf\xe9</a>')
+    
+    def test_urls(self):
+        self.assertEqual(tweetmarkup.render(u'see http://example.com/path. ok'),
+            u'see %s. ok' % url('http://example.com/path'))
+        self.assertEqual(tweetmarkup.render(u'(https://example.com/a_(b))!'),
+            u'(%s))!' % url('https://example.com/a_(b'))
+        self.assertEqual(tweetmarkup.render(u'ftp://example.com'), u'ftp://example.com')
+    
+    def test_overlaps(self):
+        # mentions and hashtags inside a URL are part of the URL
+        self.assertEqual(tweetmarkup.render(u'http://example.com/#tag http://example.com/@user'),
+            u'%s %s' % (url('http://example.com/#tag'), url('http://example.com/@user')))
+        self.assertEqual(tweetmarkup.render(u'@a #b http://c.com/@a#b @a'),
+            u'%s %s %s %s' % (mention('a'), hashtag('b'), url('http://c.com/@a#b'), mention('a')))
+    
+    def test_escaping(self):
+        html = tweetmarkup.render(u'<b>bold</b> & @x http://example.com/?a=1&b="2"')
+        self.assertTrue(isinstance(html, SafeData))
+        self.assertEqual(html, u'&lt;b&gt;bold&lt;/b&gt; &amp; %s %s&quot;2&quot;' % (
+            mention('x'), url('http://example.com/?a=1&amp;b=')))
+        # text which is already safe, or with autoescaping off, is left alone
+        self.assertEqual(tweetmarkup.render(mark_safe(u'<i> @x</i>')), u'<i> %s</i>' % mention('x'))
+        self.assertEqual(tweetmarkup.render(u'<i> #x</i>', autoescape=False), u'<i> %s</i>' % hashtag('x'))
+        # a mention or hashtag may not follow markup
+        self.assertEqual(tweetmarkup.render(u'<@x>'), u'&lt;@x&gt;')
+    
+    def test_memoized(self):
+        self.assertTrue(tweetmarkup.render(u'@memo #ized') is tweetmarkup.render(u'@memo #ized'))
+        self.assertNotEqual(tweetmarkup.render(u'<@memo>'), tweetmarkup.render(u'<@memo>', autoescape=False))
+
+
+class TweetifyTests(SimpleTestCase):
+    def render(self, source, **context):
+        return template.Template(u'{% load djangregator_filters %}' + source).render(
+            template.Context(context))
+    
+    def test_filter(self):
+        self.assertEqual(self.render(u'{{ text|tweetify }}', text=u'<b> @x #y http://z.com/'),
+            u'&lt;b&gt; %s %s %s' % (mention('x'), hashtag('y'), url('http://z.com/')))
+    
+    def test_autoescape_off(self):
+        self.assertEqual(self.render(u'{% autoescape off %}{{ text|tweetify }}{% endautoescape %}',
+            text=u'<b> @x</b>'), u'<b> %s</b>' % mention('x'))
+    
+    def test_status(self):
+        status = TwitterStatus(title=u'<3 @x')
+        self.assertEqual(self.render(u'{{ status|tweetify }}', status=status),
+            u'&lt;3 %s' % mention('x'))
+        # a pre-rendered copy is used as is
+        status.html = u'<p>pre-rendered</p>'
+        self.assertEqual(self.render(u'{{ status|tweetify }}', status=status), u'<p>pre-rendered</p>')
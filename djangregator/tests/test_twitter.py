@@ -0,0 +1,152 @@
+# Copyright (c) 2008, Idan Gazit
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#     * Neither the name of the author nor the names of other
+#       contributors may be used to endorse or promote products derived
+#       from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils import unittest
+from djangregator.models import OnlinePersona, TwitterAccount, TwitterStatus, SyncState
+from djangregator import ratelimit
+from datetime import datetime, timedelta
+
+try:
+    from djangregator.services import twitter
+except ImportError:
+    twitter = None
+
+
+class Status(object):
+    def __init__(self, id, created_at, text):
+        self.id = id
+        self.created_at = created_at
+        self.text = text
+
+
+class StubApi(object):
+    """
+    Serves a user timeline of ``count`` tweets with ids counting up from 101,
+    newest first, the way GetUserTimeline pages through it. Raises ``error``
+    for any page reaching below ``fail_below``.
+    """
+    def __init__(self, count, start):
+        self.statuses = [Status(100 + count - i, (start - timedelta(minutes=i)).strftime(
+            '%a %b %d %H:%M:%S +0000 %Y'), u'Tweet %d' % (100 + count - i)) for i in range(count)]
+        self.requests = []
+        self.fail_below = None
+        self.error = ValueError('Twitter is having a moment')
+    
+    def GetUserTimeline(self, user, count, since_id=None, max_id=None):
+        self.requests.append({'since_id': since_id, 'max_id': max_id})
+        statuses = [status for status in self.statuses
+            if (since_id is None or status.id > since_id) and (max_id is None or status.id <= max_id)]
+        page = statuses[:count]
+        if self.fail_below is not None and page and page[-1].id < self.fail_below:
+            raise self.error
+        return page
+
+
+@unittest.skipIf(twitter is None, 'twitterapi is not installed')
+@override_settings(DJANGREGATOR_PAGING={'twitter': {'page_size': 2, 'max_pages': 2}},
+    DJANGREGATOR_RATE_LIMITS={'twitter': {'requests_per_hour': 3600000, 'burst': 1000}})
+class TwitterFetchTests(TestCase):
+    """
+    Tests fetching and backfilling a Twitter timeline, with the API client
+    stubbed out.
+    """
+    def setUp(self):
+        persona = OnlinePersona.objects.create(name='twitter')
+        self.account = TwitterAccount.objects.create(persona=persona, username='twitter')
+        self.api = StubApi(7, datetime(2008, 8, 27, 14, 0, 0))
+        self.clients = twitter.clients
+        twitter.clients = twitter.ClientPool(lambda key: self.api)
+        ratelimit.reset()
+    
+    def tearDown(self):
+        twitter.clients = self.clients
+        ratelimit.reset()
+    
+    def state(self):
+        return SyncState.objects.for_account(self.account)
+    
+    def stored(self):
+        return sorted(TwitterStatus.objects.values_list('twitter_id', flat=True))
+    
+    def test_backfill_resumes(self):
+        self.assertEqual(twitter.fetch(self.account), (4, 0))
+        self.assertEqual(self.stored(), [104, 105, 106, 107])
+        state = self.state()
+        self.assertEqual(state.backfill_cursor, 103)
+        self.assertEqual(state.last_id, 107)
+        
+        # the catch-up page finds nothing new, and the backfill carries on
+        # from where it stopped
+        self.api.requests = []
+        self.assertEqual(twitter.fetch(self.account), (2, 0))
+        self.assertEqual(self.api.requests, [{'since_id': 107, 'max_id': None},
+            {'since_id': None, 'max_id': 103}])
+        self.assertEqual(self.stored(), range(102, 108))
+        self.assertEqual(self.state().backfill_cursor, 101)
+    
+    def test_end_of_history(self):
+        with self.settings(DJANGREGATOR_PAGING={'twitter': {'page_size': 2, 'max_pages': None}}):
+            self.assertEqual(twitter.fetch(self.account), (7, 0))
+        self.assertEqual(self.stored(), range(101, 108))
+        state = self.state()
+        self.assertEqual(state.backfill_cursor, None)
+        self.assertNotEqual(state.last_success, None)
+        
+        # once the backfill is done only new tweets are asked for
+        self.api.requests = []
+        twitter.fetch(self.account)
+        self.assertEqual(self.api.requests, [{'since_id': 107, 'max_id': None}])
+    
+    def test_failure_midway(self):
+        self.api.fail_below = 106
+        self.assertRaises(ValueError, twitter.fetch, self.account)
+        # the first page was checkpointed, but the fetch didn't succeed
+        self.assertEqual(self.stored(), [106, 107])
+        state = self.state()
+        self.assertEqual(state.backfill_cursor, 105)
+        self.assertEqual(state.last_success, None)
+        
+        self.api.fail_below = None
+        self.api.requests = []
+        self.assertEqual(twitter.fetch(self.account), (2, 0))
+        self.assertEqual(self.api.requests, [{'since_id': 107, 'max_id': None},
+            {'since_id': None, 'max_id': 105}])
+        self.assertEqual(self.stored(), range(104, 108))
+    
+    @override_settings(DJANGREGATOR_RETENTION={'twitter': {'items': 3}})
+    def test_backfill_stops_at_the_retention_policy(self):
+        with self.settings(DJANGREGATOR_PAGING={'twitter': {'page_size': 2, 'max_pages': None}}):
+            self.assertEqual(twitter.fetch(self.account), (4, 0))
+        # the third page is older than the three newest tweets kept
+        self.assertEqual(len(self.api.requests), 3)
+        self.assertEqual(self.stored(), [104, 105, 106, 107])
+        self.assertEqual(self.state().backfill_cursor, None)
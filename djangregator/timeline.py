@@ -0,0 +1,169 @@
+# Copyright (c) 2008, Idan Gazit
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#     * Neither the name of the author nor the names of other
+#       contributors may be used to endorse or promote products derived
+#       from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Reading the aggregated timeline.
+
+get_page() returns one page of a timeline -- of a single persona or of
+everyone, optionally limited to some services -- using keyset pagination on
+(published, id), so that deep pages cost the same as the first one. Pages are
+cached with Django's cache framework. Every persona's cached pages carry a
+generation number which is bumped whenever that persona's timeline changes,
+which makes all of its stale pages unreachable at once.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils import timezone
+from djangregator.models import TimelineEntry
+from datetime import datetime
+import time
+
+DEFAULT_LIMIT = 50
+CURSOR_FORMAT = '%Y%m%d%H%M%S%f'
+GENERATION_TIMEOUT = 60 * 60 * 24 * 30
+
+
+class TimelinePage(object):
+    """
+    One page of a timeline. ``next_cursor`` is passed back to get_page() to
+    fetch the following page, and is None on the last page.
+    """
+    def __init__(self, entries, next_cursor=None):
+        self.entries = entries
+        self.next_cursor = next_cursor
+    
+    def __iter__(self):
+        return iter(self.entries)
+    
+    def __len__(self):
+        return len(self.entries)
+    
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+
+def encode_cursor(entry):
+    """
+    Returns the cursor of the page following ``entry``. Times are encoded
+    in UTC when they are time zone aware.
+    """
+    published = entry.published
+    if timezone.is_aware(published):
+        published = published.astimezone(timezone.utc)
+    return '%s_%d' % (published.strftime(CURSOR_FORMAT), entry.pk)
+
+
+def decode_cursor(cursor):
+    """
+    Returns the (published, id) pair encoded in a cursor. Raises ValueError
+    if the cursor is malformed.
+    """
+    published, pk = cursor.split('_', 1)
+    published = datetime.strptime(published, CURSOR_FORMAT)
+    if settings.USE_TZ:
+        published = timezone.make_aware(published, timezone.utc)
+    return (published, int(pk))
+
+
+def _generation_key(persona_id):
+    return 'djangregator:timeline:generation:%s' % (persona_id or 'all')
+
+
+def generation(persona_id):
+    """
+    Returns the current generation number of a persona's timeline (or of
+    the combined timeline, for None). It changes whenever the timeline does.
+    """
+    key = _generation_key(persona_id)
+    value = cache.get(key)
+    if value is None:
+        # Seeding from the clock rather than from zero means that a
+        # generation which fell out of the cache never comes back around.
+        value = int(time.time() * 1000)
+        cache.add(key, value, GENERATION_TIMEOUT)
+        value = cache.get(key, value)
+    return value
+
+
+def invalidate(persona_ids):
+    """
+    Expires the cached pages of the given personas' timelines, along with
+    those of the combined timeline.
+    """
+    for persona_id in set(list(persona_ids) + [None]):
+        key = _generation_key(persona_id)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, int(time.time() * 1000), GENERATION_TIMEOUT)
+
+
+def get_page(persona=None, services=None, cursor=None, limit=DEFAULT_LIMIT, use_cache=True):
+    """
+    Returns a TimelinePage holding up to ``limit`` timeline entries, newest
+    first.
+    
+    ``persona`` limits the page to a single persona's timeline (it may be
+    an OnlinePersona or its id), and ``services`` to a sequence of service
+    names. ``cursor`` is the next_cursor of the previous page.
+    """
+    persona_id = getattr(persona, 'pk', persona)
+    services = services and sorted(services) or None
+    
+    if use_cache:
+        key = 'djangregator:timeline:%s:%s:%s:%s:%d' % (
+            persona_id or 'all', generation(persona_id),
+            services and ','.join(services) or 'all', cursor or 'first', limit)
+        page = cache.get(key)
+        if page is not None:
+            return page
+    
+    entries = TimelineEntry.objects.order_by('-published', '-id')
+    if persona_id:
+        entries = entries.filter(persona=persona_id)
+    if services:
+        entries = entries.filter(service__in=services)
+    if cursor:
+        published, pk = decode_cursor(cursor)
+        entries = entries.filter(Q(published__lt=published) | Q(published=published, id__lt=pk))
+    
+    entries = list(entries[:limit + 1])
+    next_cursor = None
+    if len(entries) > limit:
+        entries = entries[:limit]
+        next_cursor = encode_cursor(entries[-1])
+    page = TimelinePage(entries, next_cursor)
+    
+    if use_cache:
+        cache.set(key, page, getattr(settings, 'DJANGREGATOR_TIMELINE_CACHE_TIMEOUT', 3600))
+    return page
@@ -0,0 +1,174 @@
+# Copyright (c) 2008, Idan Gazit
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#     * Neither the name of the author nor the names of other
+#       contributors may be used to endorse or promote products derived
+#       from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Parsing of the timestamps found in service feeds.
+
+Each service writes its timestamps in one known format, so parse() first
+tries a fixed-format parser for it, and only falls back to dateutil's
+general-purpose parser (when it is installed) for anything unexpected.
+Results are converted to what the database expects: aware datetimes in UTC
+when USE_TZ is on, naive datetimes in the default time zone otherwise.
+Parsed values are memoized, since the same timestamps turn up again on every
+fetch of an unchanged feed.
+
+Timestamps which cannot be parsed at all raise TimestampError, and are
+counted in the parse_failures of the active fetch's metrics.
+"""
+
+from django.conf import settings
+from django.utils import timezone
+from djangregator.lrucache import LRUCache
+from djangregator import metrics
+from datetime import datetime, timedelta
+import calendar
+import re
+
+try:
+    import dateutil.parser
+except ImportError:
+    dateutil = None
+
+CACHE_SIZE = 10000
+
+MONTHS = dict([(name, i + 1) for i, name in enumerate(
+    ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'))])
+
+ISO8601 = re.compile(r'^(\d{4})-(\d\d)-(\d\d)[T ](\d\d):(\d\d):(\d\d)(?:\.\d+)?'
+                     r'(Z|[+-]\d\d:?\d\d)?$')
+
+
+class TimestampError(ValueError):
+    pass
+
+
+def _offset(value):
+    """
+    Returns the timedelta described by a UTC offset such as '+0200',
+    '-05:00' or 'Z'.
+    """
+    if value in ('Z', '+0000', '+00:00'):
+        return timedelta(0)
+    sign = value[0] == '-' and -1 or 1
+    value = value[1:].replace(':', '')
+    return sign * timedelta(hours=int(value[:2]), minutes=int(value[2:]))
+
+
+def _twitter(value):
+    # Wed Aug 27 13:08:45 +0000 2008
+    weekday, month, day, time, offset, year = value.split()
+    hour, minute, second = time.split(':')
+    parsed = datetime(int(year), MONTHS[month], int(day), int(hour), int(minute), int(second))
+    return (parsed - _offset(offset)).replace(tzinfo=timezone.utc)
+
+
+def _iso8601(value):
+    # 2009-03-31T18:42:38Z, or without the zone for local wall-clock times
+    match = ISO8601.match(value)
+    if match is None:
+        raise ValueError(value)
+    parsed = datetime(*[int(part) for part in match.groups()[:6]])
+    if match.group(7) is None:
+        return parsed
+    return (parsed - _offset(match.group(7))).replace(tzinfo=timezone.utc)
+
+
+def _unix(value):
+    # seconds since the epoch
+    return (datetime(1970, 1, 1) + timedelta(seconds=int(value))).replace(tzinfo=timezone.utc)
+
+
+FORMATS = {
+    'twitter': _twitter,
+    'iso8601': _iso8601,
+    'unix': _unix,
+    'local': _iso8601,
+}
+
+_cache = LRUCache(CACHE_SIZE)
+
+
+def parse(value, format=None):
+    """
+    Parses a timestamp written in one of the FORMATS, ready for saving:
+    
+    * 'twitter': Twitter's created_at, e.g. 'Wed Aug 27 13:08:45 +0000 2008'
+    * 'iso8601': e.g. '2009-03-31T18:42:38Z'; times without a zone are UTC
+    * 'unix': seconds since the epoch
+    * 'local': e.g. '2008-05-11 14:31:20', a wall-clock time without a zone
+      which is taken to be in the default time zone
+    
+    Raises TimestampError if the value can't be parsed.
+    """
+    # what a value parses to depends on the time zone settings
+    key = (format, value, settings.USE_TZ, timezone.get_default_timezone())
+    parsed = _cache.get(key)
+    if parsed is None:
+        parsed = _parse(value, format)
+        _cache.set(key, parsed)
+    return parsed
+
+
+def _parse(value, format):
+    parsed = None
+    try:
+        parsed = FORMATS[format](value)
+    except (KeyError, ValueError, TypeError, OverflowError):
+        pass
+    if parsed is None and dateutil is not None:
+        try:
+            parsed = dateutil.parser.parse(value)
+        except (ValueError, TypeError, OverflowError, AttributeError):
+            pass
+    if parsed is None:
+        metrics.record_parse_failure()
+        raise TimestampError("Unable to parse timestamp %r" % (value,))
+    
+    default = timezone.get_default_timezone()
+    if timezone.is_naive(parsed):
+        if format != 'local':
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        elif settings.USE_TZ:
+            return timezone.make_aware(parsed, default)
+        else:
+            return parsed
+    if settings.USE_TZ:
+        return parsed.astimezone(timezone.utc)
+    return timezone.make_naive(parsed, default)
+
+
+def to_unix(value):
+    """
+    Returns the number of seconds since the epoch of a datetime as saved by
+    djangregator, naive datetimes being in the default time zone.
+    """
+    if timezone.is_naive(value):
+        value = timezone.make_aware(value, timezone.get_default_timezone())
+    return calendar.timegm(value.utctimetuple())
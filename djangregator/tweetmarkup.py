@@ -0,0 +1,100 @@
+# Copyright (c) 2008, Idan Gazit
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+# 
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#     * Neither the name of the author nor the names of other
+#       contributors may be used to endorse or promote products derived
+#       from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Turns the plain text of a tweet into HTML, linking @mentions, #hashtags and
+bare URLs.
+
+All three are found by a single regular expression in one pass over the
+text, and every stretch of text between them is escaped exactly once. The
+rendered HTML is memoized in a bounded LRU cache, since the same tweets tend
+to be rendered over and over again.
+"""
+
+from django.utils.html import escape
+from django.utils.http import urlquote
+from django.utils.safestring import mark_safe, SafeData
+from djangregator.lrucache import LRUCache
+import re
+
+CACHE_SIZE = 2048
+
+# mentions and hashtags may only follow the start of the text, whitespace or
+# some punctuation, which rules out email addresses and the like.
+LINKIFY_PATTERN = r'''
+    (?P<url>
+        https?://[^\s<>"]*[^\s<>".,;:!?)\]']    # don't swallow trailing punctuation
+    )
+    | (?: ^ | (?<=[\s.,:;'"(]) )
+    (?:
+        @(?P<user>\w{1,15})(?!\.?\w)            # 1-15 chars, not an email domain
+        | \#(?P<tag>\w*[^\W\d]\w*)              # at least one non-digit
+    )'''
+
+linkify_regex = re.compile(LINKIFY_PATTERN, re.VERBOSE | re.UNICODE)
+
+MENTION = u'@<a class="tweetreply" href="http://twitter.com/%s">%s</a>'
+HASHTAG = u'<a class="tweethashtag" href="http://twitter.com/search?q=%%23%s">#%s</a>'
+URL = u'<a class="tweetlink" href="%s" rel="nofollow">%s</a>'
+
+
+_cache = LRUCache(CACHE_SIZE)
+
+
+def _linkify(text, esc):
+    pieces = []
+    pos = 0
+    for match in linkify_regex.finditer(text):
+        pieces.append(esc(text[pos:match.start()]))
+        url, user, tag = match.group('url', 'user', 'tag')
+        if url:
+            pieces.append(URL % (esc(url), esc(url)))
+        elif user:
+            pieces.append(MENTION % (user, user))
+        else:
+            pieces.append(HASHTAG % (urlquote(tag), esc(tag)))
+        pos = match.end()
+    pieces.append(esc(text[pos:]))
+    return u''.join(pieces)
+
+
+def render(text, autoescape=True):
+    """
+    Returns the tweet ``text`` as safe HTML with its @mentions, #hashtags
+    and URLs linked. The text is escaped first when ``autoescape`` is on,
+    unless it is already marked safe.
+    """
+    escape_text = bool(autoescape) and not isinstance(text, SafeData)
+    key = (unicode(text), escape_text)
+    html = _cache.get(key)
+    if html is None:
+        html = mark_safe(_linkify(key[0], escape_text and escape or (lambda x: x)))
+        _cache.set(key, html)
+    return html
@@ -33,7 +33,8 @@
 
 """
 This script can be used as a cron script to trigger periodic fetching of new
-activity from the various online services configured in your project.
+activity from the various online services configured in your project, or run
+with --daemon as a long-running process which schedules fetches itself.
 """
 
 
@@ -57,8 +58,54 @@ parser.add_option("-p", "--projectpath",
                   default=CURRENT_PATH,
                   metavar="PATH"
                   )
+parser.add_option("-w", "--workers",
+                  dest="workers",
+                  type="int",
+                  help="Number of accounts to fetch concurrently [default: %default]",
+                  default=1,
+                  metavar="N")
+parser.add_option("-t", "--timeout",
+                  dest="timeout",
+                  type="float",
+                  help="Give up on an account after this many seconds [default: no timeout]",
+                  default=None,
+                  metavar="SECONDS")
+parser.add_option("--metrics-jsonl",
+                  dest="metrics_jsonl",
+                  help="Append fetch metrics as JSON lines to this file",
+                  default=None,
+                  metavar="FILE")
+parser.add_option("--metrics-prom",
+                  dest="metrics_prom",
+                  help="Write fetch metrics to this Prometheus textfile",
+                  default=None,
+                  metavar="FILE")
+parser.add_option("-d", "--daemon",
+                  dest="daemon",
+                  action="store_true",
+                  help="Keep running, fetching each account whenever it falls due",
+                  default=False)
+parser.add_option("-r", "--refresh",
+                  dest="refresh",
+                  type="int",
+                  help="In daemon mode, reload the list of accounts this often [default: %default]",
+                  default=300,
+                  metavar="SECONDS")
+parser.add_option("-s", "--shard",
+                  dest="shard",
+                  help="Only fetch this shard of the accounts, given as INDEX/COUNT, e.g. 0/4",
+                  default=None,
+                  metavar="INDEX/COUNT")
+parser.add_option("--lease",
+                  dest="lease",
+                  type="int",
+                  help="Lease each account in the database before fetching it, for this many seconds, so that processes running side by side split the accounts between them",
+                  default=None,
+                  metavar="SECONDS")
 
 (options, args) = parser.parse_args()
+if options.lease and options.daemon:
+    parser.error("--lease can't be used with --daemon; use --shard instead")
 
 logging.basicConfig(
     level=logging.getLevelName(options.loglevel),
@@ -95,4 +142,24 @@ try:
 except ImportError:
     logger.critical("Unable to import Djangregator, aborting.")
 else:
-    djangregator.fetch()
\ No newline at end of file
+    from djangregator import metrics, sharding
+    shard = None
+    if options.shard:
+        try:
+            shard = sharding.parse_shard(options.shard)
+        except ValueError, e:
+            parser.error(str(e))
+    
+    sinks = metrics.configured_sinks()
+    if options.metrics_jsonl:
+        sinks.append(metrics.JSONLinesSink(options.metrics_jsonl))
+    if options.metrics_prom:
+        sinks.append(metrics.PrometheusTextfileSink(options.metrics_prom))
+    
+    if options.daemon:
+        from djangregator import scheduler
+        scheduler.run(workers=options.workers, timeout=options.timeout,
+            refresh=options.refresh, sinks=sinks, shard=shard)
+    else:
+        djangregator.fetch(workers=options.workers, timeout=options.timeout,
+            sinks=sinks, shard=shard, lease=options.lease)
\ No newline at end of file